@@ -21,7 +21,8 @@ import '@maicol07/material-web-additions/data-table/data-table-cell.js';
 
 interface Call {
     meta: {
-        total: number
+        total: number,
+        next: string | null // cursor of the next page
     }
     data: [{
         "ts": string, // "2024-02-25T22:31:18.525725+01:00",
@@ -42,17 +43,19 @@ export class TrafficTable extends LitElement {
     @state() accessor filter: Record<string, string> = {};
     @state() accessor page_size = 10;
     //@state() accessor page = 0;
+    @state() accessor cursors: string[] = []; // meta.next of each page before the current one
     @state() accessor row_position = 0;
     @state() accessor refresh = 0;
 
     private intervalHandle?: NodeJS.Timeout;
 
     private _hystoryTask = new Task(this, {
-        task: async ([token, sort, filter, page = 0, page_size = 25], { signal }) => {
+        task: async ([token, sort, filter, cursor, page_size = 25], { signal }) => {
             if (!this.checkVisibility()) {
                 return {
                     meta: {
-                        total: 0
+                        total: 0,
+                        next: null
                     },
                     data: []
                 }
@@ -62,14 +65,31 @@ export class TrafficTable extends LitElement {
                 //filter: JSON.stringify(filter),
                 //offset: "" + (page_size as number) * (page as number),
                 //limit: "" + page_size
+                limit: "" + page_size,
+                ...(cursor ? { cursor: cursor as string } : {})
             }), { signal, headers: { Authorization: `Bearer ${token}` } });
             if (!response.ok) {
                 throw new Error("API Response:" + response.status);
             }
             return response.json() as unknown as Call
-        }, args: () => [this.token, this.sort, this.filter, /*this.page,*/ this.page_size, this.refresh]
+        }, args: () => [this.token, this.sort, this.filter, this.cursors[this.cursors.length - 1], this.page_size, this.refresh]
     })
 
+    private _nextPage() {
+        const next = this._hystoryTask.value?.meta.next;
+        if (next) {
+            this.cursors = [...this.cursors, next];
+            this.row_position += this.page_size;
+        }
+    }
+
+    private _previousPage() {
+        if (this.cursors.length) {
+            this.cursors = this.cursors.slice(0, -1);
+            this.row_position -= this.page_size;
+        }
+    }
+
     /*
     private _handlePageChanged(event: CustomEvent) {
         this.page = event.detail.page;
@@ -79,10 +99,14 @@ export class TrafficTable extends LitElement {
 
     private _sortChanged(event: CustomEvent) {
         this.sort = event.detail.value;
+        this.cursors = []; // the cursors belong to the old sort/filter
+        this.row_position = 0;
         console.log(event);
     }
 
     private _filterChanged(event: CustomEvent) {
+        this.cursors = []; // the cursors belong to the old sort/filter
+        this.row_position = 0;
         //this.filter[event.detail.property] = event.detail.value;
         //this.requestUpdate();
         if (event.detail.value) {
@@ -146,6 +170,8 @@ export class TrafficTable extends LitElement {
 
                 <md-data-table-footer slot="footer" style="display: flex; align-items: center; justify-content: right; gap: 4px;">
                     Actions:
+                    <md-text-button ?disabled="${!this.cursors.length}" @click="${this._previousPage}">Previous</md-text-button>
+                    <md-text-button ?disabled="${!this._hystoryTask.value?.meta.next}" @click="${this._nextPage}">Next</md-text-button>
                     <md-text-button @click="${() => this.refresh++}">Refresh</md-text-button>
                     <!--
                     <md-text-button>Action 2</md-text-button>
@@ -1,11 +1,182 @@
 import logging
+import os
+import time
+from contextlib import contextmanager
 
 from numpy import byte
-from databaseConnection import DatabaseType, DatabaseConnection
+from databaseConnection import (
+    DB_QUERY_TIMEOUT,
+    DB_READ_POOL_SIZE,
+    DB_STREAM_BATCH,
+    DB_BACKEND,
+    ConnectionPool,
+    DatabaseType,
+)
+from databaseWriter import DB_WRITE_BEHIND, DatabaseWriter
+from metrics import COLLECTOR, DB_INSERT_SECONDS
+from profiling import PHASE_STATS
+from scheduler import Scheduler
+from migrations import BASE_VERSION, LATEST_VERSION, MigrationRunner
+from deadband import TEMP_HEARTBEAT
+from rollups import RESOLUTIONS, RollupAccumulator
+from partitions import PARTITIONED, Partitions
+from fulltext import MatchQuery, RowMatcher
+from export import EXPORTS
+from downsample import Lttb
+from resultcache import RESULT_CACHE_SETTLE, ResultCache
+from ringBuffer import DB_MEMORY_FLUSH, RINGS, MemoryStore
+from dedup import UNKNOWN, UpsertSql, UpsertValues, Unzip
+from pagination import (
+    CALL_GROUP_SORT,
+    CALL_SORT,
+    CountCache,
+    KeysetClause,
+    NextCursor,
+    OrderBy,
+    SortKeys,
+    SortRows,
+)
 from datetime import datetime, timezone, timedelta
+from operator import itemgetter
 
 logger = logging.getLogger(__name__)
 
+#
+# SQLite tuning (addon options db_*)
+#
+DB_JOURNAL_MODE = os.getenv("BESIM_DB_JOURNAL_MODE", "wal")
+DB_SYNCHRONOUS = os.getenv("BESIM_DB_SYNCHRONOUS", "normal")
+DB_CACHE_SIZE = int(os.getenv("BESIM_DB_CACHE_SIZE", "8192"))  # KiB per connection
+DB_MMAP_SIZE = int(os.getenv("BESIM_DB_MMAP_SIZE", "32"))  # MiB, 0 = no mmap
+DB_TEMP_STORE = os.getenv("BESIM_DB_TEMP_STORE", "memory")
+DB_BUSY_TIMEOUT = int(os.getenv("BESIM_DB_BUSY_TIMEOUT", "5000"))  # ms
+DB_RETENTION_DAYS = int(os.getenv("BESIM_DB_RETENTION_DAYS", "0"))  # 0 = keep all
+DB_MAINTENANCE_INTERVAL = int(
+    os.getenv("BESIM_DB_MAINTENANCE_INTERVAL", "3600")
+)  # seconds, 0 = off
+
+
+TEMP_SCALE = 10  # temperatures are stored as integer tenths of degree
+DEFAULT_HISTORY = timedelta(days=14)
+TIME_COLUMNS = ("ts", "first_seen")  # epoch ms, ISO 8601 in the REST api
+TRACE_COLUMNS = (
+    "ts",
+    "source",
+    "adapterMap",
+    "host",
+    "uri",
+    "elapsed",
+    "response_status",
+)
+CALL_GROUP = ("source", "adapterMap", "host", "response_status")
+
+
+@contextmanager
+def timed_insert(table: str):
+    with DB_INSERT_SECONDS.labels(table).time(), PHASE_STATS.phase("db"):
+        yield
+
+
+def EpochMs(value=None) -> int:
+    # Timestamps are stored as integer epoch milliseconds. Accepts what the REST
+    # api receives (ISO 8601, local time if naive), datetimes and epoch ms
+    if value is None:
+        return time.time_ns() // 1_000_000
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.astimezone().timestamp() * 1000)
+
+
+def IsoTime(ms: int | None) -> str | None:
+    # Back to the ISO 8601 local time strings the REST api has always returned
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).astimezone().isoformat()
+
+
+def TimeRange(date_from=None, date_to=None) -> tuple[int, int]:
+    now = EpochMs()
+    return (
+        (
+            EpochMs(date_from)
+            if date_from is not None
+            else now - int(DEFAULT_HISTORY.total_seconds() * 1000)
+        ),
+        EpochMs(date_to) if date_to is not None else now,
+    )
+
+
+def ApiRows(rows: list | None, temps: tuple[str, ...] = ()) -> list | None:
+    # Converts stored rows (epoch ms ts, tenths of degree) to the REST format in place
+    if rows is None:
+        return None
+    for row in rows:
+        for column in TIME_COLUMNS:
+            if column in row:
+                row[column] = IsoTime(row[column])
+        for column in temps:
+            if row[column] is not None:
+                row[column] = row[column] / TEMP_SCALE
+    return rows
+
+
+def ColumnarRows(rows: list | None, temps: tuple[str, ...] = ()) -> dict:
+    # Stored rows as parallel arrays: ts is epoch ms for the first row and
+    # the delta from the previous row after it, temperatures in degrees
+    rows = rows or []
+    columns = list(rows[0]) if rows else ["ts"]
+    rc = {column: [row[column] for row in rows] for column in columns}
+    ts = rc["ts"]
+    rc["ts"] = ts[:1] + [b - a for a, b in zip(ts, ts[1:])]
+    for column in temps:
+        if column in rc:
+            rc[column] = [
+                None if value is None else value / TEMP_SCALE for value in rc[column]
+            ]
+    return rc
+
+
+def HistoryRows(rows: list | None, temps: tuple[str, ...], format: str | None):
+    if format == "columnar":
+        return ColumnarRows(rows, temps)
+    return ApiRows(rows, temps=temps)
+
+
+def MergeCallGroups(groups: list, rows: list) -> list:
+    # Adds trace rows to the get_calls_group groups, as the group by would
+    merged = {tuple(group[c] for c in CALL_GROUP): dict(group) for group in groups}
+    for row in rows:
+        group = merged.get(tuple(row[c] for c in CALL_GROUP))
+        if group is None:
+            merged[tuple(row[c] for c in CALL_GROUP)] = {
+                "rowId": row["rowid"],
+                "cardinal": 1,
+                "ts": row["ts"],
+                "source": row["source"],
+                "adapterMap": row["adapterMap"],
+                "host": row["host"],
+                "elapsed": row["elapsed"],
+                "response_status": row["response_status"],
+            }
+            continue
+        if row["elapsed"] is not None:
+            group["elapsed"] = (
+                row["elapsed"]
+                if group["elapsed"] is None
+                else (group["elapsed"] * group["cardinal"] + row["elapsed"])
+                / (group["cardinal"] + 1)
+            )
+        group["cardinal"] += 1
+        group["rowId"] = max(group["rowId"], row["rowid"])
+        group["ts"] = max(group["ts"], row["ts"])
+    return list(merged.values())
+
+
+def ScaleTemp(temp) -> int | None:
+    return None if temp is None else round(temp * TEMP_SCALE)
+
 
 class Singleton(type):
     _instances = {}
@@ -18,11 +189,56 @@ class Singleton(type):
 
 class Database(metaclass=Singleton):
 
-    VERSION = 7
+    VERSION = LATEST_VERSION
 
-    def __init__(self, name: str = __name__, log=False) -> None:
+    def __init__(
+        self, name: str = __name__, log=False, backend: DatabaseType = DB_BACKEND
+    ) -> None:
         self.name: str = name
         self.log: bool = log
+        self.pragmas = [
+            f"synchronous = {DB_SYNCHRONOUS}",
+            f"cache_size = {-DB_CACHE_SIZE}",
+            f"mmap_size = {DB_MMAP_SIZE * 1024 * 1024}",
+            f"temp_store = {DB_TEMP_STORE}",
+            f"busy_timeout = {DB_BUSY_TIMEOUT}",
+        ]
+        self.pool = ConnectionPool(
+            DatabaseType.SQLITE3,
+            self.name,
+            pragmas=self.pragmas,
+            functions=[("unzip", 1, Unzip)],
+        )
+        # REST queries: their own connections, which can't write nor run for long
+        self.readPool = ConnectionPool(
+            DatabaseType.SQLITE3,
+            self.name,
+            maxSize=DB_READ_POOL_SIZE,
+            pragmas=self.pragmas + ["query_only = 1"],
+            functions=[("unzip", 1, Unzip)],
+            readOnly=True,
+            queryTimeout=DB_QUERY_TIMEOUT / 1000.0,
+        )
+        self.maintenance: Scheduler | None = None
+        self.migrations = MigrationRunner()
+        self.rollups = RollupAccumulator()
+        self.partitions = Partitions(self.pool)
+        # Memory backend: telemetry and traces go to ring buffers first
+        self.memory: MemoryStore | None = None
+        self.memoryFlush: Scheduler | None = None
+        if backend == DatabaseType.MEMORY:
+            self.memory = MemoryStore(self.partitions)
+            self.start_memory_flush()
+        self.counts = CountCache()
+        self.results = COLLECTOR.dbResults = ResultCache()
+        COLLECTOR.dbPool = self.pool
+        self.writer: DatabaseWriter | None = None
+        if DB_WRITE_BEHIND:
+            self.writer = COLLECTOR.dbWriter = DatabaseWriter(
+                self.pool,
+                onCommit=self.counts.invalidate,
+                onRows=self.results.committed,
+            )
 
     def create_tables(self, conn=None):
         if not conn:
@@ -67,54 +283,265 @@ class Database(metaclass=Singleton):
             if user_version == 0:
                 logger.warning(f"Initialising Database to version {self.VERSION}")
                 self.create_tables(conn=conn)
-                self._set_user_version(self.VERSION, conn=conn)
+                self._set_user_version(BASE_VERSION, conn=conn)
+                user_version = BASE_VERSION
+            if user_version < BASE_VERSION or user_version > self.VERSION:
+                logger.error(
+                    f"No migration from database version {user_version} to {self.VERSION}. Drop all database and restart!"
+                )
+                success = False
             elif user_version != self.VERSION:
                 logger.warning(
                     f"Database needs upgrading from version {user_version} to {self.VERSION}"
                 )
-                logger.error(
-                    "Migration not yet implemented :(. Drop all database and restart!"
-                )
-                success = False
+                try:
+                    self.migrations.run(conn.getConn(), user_version)
+                except Exception as e:
+                    logger.error(f"Database migration failed: {e}")
+                    success = False
         else:
             logger.error("Failed to get database version")
             success = False
 
+        if success:
+            self.set_journal_mode(conn=conn)
+            self.set_auto_vacuum(conn=conn)
+            self.partitions.load()
+            self.start_maintenance()
+
         if closeit:
             conn.close(commit=True)
 
         return success
 
-    def get_connection(self):
-        dbConnection = DatabaseConnection(DatabaseType.SQLITE3, self.name)
-        dbConnection.connect()
-        return dbConnection
+    def set_journal_mode(self, journal_mode=DB_JOURNAL_MODE, conn=None):
+        # Persistent in the database file, unlike the per connection pragmas
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        rc = conn.run_pragma(f"journal_mode = {journal_mode}", log=self.log)[0]
+        if str(rc).lower() != journal_mode.lower():
+            logger.warning(f"Database journal mode is {rc}, not {journal_mode}")
+        if closeit:
+            conn.close(commit=True)
+        return rc
 
-    def log_outside_temperature(self, temp, conn=None):
+    def set_auto_vacuum(self, conn=None):
+        # Needed by the incremental vacuum after a purge. Changing it on an
+        # existing database takes a full VACUUM, once
         if not conn:
             conn = self.get_connection()
             closeit = True
         else:
             closeit = False
-        now = datetime.now(timezone.utc).astimezone().isoformat()
-        sql = "insert into besim_outside_temperature(ts, temp) values (?,?)"
-        values = (now, temp)
-        conn.run_sql(sql, values, log=self.log)
+        if conn.run_pragma("auto_vacuum", log=self.log)[0] != 2:
+            logger.warning("Enabling incremental vacuum, this may take a while")
+            conn.run_pragma("auto_vacuum = incremental", log=self.log)
+            conn.getConn().autocommit = True
+            try:
+                conn.getConn().execute("vacuum")
+            finally:
+                conn.getConn().autocommit = False
         if closeit:
             conn.close(commit=True)
 
-    def log_temperature(self, thermostat, temp, settemp, heating, conn=None):
+    def start_maintenance(self, interval=DB_MAINTENANCE_INTERVAL):
+        if interval <= 0 or self.maintenance is not None:
+            return
+        self.maintenance = Scheduler(workers=1)
+        self.maintenance.start()
+        self.maintenance.schedule(
+            "maintenance", interval, self.maintenance_job, interval
+        )
+
+    def maintenance_job(self, interval=DB_MAINTENANCE_INTERVAL):
+        try:
+            self.run_maintenance()
+        finally:
+            if self.maintenance is not None:
+                self.maintenance.schedule(
+                    "maintenance", interval, self.maintenance_job, interval
+                )
+
+    def start_memory_flush(self, interval=DB_MEMORY_FLUSH):
+        if interval <= 0 or self.memoryFlush is not None:
+            return
+        self.memoryFlush = Scheduler(workers=1)
+        self.memoryFlush.start()
+        self.memoryFlush.schedule(
+            "memory_flush", interval, self.memory_flush_job, interval
+        )
+
+    def memory_flush_job(self, interval=DB_MEMORY_FLUSH):
+        try:
+            self.flush_memory()
+        finally:
+            if self.memoryFlush is not None:
+                self.memoryFlush.schedule(
+                    "memory_flush", interval, self.memory_flush_job, interval
+                )
+
+    def flush_memory(self, tables=None, conn=None):
+        # Writes the rows waiting in the ring buffers to SQLite, returns the
+        # tables that got some
+        if self.memory is None:
+            return []
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        written = self.memory.flush(conn, tables)
+        if closeit:
+            conn.close(commit=True)
+        self.counts.invalidate(*written)
+        return written
+
+    def run_maintenance(self, retentionDays=DB_RETENTION_DAYS, conn=None):
+        # Drop expired partitions, keep the WAL file from growing while readers
+        # pin it, and refresh the query planner statistics
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        rc = {}
+        if retentionDays > 0:
+            rc["purge"] = self.purge(retentionDays, conn=conn)
+        if DB_JOURNAL_MODE.lower() == "wal":
+            busy, log, checkpointed = conn.run_pragma(
+                "wal_checkpoint(TRUNCATE)", log=self.log
+            )
+            rc["wal_checkpoint"] = {
+                "busy": busy,
+                "log": log,
+                "checkpointed": checkpointed,
+            }
+        conn.run_pragma("optimize", log=self.log)
+        logger.debug(f"Database maintenance {rc}")
+        if closeit:
+            conn.close(commit=True)
+        return rc
+
+    def get_status(self, conn=None):
         if not conn:
             conn = self.get_connection()
             closeit = True
         else:
             closeit = False
-        now = datetime.now(timezone.utc).astimezone().isoformat()
-        sql = "insert into besim_temperature(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)"
-        values = (now, thermostat, temp, settemp, heating)
-        conn.run_sql(sql, values, log=self.log)
+        rc = {
+            "version": self._get_user_version(conn=conn),
+            "target_version": self.VERSION,
+            "journal_mode": conn.run_pragma("journal_mode")[0],
+            "migration": self.migrations.getStatus(),
+            "pool": self.pool.getStats(),
+            "read_pool": self.readPool.getStats(),
+            "writer": self.writer.getStats() if self.writer is not None else None,
+            "counts": self.counts.getStats(),
+            "results": self.results.getStats(),
+            "memory": self.memory.getStats() if self.memory is not None else None,
+        }
         if closeit:
             conn.close(commit=True)
+        return rc
+
+    def get_connection(self):
+        # Leased from the pool, close() gives it back
+        return self.pool.acquire()
+
+    def get_read_connection(self):
+        # Read-only, from the pool of the REST queries
+        return self.readPool.acquire()
+
+    def _insert(self, table: str, sql: str, values: tuple, conn=None) -> None:
+        # Queued to the writer unless the caller brings its own connection
+        with timed_insert(table):
+            if conn is None and self.memory is not None and table in RINGS:
+                self.memory.append(table, values)
+                self.results.committed(table, [values])
+                return
+            if conn is None and self.writer is not None:
+                self.writer.put(table, sql, values)
+                return
+            if not conn:
+                conn = self.get_connection()
+                closeit = True
+            else:
+                closeit = False
+            conn.run_sql(sql, values, log=self.log)
+            if closeit:
+                conn.close(commit=True)
+            self.counts.invalidate(table)
+            self.results.committed(table, [values])
+
+    def flush(self) -> None:
+        # Write the pending rollups and wait for the queued inserts to be committed
+        self.flush_rollups()
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self) -> None:
+        # Drain the rollups and queued inserts, then close the idle connections
+        self.flush_rollups()
+        if self.memoryFlush is not None:
+            # Written out on exit too, unless flushing is off (db_memory_flush 0)
+            self.memoryFlush.stop()
+            self.memoryFlush = None
+            self.flush_memory()
+        if self.writer is not None:
+            self.writer.flush()
+            self.writer.stop()
+        if self.maintenance is not None:
+            self.maintenance.stop()
+            self.maintenance = None
+        self.readPool.closeAll()
+        self.pool.closeAll()
+
+    def log_outside_temperature(self, temp, conn=None):
+        now = EpochMs()
+        sql = f"insert into {self.partitions.table('besim_outside_temperature', now)}(ts, temp) values (?,?)"
+        values = (now, ScaleTemp(temp))
+        self._insert("besim_outside_temperature", sql, values, conn=conn)
+        if temp is not None:
+            self.rollups.addOutside(now, ScaleTemp(temp))
+
+    def rollup_temperature(self, thermostat, temp, settemp, heating, conn=None):
+        # Every sample goes in the hourly/daily rollups, even when log_temperature
+        # skips it (see DeadbandRecorder)
+        self.rollups.addTemperature(
+            thermostat, EpochMs(), ScaleTemp(temp), ScaleTemp(settemp), heating
+        )
+        if self.rollups.due():
+            self.flush_rollups(conn=conn)
+
+    def flush_rollups(self, conn=None):
+        for table, sql, values in self.rollups.drain():
+            self._insert(table, sql, values, conn=conn)
+
+    def _resolution(self, table, where, values, date_from, points, resolution, conn):
+        # The coarsest source that still has `points` rows for LTTB to reduce:
+        # the daily rollups, else the hourly ones, else the samples. `values`
+        # end with the ts range of `where`
+        if resolution not in (None, "auto"):
+            if resolution != "raw" and resolution not in RESOLUTIONS:
+                raise ValueError(f"Unknown resolution {resolution}")
+            return resolution
+        if not points:
+            return "raw"
+        for name, size in reversed(RESOLUTIONS.items()):
+            sql = f"select count(*) as total from {table}_{name} where {where}"
+            bucketed = values[:-2] + (date_from - date_from % size, values[-1])
+            if conn.fetchone(sql, bucketed, log=self.log)["total"] >= points:
+                return name
+        return "raw"
+
+    def log_temperature(self, thermostat, temp, settemp, heating, conn=None):
+        now = EpochMs()
+        sql = f"insert into {self.partitions.table('besim_temperature', now)}(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)"
+        values = (now, thermostat, ScaleTemp(temp), ScaleTemp(settemp), heating)
+        self._insert("besim_temperature", sql, values, conn=conn)
 
     def log_traces(
         self,
@@ -126,17 +553,10 @@ class Database(metaclass=Singleton):
         response_status: str,
         conn=None,
     ) -> None:
-        if not conn:
-            conn = self.get_connection()
-            closeit = True
-        else:
-            closeit = False
-        now: str = datetime.now(timezone.utc).astimezone().isoformat()
-        sql = "insert into web_traces(ts, source, adapterMap, host, uri, elapsed, response_status) values (?,?,?,?,?,?,?)"
+        now: int = EpochMs()
+        sql = f"insert into {self.partitions.table('web_traces', now)}(ts, source, adapterMap, host, uri, elapsed, response_status) values (?,?,?,?,?,?,?)"
         values = (now, source, adapterMap, host, uri, elapsed, response_status)
-        conn.run_sql(sql, values, log=self.log)
-        if closeit:
-            conn.close(commit=True)
+        self._insert("web_traces", sql, values, conn=conn)
 
     def log_unknown_udp(
         self,
@@ -148,17 +568,13 @@ class Database(metaclass=Singleton):
         unparsed_payload: bytes = bytes([]),
         conn=None,
     ) -> None:
-        if not conn:
-            conn = self.get_connection()
-            closeit = True
-        else:
-            closeit = False
-        now: str = datetime.now(timezone.utc).astimezone().isoformat()
-        sql = "insert into unknown_udp(ts, source, type, code, payload, unparsed_payload, raw_data) values (?,?,?,?,?,?,?)"
-        values = (now, source, type, code, payload, unparsed_payload, raw_data)
-        conn.run_sql(sql, values, log=self.log)
-        if closeit:
-            conn.close(commit=True)
+        # One row per distinct message, see dedup.UNKNOWN
+        values = UpsertValues(
+            "unknown_udp",
+            EpochMs(),
+            (source, type, code, payload, unparsed_payload, raw_data),
+        )
+        self._insert("unknown_udp", UpsertSql("unknown_udp"), values, conn=conn)
 
     def log_unknown_api(
         self,
@@ -172,27 +588,12 @@ class Database(metaclass=Singleton):
         rm_res_body: str,
         conn=None,
     ) -> None:
-        if not conn:
-            conn = self.get_connection()
-            closeit = True
-        else:
-            closeit = False
-        now: str = datetime.now(timezone.utc).astimezone().isoformat()
-        sql = "insert into unknown_api(ts, source, host, method, uri, headers, body, rm_resp_code, rm_res_body) values (?,?,?,?,?,?,?,?,?)"
-        values = (
-            now,
-            source,
-            host,
-            method,
-            uri,
-            headers,
-            body,
-            rm_resp_code,
-            rm_res_body,
+        values = UpsertValues(
+            "unknown_api",
+            EpochMs(),
+            (source, host, method, uri, headers, body, rm_resp_code, rm_res_body),
         )
-        conn.run_sql(sql, values, log=self.log)
-        if closeit:
-            conn.close(commit=True)
+        self._insert("unknown_api", UpsertSql("unknown_api"), values, conn=conn)
 
     def purge(self, daysToKeep, conn=None):
         if not conn:
@@ -200,63 +601,236 @@ class Database(metaclass=Singleton):
             closeit = True
         else:
             closeit = False
-        now: datetime = datetime.now(timezone.utc).astimezone()
-        limit: datetime = now - timedelta(days=daysToKeep)
-        sql: str = (
-            f"delete from besim_outside_temperature where ts < '{limit.isoformat()}'"
+        limit: int = EpochMs() - daysToKeep * 86400 * 1000
+        rc = self.partitions.drop_before(limit)
+        for table in UNKNOWN:
+            rc["deleted"] += (
+                conn.getConn()
+                .execute(f"delete from {table} where last_seen < ?", (limit,))
+                .rowcount
+            )
+        conn.commit()
+        self.counts.invalidate(*PARTITIONED, *UNKNOWN)
+        self.results.clear()
+        # Give the pages of the dropped partitions back to the filesystem
+        rc["vacuumed_pages"] = len(
+            conn.run_pragma("incremental_vacuum", log=self.log, fetchall=True)
         )
-        conn.run_sql(sql, log=self.log)
-        sql: str = f"delete from besim_temperature where ts < '{limit.isoformat()}'"
-        conn.run_sql(sql, log=self.log)
-        sql: str = f"delete from web_traces where ts < '{limit.isoformat()}'"
-        conn.run_sql(sql, log=self.log)
-        sql: str = f"delete from unknown_udp where ts < '{limit.isoformat()}'"
-        conn.run_sql(sql, log=self.log)
-        sql: str = f"delete from unknown_api where ts < '{limit.isoformat()}'"
-        conn.run_sql(sql, log=self.log)
+        logger.info(f"Database purge {rc}")
         if closeit:
             conn.close(commit=True)
+        return rc
 
-    def get_outside_temperature(self, date_from=None, date_to=None, conn=None):
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+    def _pending(
+        self, table, date_from, date_to, columns, last=False, ids=None, **equals
+    ):
+        # Rows still in the ring buffers (memory backend), oldest first
+        if self.memory is None:
+            return []
+        return self.memory.rings[table].select(
+            date_from, date_to, columns, last=last, ids=ids, **equals
+        )
+
+    def _pending_traces(self, date_from, date_to, matches):
+        # Buffered traces as the call history rows, `matches` is a RowMatcher
+        rows = self._pending(
+            "web_traces", date_from, date_to, TRACE_COLUMNS, ids="rowid"
+        )
+        return [row for row in rows if matches(row)] if matches else rows
+
+    def _read(self, query):
+        # Queries merging the ring buffers run again if a flush moved rows
+        return query() if self.memory is None else self.memory.read(query)
+
+    def _with_pending(self, table, query, date_from, date_to, columns, **equals):
+        # Rows of `query` and those of the ring buffers not yet in SQLite
+        if self.memory is None:
+            return query()
+
+        def merged():
+            rows = (query() or []) + self._pending(
+                table, date_from, date_to, columns, **equals
+            )
+            rows.sort(key=itemgetter("ts"))
+            return rows
+
+        return self._read(merged)
+
+    def _cached_history(self, source, date_from, date_to, options, compute):
+        # Keyed on the query as asked: an open window (no `to`) is the same
+        # query until it expires, whatever the time it is run
+        key = (
+            EpochMs(date_from) if date_from is not None else None,
+            EpochMs(date_to) if date_to is not None else None,
+        ) + options
+        closed = key[1] is not None and key[1] < EpochMs() - RESULT_CACHE_SETTLE
+        return self.results.get(source, key, closed, compute)
+
+    def get_outside_temperature(
+        self,
+        date_from=None,
+        date_to=None,
+        points=None,
+        resolution=None,
+        format=None,
+        conn=None,
+    ):
+        return self._cached_history(
+            ("besim_outside_temperature", None),
+            date_from,
+            date_to,
+            (points, resolution or "auto", format or "rows"),
+            lambda: self._query_outside_temperature(
+                date_from, date_to, points, resolution, format, conn
+            ),
+        )
+
+    def _query_outside_temperature(
+        self, date_from, date_to, points, resolution, format, conn
+    ):
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select ts,temp from besim_outside_temperature where ts between ? and ?"
+        where = "ts between ? and ?"
         values = (date_from, date_to)
-        rc = conn.run_sql(sql, values, log=self.log)
+        resolution = self._resolution(
+            "besim_outside_temperature",
+            where,
+            values,
+            date_from,
+            points,
+            resolution,
+            conn,
+        )
+        if resolution == "raw":
+            sql = f"select ts,temp from besim_outside_temperature where {where} order by ts"
+            rows = self._with_pending(
+                "besim_outside_temperature",
+                lambda: conn.run_sql(sql, values, log=self.log),
+                date_from,
+                date_to,
+                ("ts", "temp"),
+            )
+            temps = ("temp",)
+        else:
+            # Rollups as committed, the buckets still accumulating are written
+            # by rollup_temperature every ROLLUP_FLUSH_INTERVAL, never by a read
+            sql = f"select ts, round(temp_sum * 1.0 / samples, 1) as temp, temp_min, temp_max, samples from besim_outside_temperature_{resolution} where {where} order by ts"
+            values = (date_from - date_from % RESOLUTIONS[resolution], date_to)
+            rows = conn.run_sql(sql, values, log=self.log)
+            temps = ("temp", "temp_min", "temp_max")
+        rc = HistoryRows(Lttb(rows, points), temps, format)
         if closeit:
             conn.close(commit=True)
         return rc
 
-    def get_temperature(self, thermostat, date_from=None, date_to=None, conn=None):
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+    def get_temperature(
+        self,
+        thermostat,
+        date_from=None,
+        date_to=None,
+        step=True,
+        points=None,
+        resolution=None,
+        format=None,
+        conn=None,
+    ):
+        # format="columnar" returns parallel arrays (see ColumnarRows) instead
+        # of a list of rows. Beyond `points` rows, after picking the resolution,
+        # the result is downsampled with LTTB
+        return self._cached_history(
+            ("besim_temperature", str(thermostat)),
+            date_from,
+            date_to,
+            (step, points, resolution or "auto", format or "rows"),
+            lambda: self._query_temperature(
+                thermostat, date_from, date_to, step, points, resolution, format, conn
+            ),
+        )
+
+    def _query_temperature(
+        self, thermostat, date_from, date_to, step, points, resolution, format, conn
+    ):
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select ts,temp,settemp,heating from besim_temperature where thermostat = ? and ts between ? and ?"
+        where = "thermostat = ? and ts between ? and ?"
         values = (thermostat, date_from, date_to)
-        rc = conn.run_sql(sql, values, log=self.log)
+        resolution = self._resolution(
+            "besim_temperature",
+            where,
+            values,
+            date_from,
+            points,
+            resolution,
+            conn,
+        )
+        if resolution == "raw":
+            sql = f"select ts,temp,settemp,heating from besim_temperature where {where} order by ts"
+            rows = self._with_pending(
+                "besim_temperature",
+                lambda: conn.run_sql(sql, values, log=self.log),
+                date_from,
+                date_to,
+                ("ts", "temp", "settemp", "heating"),
+                thermostat=int(thermostat),
+            )
+            if step:
+                rows = self._step_edges(thermostat, rows, date_from, date_to, conn)
+            temps = ("temp", "settemp")
+        else:
+            # heating is the duty cycle, 0..1. Rollups as committed
+            sql = f"select ts, round(temp_sum * 1.0 / samples, 1) as temp, temp_min, temp_max, round(settemp_sum * 1.0 / samples, 1) as settemp, round(heating_samples * 1.0 / samples, 3) as heating, samples from besim_temperature_{resolution} where {where} order by ts"
+            values = (
+                thermostat,
+                date_from - date_from % RESOLUTIONS[resolution],
+                date_to,
+            )
+            rows = conn.run_sql(sql, values, log=self.log)
+            temps = ("temp", "temp_min", "temp_max", "settemp")
+        rc = HistoryRows(Lttb(rows, points), temps, format)
         if closeit:
             conn.close(commit=True)
         return rc
 
+    def _step_edges(self, thermostat, rows, date_from, date_to, conn):
+        # Samples are only written on change (see DeadbandRecorder): the value at
+        # date_from is the last sample before it, and the last sample holds until
+        # date_to, as long as no heartbeat was missed
+        heartbeat = TEMP_HEARTBEAT * 1000 if TEMP_HEARTBEAT > 0 else None
+        sql = "select ts,temp,settemp,heating from besim_temperature where thermostat = ? and ts < ? order by ts desc limit 1"
+        prior = conn.fetchone(sql, (thermostat, date_from), log=self.log)
+        pending = self._pending(
+            "besim_temperature",
+            0,
+            date_from - 1,
+            ("ts", "temp", "settemp", "heating"),
+            last=True,
+            thermostat=int(thermostat),
+        )
+        if pending:
+            prior = pending[0]
+        if (
+            prior is not None
+            and heartbeat is not None
+            and date_from - prior["ts"] <= heartbeat
+            and (not rows or rows[0]["ts"] > date_from)
+        ):
+            rows.insert(0, prior | {"ts": date_from})
+        if rows and heartbeat is not None:
+            end = min(date_to, EpochMs(), rows[-1]["ts"] + heartbeat)
+            if end > rows[-1]["ts"]:
+                rows.append(rows[-1] | {"ts": end})
+        return rows
+
     def get_calls(
         self,
         date_from=None,
@@ -265,38 +839,65 @@ class Database(metaclass=Singleton):
         filter=None,
         limit=200,
         offset=0,
+        cursor=None,
+        q=None,
         conn=None,
     ):  # -> List[Any] | Any:
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+        # Pages continue from `cursor` (meta.next of the previous page); offset
+        # is still accepted but costs a scan of the skipped rows. `q` and the
+        # `filter` values are searched as word prefixes in the full-text index.
+        # Traces still buffered by the memory backend are merged into the page
+        keys, descending = SortKeys(sort, CALL_SORT)
+        match = MatchQuery("web_traces", q, filter)
+        matches = RowMatcher("web_traces", q, filter)
+        countKey = (date_from, date_to, match)
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select rowid,ts,source,adapterMap,host,uri,elapsed,response_status from web_traces where ts between ? and ? "
+        sql = "select id as rowid,ts,source,adapterMap,host,uri,elapsed,response_status from web_traces where ts between ? and ? "
         values = (date_from, date_to)
-        if filter:
-            filter_sql = str()
-            for key in filter:
-                filter_sql += f"and {key} like ? "
-                values += (f"%{filter[key]}%",)
-            sql += filter_sql
+        if match:
+            match_sql, binds = self.partitions.match("web_traces", *values)
+            sql += f"and id in ({match_sql}) "
+            values += (match,) * binds
 
         sqlcount = f"select count(*) as total from ({sql})"
-        sql += f" order by {sort}" if sort else ""
-        sql += f" LIMIT {offset},{limit}"
+        keyset_sql, keyset_values = KeysetClause(keys, descending, cursor)
+        if keyset_sql:
+            sql += f"and {keyset_sql} "
+            offset = 0
+        sql += f" order by {OrderBy(keys, descending)} LIMIT ?,?"
         logger.debug((sql, sqlcount))
-        rcc = conn.run_sql(sqlcount, values, log=self.log)
-        rc = conn.run_sql(sql, values, log=self.log)
+
+        def page():
+            pending = self._pending_traces(date_from, date_to, matches)
+            total = self.counts.get(
+                "web_traces",
+                ("calls",) + countKey,
+                lambda: conn.run_sql(sqlcount, values, log=self.log)[0]["total"],
+            )
+            if not pending:
+                rows = conn.run_sql(
+                    sql, values + keyset_values + (offset, limit), log=self.log
+                )
+                return total, rows
+            # Enough SQLite rows to fill the page on their own, then merged
+            rows = conn.run_sql(
+                sql, values + keyset_values + (0, offset + limit), log=self.log
+            )
+            rows = SortRows(rows + pending, keys, descending, cursor)
+            return total + len(pending), rows[offset : offset + limit]
+
+        total, rc = self._read(page)
+        nextCursor = NextCursor(rc, keys, limit)
+        rc = ApiRows(rc)
         if closeit:
             conn.close(commit=True)
-        return {"meta": rcc[0], "data": rc}
+        return {"meta": {"total": total, "next": nextCursor}, "data": rc}
 
     def get_calls_group(
         self,
@@ -306,76 +907,162 @@ class Database(metaclass=Singleton):
         filter=None,
         limit=200,
         offset=0,
+        cursor=None,
+        q=None,
         conn=None,
     ):  # -> List[Any] | Any:
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+        keys, descending = SortKeys(sort, CALL_GROUP_SORT)
+        match = MatchQuery("web_traces", q, filter)
+        matches = RowMatcher("web_traces", q, filter)
+        countKey = (date_from, date_to, match)
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select max(rowid) as rowId,count(*) as cardinal ,max(ts) as ts,source,adapterMap,host,avg(elapsed) as elapsed,response_status from web_traces where ts between ? and ? "
+        sql = "select max(id) as rowId,count(*) as cardinal ,max(ts) as ts,source,adapterMap,host,avg(elapsed) as elapsed,response_status from web_traces where ts between ? and ? "
         values = (date_from, date_to)
-        if filter:
-            filter_sql = str()
-            for key in filter:
-                filter_sql += f"and {key} like ? "
-                values += (f"%{filter[key]}%",)
-            sql += filter_sql
+        if match:
+            match_sql, binds = self.partitions.match("web_traces", *values)
+            sql += f"and id in ({match_sql}) "
+            values += (match,) * binds
 
         sql += " group by source,adapterMap,host,response_status "
+        groups_sql = sql
         sqlcount = f"select count(*) as total from ({sql})"
-        sql += f" order by {sort}" if sort else ""
-        sql += f" LIMIT {offset},{limit}"
+        keyset_sql, keyset_values = KeysetClause(keys, descending, cursor)
+        if keyset_sql:
+            sql += f"having {keyset_sql} "
+            offset = 0
+        sql += f" order by {OrderBy(keys, descending)} LIMIT ?,?"
         #  logger.debug((sql, sqlcount))
-        rcc = conn.run_sql(sqlcount, values, log=self.log)
-        rc = conn.run_sql(sql, values, log=self.log)
+
+        def page():
+            pending = self._pending_traces(date_from, date_to, matches)
+            if not pending:
+                total = self.counts.get(
+                    "web_traces",
+                    ("calls_group",) + countKey,
+                    lambda: conn.run_sql(sqlcount, values, log=self.log)[0]["total"],
+                )
+                rows = conn.run_sql(
+                    sql, values + keyset_values + (offset, limit), log=self.log
+                )
+                return total, rows
+            # Buffered traces (memory backend) may join any group: all of them
+            # are merged, then sorted and paged
+            groups = MergeCallGroups(
+                conn.run_sql(groups_sql, values, log=self.log) or [], pending
+            )
+            rows = SortRows(groups, keys, descending, cursor)
+            return len(groups), rows[offset : offset + limit]
+
+        total, rc = self._read(page)
+        nextCursor = NextCursor(rc, keys, limit)
+        rc = ApiRows(rc)
         if closeit:
             conn.close(commit=True)
-        return {"meta": rcc[0], "data": rc}
+        return {"meta": {"total": total, "next": nextCursor}, "data": rc}
+
+    def export(
+        self,
+        kind,
+        date_from=None,
+        date_to=None,
+        room=None,
+        batchSize=DB_STREAM_BATCH,
+    ):
+        # Batches of rows (tuples, in EXPORTS[kind] column order, ISO times)
+        # of the whole history unless limited, one partition at a time in ts
+        # order. The connection is held until the generator ends or is closed.
+        # Rows still buffered by the memory backend come last, read along with
+        # the SQLite snapshot so that a flush meanwhile doesn't repeat any.
+        # Bad dates raise ValueError here, before the first batch
+        date_from = EpochMs(date_from) if date_from is not None else 0
+        date_to = EpochMs(date_to) if date_to is not None else EpochMs()
+        return self._export(kind, date_from, date_to, room, batchSize)
+
+    def _export(self, kind, date_from: int, date_to: int, room, batchSize):
+        table, columns, select, ts = EXPORTS[kind]
+        times = [i for i, column in enumerate(columns) if column in TIME_COLUMNS]
+        temps = [i for i, column in enumerate(columns) if column in ("temp", "settemp")]
+        equals = (
+            {"thermostat": int(room)}
+            if room is not None and kind == "temperature"
+            else {}
+        )
+        partitions = (
+            self.partitions.between(table, date_from, date_to)
+            if table in PARTITIONED
+            else [table]
+        )
+        select = select.format(scale=float(TEMP_SCALE))
+        room_sql = (
+            "and thermostat = ? " if room is not None and kind == "temperature" else ""
+        )
+        conn = self.get_read_connection()
+        try:
+            pending = []
+            if table in RINGS and self.memory is not None:
+                pending = self.memory.snapshot(
+                    conn,
+                    lambda: self._pending(table, date_from, date_to, columns, **equals),
+                )
+            for partition in partitions:
+                sql = f"select {select} from {partition} where {ts} between ? and ? {room_sql}order by {ts}"
+                values = (date_from, date_to) + ((room,) if room_sql else ())
+                for batch in conn.stream(
+                    sql, values, format="tuple", batchSize=batchSize, batches=True
+                ):
+                    rows = [list(row) for row in batch]
+                    for row in rows:
+                        for column in times:
+                            row[column] = IsoTime(row[column])
+                    yield rows
+            for start in range(0, len(pending), batchSize):
+                rows = [
+                    [row[column] for column in columns]
+                    for row in pending[start : start + batchSize]
+                ]
+                for row in rows:
+                    for column in temps:
+                        if row[column] is not None:
+                            row[column] /= TEMP_SCALE
+                    for column in times:
+                        row[column] = IsoTime(row[column])
+                yield rows
+        finally:
+            conn.close()
 
     def get_unknown_udp(self, date_from=None, date_to=None, conn=None):
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select count(*) as count, max(ts) as ts, source, type, code, hex(payload) as payload, hex(unparsed_payload) as unparsed_payload, hex(raw_data) as raw_data from unknown_udp where ts between ? and ? group by source, type, code, payload, unparsed_payload, raw_data"
+        # Messages seen in the period, count is over their whole life
+        sql = "select count, last_seen as ts, first_seen, source, type, code, hex(unzip(payload)) as payload, hex(unzip(unparsed_payload)) as unparsed_payload, hex(unzip(raw_data)) as raw_data from unknown_udp where last_seen >= ? and first_seen <= ? order by last_seen desc"
         values = (date_from, date_to)
-        rc = conn.run_sql(sql, values, log=self.log)
+        rc = ApiRows(conn.run_sql(sql, values, log=self.log))
         if closeit:
             conn.close(commit=True)
         return rc
 
     def get_unknown_api(self, date_from=None, date_to=None, conn=None):
-        if date_from is None:
-            date_from = (
-                datetime.now(timezone.utc).astimezone() - timedelta(days=14)
-            ).isoformat()
-        if date_to is None:
-            date_to = datetime.now(timezone.utc).astimezone().isoformat()
+        date_from, date_to = TimeRange(date_from, date_to)
 
         if not conn:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             closeit = True
         else:
             closeit = False
-        sql = "select count(*) as count, max(ts) as ts, source, host, method, uri, headers, hex(body) as body, rm_resp_code, rm_res_body from unknown_api where ts between ? and ? group by source, host, method, uri, headers, body, rm_resp_code, rm_res_body"
+        sql = "select count, last_seen as ts, first_seen, source, host, method, uri, headers, hex(unzip(body)) as body, rm_resp_code, rm_res_body from unknown_api where last_seen >= ? and first_seen <= ? order by last_seen desc"
         values = (date_from, date_to)
-        rc = conn.run_sql(sql, values, log=self.log)
+        rc = ApiRows(conn.run_sql(sql, values, log=self.log))
         if closeit:
             conn.close(commit=True)
         return rc
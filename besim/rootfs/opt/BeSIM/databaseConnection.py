@@ -1,17 +1,96 @@
+import os
 import sqlite3
 import logging
 import contextlib
+import threading
+import time
 from enum import Enum
+from urllib.parse import quote
 
-from typing import List
+from typing import Iterator, List
 from typing import Union
 
 logger = logging.getLogger(__name__)
 
+DB_POOL_SIZE = int(os.getenv("BESIM_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("BESIM_DB_POOL_TIMEOUT", "10"))  # seconds
+DB_POOL_HEALTHCHECK = 30  # seconds idle before a connection is checked on reuse
+DB_STREAM_BATCH = int(os.getenv("BESIM_DB_STREAM_BATCH", "500"))  # rows per fetch
+DB_READ_POOL_SIZE = int(os.getenv("BESIM_DB_READ_POOL_SIZE", "4"))
+DB_QUERY_TIMEOUT = int(os.getenv("BESIM_DB_QUERY_TIMEOUT", "10000"))  # ms, 0 = none
+DB_QUERY_TIMEOUT_STEPS = 10000  # sqlite VM steps between timeout checks
+
+ROW_FORMATS = ("dict", "tuple", "columnar")
+
 
 class DatabaseType(Enum):
     SQLITE3 = 1
     UNSET = 2
+    MEMORY = 3  # recent telemetry in ring buffers, SQLite for the rest
+
+
+DB_BACKEND = DatabaseType[os.getenv("BESIM_DB_BACKEND", "sqlite3").upper()]
+
+
+class RowStream:
+    """
+    Rows of an executed query, fetched `batchSize` at a time while iterating.
+    format "dict" yields dicts, "tuple" the sqlite3 rows as they are and
+    "columnar" one dict of column lists per batch. With batches=True lists
+    of rows are yielded instead of single rows. The cursor is closed when
+    the rows run out or on close(). The query timeout of `connection`, if
+    any, applies to every fetch.
+    """
+
+    def __init__(
+        self,
+        cursor: sqlite3.Cursor,
+        format: str = "dict",
+        batchSize: int = DB_STREAM_BATCH,
+        batches: bool = False,
+        connection: "DatabaseConnection | None" = None,
+    ) -> None:
+        if format not in ROW_FORMATS:
+            raise ValueError(f"Invalid row format {format!r}, allowed {ROW_FORMATS}")
+        self.cursor = cursor
+        self.format = format
+        self.batchSize = max(1, batchSize)
+        self.batches = batches or format == "columnar"
+        self.columns: list[str] = [x[0] for x in cursor.description or ()]
+        self.connection = connection
+        self.rows = 0
+
+    def __iter__(self) -> Iterator:
+        try:
+            while True:
+                if self.connection is not None:
+                    self.connection.armTimeout()
+                rows = self.cursor.fetchmany(self.batchSize)
+                if not rows:
+                    break
+                self.rows += len(rows)
+                if self.format == "dict":
+                    cols = self.columns
+                    rows = [dict(zip(cols, row)) for row in rows]
+                elif self.format == "columnar":
+                    rows = dict(zip(self.columns, map(list, zip(*rows))))
+                if self.batches:
+                    yield rows
+                else:
+                    yield from rows
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.cursor.close()
+        if self.connection is not None:
+            self.connection.disarmTimeout()
+
+    def __enter__(self) -> "RowStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 
 class DatabaseConnection:
@@ -21,11 +100,13 @@ class DatabaseConnection:
         self.databaseType = databaseType
         self.databaseName = databaseName
         self.conn = None
+        self.queryTimeout = 0.0  # seconds, enforced by a progress handler
+        self.deadline: float | None = None
 
-    def connect(self):
+    def connect(self, **kwargs):
         if self.databaseName is not None and self.conn is None:
             self.conn = sqlite3.connect(
-                self.databaseName, autocommit=False
+                self.databaseName, autocommit=False, **kwargs
             )  # PEP 249 compliant Python3.12+
         return self.conn
 
@@ -39,6 +120,32 @@ class DatabaseConnection:
             self.connect()
         return self.conn  # type: ignore
 
+    def run_pragma(self, pragma: str, log=False, fetchall=False):
+        # Some pragmas (journal_mode) can't run inside the implicit transaction
+        # opened by autocommit=False
+        conn = self.getConn()
+        conn.autocommit = True
+        try:
+            if log:
+                logger.info(f"pragma {pragma}")
+            cursor = conn.execute(f"pragma {pragma}")
+            # incremental_vacuum does one step per row
+            row = cursor.fetchall() if fetchall else cursor.fetchone()
+        finally:
+            conn.autocommit = False
+        return row
+
+    def armTimeout(self) -> None:
+        if self.queryTimeout > 0:
+            self.deadline = time.monotonic() + self.queryTimeout
+
+    def disarmTimeout(self) -> None:
+        self.deadline = None
+
+    def timedOut(self) -> bool:
+        # sqlite progress handler: a true result interrupts the statement
+        return self.deadline is not None and time.monotonic() > self.deadline
+
     def commit(self) -> None:
         if self.getConn() is not None:
             self.getConn().commit()
@@ -53,17 +160,21 @@ class DatabaseConnection:
         if log:
             logger.info(sql)
         if self.getConn() is not None:
+            self.armTimeout()
             with contextlib.closing(
                 self.getConn().cursor()
             ) as cursor:  # Use contextlib since sqlite3 cursors do not support __enter__
-                cursor.execute(sql, values)
-                if (
-                    cursor.description is None
-                ):  # sqlite3 will not return anything on a create/insert etc
-                    result = None
-                else:
-                    cols = [x[0] for x in cursor.description]
-                    result = [dict(zip(cols, row)) for row in cursor.fetchall()]
+                try:
+                    cursor.execute(sql, values)
+                    if (
+                        cursor.description is None
+                    ):  # sqlite3 will not return anything on a create/insert etc
+                        result = None
+                    else:
+                        cols = [x[0] for x in cursor.description]
+                        result = [dict(zip(cols, row)) for row in cursor.fetchall()]
+                finally:
+                    self.disarmTimeout()
             self.getConn().commit()
             if log:
                 logger.info(result)
@@ -71,6 +182,32 @@ class DatabaseConnection:
         else:
             return None
 
+    def stream(
+        self,
+        sql,
+        values=None,
+        format="dict",
+        batchSize=DB_STREAM_BATCH,
+        batches=False,
+        log=False,
+    ) -> RowStream:
+        # Unlike run_sql nothing is materialized nor committed: the read
+        # transaction lasts until the connection is committed or released
+        if values is None:
+            values = ()
+        if log:
+            logger.info(sql)
+        cursor = self.getConn().cursor()
+        cursor.arraysize = batchSize
+        try:
+            self.armTimeout()
+            cursor.execute(sql, values)
+            return RowStream(cursor, format, batchSize, batches, connection=self)
+        except Exception:
+            cursor.close()
+            self.disarmTimeout()
+            raise
+
     def fetchmany(self, sql, values=None, log=False) -> List:
         return self.run_sql(sql, values, log)
 
@@ -90,3 +227,190 @@ class DatabaseConnection:
             else:
                 sql = f"truncate table {table}"
             return self.run_sql(sql, log)
+
+
+class PooledConnection(DatabaseConnection):
+    """
+    Connection leased from a ConnectionPool: close() gives it back to the
+    pool instead of closing the sqlite3 connection. Leases are reentrant
+    within a thread, the connection goes back on the last close().
+    """
+
+    def __init__(self, pool: "ConnectionPool") -> None:
+        super().__init__(pool.databaseType, pool.databaseName)
+        self.pool = pool
+        self.queryTimeout = pool.queryTimeout
+        self.owner: int | None = None
+        self.leases = 0
+        self.lastUsed = time.monotonic()
+
+    def connect(self, **kwargs):
+        # Leases may move between threads, but never run concurrently
+        if self.conn is None:
+            if self.pool.readOnly:
+                # The file must exist, it is created by the read-write pool
+                self.databaseName = (
+                    f"file:{quote(os.path.abspath(self.pool.databaseName))}?mode=ro"
+                )
+                kwargs["uri"] = True
+            super().connect(check_same_thread=False, **kwargs)
+            if self.queryTimeout > 0:
+                self.conn.set_progress_handler(self.timedOut, DB_QUERY_TIMEOUT_STEPS)
+            for pragma in self.pool.pragmas:
+                self.run_pragma(pragma)
+            for name, nargs, function in self.pool.functions:
+                self.conn.create_function(name, nargs, function, deterministic=True)
+        return self.conn
+
+    def close(self, commit=False):
+        self.pool.release(self, commit=commit)
+
+    def discard(self) -> None:
+        super().close()
+
+    def isHealthy(self) -> bool:
+        try:
+            self.getConn().execute("select 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Dropping broken database connection: {e}")
+            return False
+
+
+class ConnectionPool:
+    """
+    At most `maxSize` long lived connections. A thread gets back the
+    connection it used last when it is idle, so the UDP workers and the
+    REST threads keep their own connection and sqlite page cache.
+    A `readOnly` pool opens the file with mode=ro, and `queryTimeout`
+    (seconds) interrupts longer statements with sqlite3.OperationalError.
+    """
+
+    def __init__(
+        self,
+        databaseType=None,
+        databaseName=None,
+        maxSize: int = DB_POOL_SIZE,
+        timeout: float = DB_POOL_TIMEOUT,
+        pragmas: list[str] | None = None,
+        functions: list[tuple] | None = None,
+        readOnly: bool = False,
+        queryTimeout: float = 0.0,
+    ) -> None:
+        self.databaseType = databaseType
+        self.databaseName = databaseName
+        self.pragmas = pragmas or []  # run on every new connection
+        self.functions = functions or []  # (name, nargs, callable) sql functions
+        self.readOnly = readOnly
+        self.queryTimeout = queryTimeout
+        self.maxSize = max(1, maxSize)
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.idle: list[PooledConnection] = []
+        self.leased: set[PooledConnection] = set()
+        self.size = 0
+        self.local = threading.local()
+
+    def acquire(self) -> PooledConnection:
+        conn: PooledConnection | None = getattr(self.local, "conn", None)
+        if conn is not None:
+            # Nested use in the same thread
+            conn.leases += 1
+            return conn
+
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.timeout
+        with self.cond:
+            while True:
+                conn = next((c for c in self.idle if c.owner == me), None)
+                if conn is None and self.idle:
+                    conn = self.idle[-1]
+                if conn is not None:
+                    self.idle.remove(conn)
+                    break
+                if self.size < self.maxSize:
+                    self.size += 1
+                    break
+                if self._reclaim():
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    raise sqlite3.OperationalError(
+                        f"Database connection pool exhausted ({self.maxSize} connections)"
+                    )
+
+        try:
+            if conn is not None and (
+                time.monotonic() - conn.lastUsed > DB_POOL_HEALTHCHECK
+                and not conn.isHealthy()
+            ):
+                conn.discard()
+                conn = None
+            if conn is None:
+                conn = PooledConnection(self)
+                conn.connect()
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+
+        conn.owner = me
+        conn.leases = 1
+        self.local.conn = conn
+        with self.cond:
+            self.leased.add(conn)
+        return conn
+
+    def _reclaim(self) -> bool:
+        # Connections leaked by threads that ended without closing them
+        alive = {t.ident for t in threading.enumerate()}
+        leaked = [c for c in self.leased if c.owner not in alive]
+        for conn in leaked:
+            logger.warning("Reclaiming database connection leaked by a dead thread")
+            self.leased.discard(conn)
+            conn.leases = 0
+            conn.discard()
+            self.size -= 1
+        return bool(leaked)
+
+    def release(self, conn: PooledConnection, commit=False) -> None:
+        conn.leases -= 1
+        if conn.leases > 0:
+            return
+        if getattr(self.local, "conn", None) is conn:
+            self.local.conn = None
+        try:
+            if conn.conn is not None and conn.conn.in_transaction:
+                if commit:
+                    conn.conn.commit()
+                else:
+                    conn.conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Dropping database connection: {e}")
+            conn.discard()
+        conn.lastUsed = time.monotonic()
+        with self.cond:
+            self.leased.discard(conn)
+            if conn.conn is None:
+                self.size -= 1
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+
+    def closeAll(self) -> None:
+        # Only the idle connections, leased ones are closed when released
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for conn in idle:
+            conn.discard()
+
+    def getStats(self) -> dict:
+        with self.cond:
+            return {
+                "size": self.size,
+                "max_size": self.maxSize,
+                "idle": len(self.idle),
+                "leased": self.size - len(self.idle),
+            }
@@ -0,0 +1,206 @@
+#
+# Write-behind for the Database.log_* inserts: a single writer thread owns
+# the sqlite write lock and commits the queued rows in batches
+#
+import atexit
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from operator import itemgetter
+
+from metrics import DB_WRITE_BATCH_ROWS, DB_WRITE_BATCH_SECONDS, DB_WRITE_DROPPED
+
+logger = logging.getLogger(__name__)
+
+DB_WRITE_BEHIND = os.getenv("BESIM_DB_WRITE_BEHIND", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+DB_WRITE_BATCH = int(os.getenv("BESIM_DB_WRITE_BATCH", "500"))  # rows
+DB_WRITE_INTERVAL = int(os.getenv("BESIM_DB_WRITE_INTERVAL", "500"))  # ms
+DB_WRITE_QUEUE = int(os.getenv("BESIM_DB_WRITE_QUEUE", "10000"))  # rows
+DB_WRITE_PUT_TIMEOUT = 1.0  # seconds a caller waits on a full queue
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Inserts are queued as (table, sql, values) and written with executemany,
+    one transaction every `batchSize` rows or `interval` ms. When the queue is
+    full callers wait up to DB_WRITE_PUT_TIMEOUT, then the row is dropped and
+    counted. stop() drains the queue, and is also run at exit; rows put
+    after it are written synchronously. `onCommit` is called with the tables
+    of every committed transaction, `onRows` with each table and its
+    committed rows.
+    """
+
+    def __init__(
+        self,
+        pool,
+        batchSize: int = DB_WRITE_BATCH,
+        interval: int = DB_WRITE_INTERVAL,
+        queueSize: int = DB_WRITE_QUEUE,
+        onCommit=None,
+        onRows=None,
+    ) -> None:
+        threading.Thread.__init__(self, name="db-writer", daemon=True)
+        self.pool = pool
+        self.batchSize = max(1, batchSize)
+        self.interval = interval / 1000.0
+        self.queue: queue.Queue = queue.Queue(maxsize=queueSize)
+        self.onCommit = onCommit
+        self.onRows = onRows
+        self.startLock = threading.Lock()
+        self.stopped = False
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def put(self, table: str, sql: str, values: tuple) -> bool:
+        if self.stopped:
+            self.writeNow([(table, sql, values)])
+            return True
+        if not self.is_alive():
+            with self.startLock:
+                if self.ident is None and not self.stopped:
+                    self.start()
+                    atexit.register(self.stop)
+        try:
+            self.queue.put((table, sql, values), timeout=DB_WRITE_PUT_TIMEOUT)
+            if self.stopped and not self.is_alive():
+                # Raced with stop(), which may have drained the queue already
+                self.drain()
+            return True
+        except queue.Full:
+            self.dropped += 1
+            DB_WRITE_DROPPED.labels(table, "full").inc()
+            if self.dropped % 100 == 1:
+                logger.warning(
+                    f"Database write queue full, {self.dropped} rows dropped so far"
+                )
+            return False
+
+    def flush(self) -> None:
+        # Wait for everything queued so far to be committed
+        if self.is_alive():
+            self.queue.join()
+
+    def stop(self) -> None:
+        with self.startLock:
+            self.stopped = True
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        self.drain()
+
+    def drain(self) -> None:
+        # Rows left in the queue once the thread is gone (it owns the None)
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+            if item is not None:
+                batch.append(item)
+        if batch:
+            self.writeNow(batch)
+
+    def writeNow(self, batch: list) -> None:
+        # In the calling thread, on a connection of its own
+        conn = self.pool.acquire()
+        try:
+            self.write(conn, batch)
+        finally:
+            conn.close(commit=True)
+
+    def run(self) -> None:
+        conn = self.pool.acquire()
+        try:
+            stopping = False
+            while not stopping:
+                item = self.queue.get()
+                if item is None:
+                    self.queue.task_done()
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.interval
+                while len(batch) < self.batchSize:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = (
+                            self.queue.get(timeout=remaining)
+                            if remaining > 0
+                            else self.queue.get_nowait()
+                        )
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # Nothing can follow, write this last batch and stop
+                        self.queue.task_done()
+                        stopping = True
+                        break
+                    batch.append(item)
+                try:
+                    self.write(conn, batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+        finally:
+            conn.close(commit=True)
+
+    def write(self, conn, batch: list) -> None:
+        # Consecutive rows of the same statement go in one executemany
+        groups = [
+            (table, sql, [values for _, _, values in rows])
+            for (table, sql), rows in itertools.groupby(batch, key=itemgetter(0, 1))
+        ]
+        sqlite = conn.getConn()
+        try:
+            with sqlite:
+                for table, sql, rows in groups:
+                    self._executemany(sqlite, table, sql, rows)
+            self.written += len(batch)
+            self._committed(groups)
+        except sqlite3.Error:
+            # Retry one statement at a time so that a bad one doesn't lose the others
+            for table, sql, rows in groups:
+                try:
+                    with sqlite:
+                        self._executemany(sqlite, table, sql, rows)
+                    self.written += len(rows)
+                    self._committed([(table, sql, rows)])
+                except sqlite3.Error:
+                    self.dropped += len(rows)
+                    DB_WRITE_DROPPED.labels(table, "error").inc(len(rows))
+                    logger.error(
+                        f"Dropped {len(rows)} rows for {table}: {traceback.format_exc()}"
+                    )
+        self.batches += 1
+        DB_WRITE_BATCH_ROWS.observe(len(batch))
+
+    def _executemany(self, sqlite, table: str, sql: str, rows: list) -> None:
+        with DB_WRITE_BATCH_SECONDS.labels(table).time():
+            sqlite.executemany(sql, rows)
+
+    def _committed(self, groups: list) -> None:
+        if self.onCommit is not None:
+            self.onCommit(*{table for table, _, _ in groups})
+        if self.onRows is not None:
+            for table, _, rows in groups:
+                self.onRows(table, rows)
+
+    def getStats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
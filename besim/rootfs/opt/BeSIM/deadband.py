@@ -0,0 +1,63 @@
+#
+# Change based recording of the room temperature samples received with STATUS
+#
+import os
+import threading
+import time
+
+TEMP_DEADBAND = float(os.getenv("BESIM_TEMP_DEADBAND", "0.1"))  # degC
+TEMP_HEARTBEAT = int(os.getenv("BESIM_TEMP_HEARTBEAT", "900"))  # seconds
+
+EPSILON = 1e-6  # temperatures come in tenths of degree
+
+
+class DeadbandRecorder:
+    """
+    Decides whether a sample must be written: when temp moved by at least
+    `deadband` from the last written one, when settemp or heating changed,
+    or when `heartbeat` seconds passed. What is not written equals the last
+    written sample (within the deadband), so the history is a step function
+    and a gap longer than the heartbeat means the device was offline.
+    heartbeat=0 writes every sample.
+    """
+
+    def __init__(
+        self, deadband: float = TEMP_DEADBAND, heartbeat: int = TEMP_HEARTBEAT
+    ) -> None:
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.last: dict = {}
+        self.accepted = 0
+        self.suppressed = 0
+
+    def accept(self, key, temp, settemp, heating, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            last = self.last.get(key)
+            if (
+                self.heartbeat > 0
+                and last is not None
+                and now - last[0] < self.heartbeat
+                and abs(temp - last[1]) < self.deadband - EPSILON
+                and settemp == last[2]
+                and heating == last[3]
+            ):
+                self.suppressed += 1
+                return False
+            self.last[key] = (now, temp, settemp, heating)
+            self.accepted += 1
+            return True
+
+    def forget(self, key) -> None:
+        # Next sample of key is written whatever its value
+        with self.lock:
+            self.last.pop(key, None)
+
+    def getStats(self) -> dict:
+        return {
+            "deadband": self.deadband,
+            "heartbeat": self.heartbeat,
+            "accepted": self.accepted,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,124 @@
+#
+# Unknown UDP messages and API calls are stored once per distinct content,
+# with first/last seen times and a counter, and their bodies zlib compressed
+#
+import hashlib
+import sqlite3
+import zlib
+
+from partitions import ListPartitions, PartitionName
+
+# table: (content columns, compressed columns)
+UNKNOWN: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {
+    "unknown_udp": (
+        ("source", "type", "code", "payload", "unparsed_payload", "raw_data"),
+        ("payload", "unparsed_payload", "raw_data"),
+    ),
+    "unknown_api": (
+        (
+            "source",
+            "host",
+            "method",
+            "uri",
+            "headers",
+            "body",
+            "rm_resp_code",
+            "rm_res_body",
+        ),
+        ("body",),
+    ),
+}
+
+COLUMN_TYPES = {
+    "code": "INTEGER",
+    "payload": "BLOB",
+    "unparsed_payload": "BLOB",
+    "raw_data": "BLOB",
+    "body": "BLOB",
+}
+
+
+def ContentHash(*values) -> bytes:
+    # Length prefixed, so that values can't run into each other
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if value is None:
+            digest.update(b"\xff")
+            continue
+        data = value if isinstance(value, bytes) else str(value).encode()
+        digest.update(len(data).to_bytes(4, "little") + data)
+    return digest.digest()
+
+
+def Compress(value) -> bytes | None:
+    if value is None:
+        return None
+    return zlib.compress(value if isinstance(value, bytes) else str(value).encode())
+
+
+def Unzip(value: bytes | None) -> bytes | None:
+    # sqlite function unzip(), registered on every connection
+    return None if value is None else zlib.decompress(value)
+
+
+def UpsertSql(table: str) -> str:
+    columns = UNKNOWN[table][0]
+    names = ", ".join(columns)
+    placeholders = ", ".join("?" * (len(columns) + 3))
+    return (
+        f"insert into {table}(hash, first_seen, last_seen, {names}) values ({placeholders}) "
+        "on conflict(hash) do update set last_seen = max(last_seen, excluded.last_seen), count = count + 1"
+    )
+
+
+def UpsertValues(table: str, ts: int, values: tuple) -> tuple:
+    # values in UNKNOWN[table] column order, as received
+    columns, compressed = UNKNOWN[table]
+    stored = tuple(
+        Compress(value) if column in compressed else value
+        for column, value in zip(columns, values)
+    )
+    return (ContentHash(*values), ts, ts) + stored
+
+
+def CreateTable(sqlite: sqlite3.Connection, table: str) -> None:
+    columns = ", ".join(
+        f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in UNKNOWN[table][0]
+    )
+    sqlite.execute(
+        f"create table {table}(hash BLOB NOT NULL, first_seen INTEGER NOT NULL, last_seen INTEGER NOT NULL, count INTEGER NOT NULL DEFAULT 1, {columns})"
+    )
+    sqlite.execute(f"create unique index {table}_hash on {table}(hash)")
+    sqlite.execute(f"create index {table}_last_seen on {table}(last_seen)")
+
+
+def DeduplicateTables(sqlite: sqlite3.Connection) -> None:
+    # Migration step: fold the captured rows (a partitioned view, or a plain
+    # table) into one row per content
+    for table, (columns, _) in UNKNOWN.items():
+        names = ", ".join(columns)
+        kind = sqlite.execute(
+            "select type from sqlite_master where name = ?", (table,)
+        ).fetchone()
+        rows = (
+            sqlite.execute(
+                f"select min(ts), max(ts), count(*), {names} from {table} group by {names}"
+            ).fetchall()
+            if kind is not None
+            else []
+        )
+        if kind is not None:
+            sqlite.execute(f"drop {kind[0]} {table}")
+        months = ListPartitions(sqlite, table)
+        for month in months:
+            sqlite.execute(f"drop table {PartitionName(table, month)}")
+        if months:
+            sqlite.execute(
+                "delete from sqlite_sequence where name glob ?", (f"{table}_p[0-9]*",)
+            )
+        CreateTable(sqlite, table)
+        placeholders = ", ".join("?" * (len(columns) + 4))
+        insert = f"insert into {table}(hash, first_seen, last_seen, count, {names}) values ({placeholders})"
+        for first, last, count, *values in rows:
+            digest, _, _, *stored = UpsertValues(table, first, tuple(values))
+            sqlite.execute(insert, (digest, first, last, count, *stored))
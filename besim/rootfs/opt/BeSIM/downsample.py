@@ -0,0 +1,50 @@
+#
+# Largest-Triangle-Three-Buckets downsampling of the history rows, so that a
+# chart never gets more points than it can draw and still keeps the peaks
+#
+import numpy as np
+
+
+def LttbIndices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    # Indices of the kept samples. First and last are always kept, every
+    # bucket in between keeps the sample forming the largest triangle with the
+    # one kept before and the average of the next bucket
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points <= 2:
+        return np.array([0, n - 1][:points])
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    # Empty samples don't pull the averages nor win a bucket
+    valid = ~np.isnan(y)
+    kept = np.empty(points, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        nextStart, nextEnd = (end, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        nextValid = valid[nextStart:nextEnd]
+        if nextValid.any():
+            avgX = x[nextStart:nextEnd][nextValid].mean()
+            avgY = y[nextStart:nextEnd][nextValid].mean()
+        else:
+            avgX, avgY = x[nextStart], y[a]
+        area = np.abs(
+            (x[a] - avgX) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avgY - y[a])
+        )
+        kept[i + 1] = a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+    return kept
+
+
+def Lttb(rows: list | None, points: int | None, column: str = "temp") -> list | None:
+    # Rows (dicts with epoch ms ts) downsampled to `points` on `column`
+    if not rows or not points or len(rows) <= points:
+        return rows
+    x = np.fromiter((row["ts"] for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter(
+        (np.nan if row[column] is None else row[column] for row in rows),
+        dtype=np.float64,
+        count=len(rows),
+    )
+    return [rows[i] for i in LttbIndices(x, y, points)]
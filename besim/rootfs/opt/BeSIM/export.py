@@ -0,0 +1,105 @@
+#
+# Bulk export of the history tables as NDJSON or CSV, encoded batch by batch
+# so that the whole history never sits in memory
+#
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator
+
+# kind: (table, exported columns, select list, time column). {scale} is the
+# stored temperature scale, blobs are exported as hex
+EXPORTS: dict[str, tuple[str, tuple[str, ...], str, str]] = {
+    "temperature": (
+        "besim_temperature",
+        ("ts", "thermostat", "temp", "settemp", "heating"),
+        "ts, thermostat, temp / {scale}, settemp / {scale}, heating",
+        "ts",
+    ),
+    "weather": (
+        "besim_outside_temperature",
+        ("ts", "temp"),
+        "ts, temp / {scale}",
+        "ts",
+    ),
+    "calls": (
+        "web_traces",
+        ("ts", "source", "adapterMap", "host", "uri", "elapsed", "response_status"),
+        "ts, source, adapterMap, host, uri, elapsed, response_status",
+        "ts",
+    ),
+    "unknown_udp": (
+        "unknown_udp",
+        (
+            "ts",
+            "first_seen",
+            "count",
+            "source",
+            "type",
+            "code",
+            "payload",
+            "unparsed_payload",
+            "raw_data",
+        ),
+        "last_seen, first_seen, count, source, type, code, hex(unzip(payload)), hex(unzip(unparsed_payload)), hex(unzip(raw_data))",
+        "last_seen",
+    ),
+    "unknown_api": (
+        "unknown_api",
+        (
+            "ts",
+            "first_seen",
+            "count",
+            "source",
+            "host",
+            "method",
+            "uri",
+            "headers",
+            "body",
+            "rm_resp_code",
+            "rm_res_body",
+        ),
+        "last_seen, first_seen, count, source, host, method, uri, headers, hex(unzip(body)), rm_resp_code, rm_res_body",
+        "last_seen",
+    ),
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def NdjsonChunks(columns: tuple, batches: Iterable[list]) -> Iterator[str]:
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+
+
+def CsvChunks(columns: tuple, batches: Iterable[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def EncodeChunks(format: str, columns: tuple, batches: Iterable[list]) -> Iterator[str]:
+    if format == "csv":
+        return CsvChunks(columns, batches)
+    return NdjsonChunks(columns, batches)
+
+
+def GzipChunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    # Streaming gzip: only what zlib holds back is buffered
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
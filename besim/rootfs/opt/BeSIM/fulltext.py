@@ -0,0 +1,85 @@
+#
+# FTS5 indexes of the text columns of the partitioned tables, used by the
+# call history filters instead of like '%value%' scans
+#
+import re
+import sqlite3
+
+# unicode61 tokens: runs of letters and digits, case folded
+TOKEN = re.compile(r"[^\W_]+")
+
+# Indexed columns of each partitioned table with a full-text index
+FULLTEXT: dict[str, tuple[str, ...]] = {
+    "web_traces": ("source", "adapterMap", "host", "uri", "response_status"),
+}
+
+
+def CreateFulltext(sqlite: sqlite3.Connection, table: str, columns: tuple) -> str:
+    # External content index of table, kept in sync by triggers. Dropping the
+    # table drops the triggers, the index must be dropped with it
+    name = f"{table}_fts"
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    sqlite.execute(
+        f"create virtual table if not exists {name} using fts5({names}, content='{table}', content_rowid='id', prefix='2 3')"
+    )
+    sqlite.execute(
+        f"create trigger if not exists {table}_fts_insert after insert on {table} begin insert into {name}(rowid, {names}) values (new.id, {new}); end"
+    )
+    sqlite.execute(
+        f"create trigger if not exists {table}_fts_delete after delete on {table} begin insert into {name}({name}, rowid, {names}) values ('delete', old.id, {old}); end"
+    )
+    return name
+
+
+def Phrase(text: str) -> str:
+    # Tokens of text in sequence, the last one as a prefix
+    return '"' + text.replace('"', '""') + '"*'
+
+
+def MatchQuery(base: str, q: str | None = None, filter: dict | None = None) -> str:
+    # FTS5 query: every word of q in any column and every filter value in its
+    # column. Empty when there is nothing to match
+    terms = [Phrase(word) for word in (q or "").split()]
+    for key, value in (filter or {}).items():
+        if key not in FULLTEXT[base]:
+            raise ValueError(f"Invalid filter {key!r}, allowed {FULLTEXT[base]}")
+        if str(value).strip():
+            terms.append(f"{key} : {Phrase(str(value))}")
+    return " AND ".join(terms)
+
+
+def Tokens(value) -> list[str]:
+    return TOKEN.findall(str(value).casefold()) if value is not None else []
+
+
+def PhraseIn(phrase: list[str], tokens: list[str]) -> bool:
+    n = len(phrase)
+    return any(
+        tokens[i : i + n - 1] == phrase[:-1]
+        and tokens[i + n - 1].startswith(phrase[-1])
+        for i in range(len(tokens) - n + 1)
+    )
+
+
+def RowMatcher(base: str, q: str | None = None, filter: dict | None = None):
+    # What MatchQuery matches, for rows that are not in the index (memory
+    # backend). None when there is nothing to match
+    terms = [(FULLTEXT[base], Tokens(word)) for word in (q or "").split()]
+    for key, value in (filter or {}).items():
+        if key not in FULLTEXT[base]:
+            raise ValueError(f"Invalid filter {key!r}, allowed {FULLTEXT[base]}")
+        if str(value).strip():
+            terms.append(((key,), Tokens(value)))
+    terms = [(columns, phrase) for columns, phrase in terms if phrase]
+    if not terms:
+        return None
+
+    def matches(row: dict) -> bool:
+        return all(
+            any(PhraseIn(phrase, Tokens(row[column])) for column in columns)
+            for columns, phrase in terms
+        )
+
+    return matches
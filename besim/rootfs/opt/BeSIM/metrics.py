@@ -0,0 +1,168 @@
+#
+# Prometheus/OpenMetrics instrumentation of BeSIM internals, served at /metrics
+#
+from typing import Any, Callable
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from status import getStatus
+
+# Sub-millisecond to a few seconds: handlers run in the 100us range, while
+# cseq round trips and upstream calls go over the network
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+UDP_PACKETS = Counter(
+    "besim_udp_packets",
+    "UDP messages by message type and direction",
+    ["msg", "direction"],
+)
+UDP_HANDLER_SECONDS = Histogram(
+    "besim_udp_handler_seconds",
+    "Time spent handling an incoming UDP message",
+    ["msg"],
+    buckets=LATENCY_BUCKETS,
+)
+CSEQ_RTT_SECONDS = Histogram(
+    "besim_cseq_rtt_seconds",
+    "Round trip time between a request and the device response",
+    ["msg"],
+    buckets=LATENCY_BUCKETS,
+)
+CSEQ_TIMEOUTS = Counter(
+    "besim_cseq_timeouts",
+    "Requests for which the device response did not arrive in time",
+    ["msg"],
+)
+DB_INSERT_SECONDS = Histogram(
+    "besim_db_insert_seconds",
+    "Time the caller spends inserting (or queueing) a row into the database",
+    ["table"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_WRITE_BATCH_SECONDS = Histogram(
+    "besim_db_write_batch_seconds",
+    "Time spent by the database writer on the rows of a table in a batch",
+    ["table"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_WRITE_BATCH_ROWS = Histogram(
+    "besim_db_write_batch_rows",
+    "Rows committed per database writer transaction",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+DB_WRITE_DROPPED = Counter(
+    "besim_db_write_dropped",
+    "Rows the database writer could not write",
+    ["table", "reason"],
+)
+PROXY_UPSTREAM_SECONDS = Histogram(
+    "besim_proxy_upstream_seconds",
+    "Time spent waiting for the upstream server in proxy mode",
+    ["host", "behaviour"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class BesimCollector(Collector):
+    """Values that are read when scraped instead of being counted as they happen"""
+
+    def __init__(self) -> None:
+        self.udpServer: Any = None
+        self.weatherCacheInfo: Callable | None = None
+        self.dbPool: Any = None
+        self.dbWriter: Any = None
+        self.dbResults: Any = None
+
+    def collect(self):
+        status = getStatus()
+        store = GaugeMetricFamily(
+            "besim_status_entries", "Entries in the status store", labels=["kind"]
+        )
+        devices = list(status["devices"].values())
+        store.add_metric(["peers"], len(status["peers"]))
+        store.add_metric(["devices"], len(devices))
+        store.add_metric(["rooms"], sum(len(d["rooms"]) for d in devices))
+        store.add_metric(["pending_results"], sum(len(d["results"]) for d in devices))
+        yield store
+
+        if self.udpServer is not None:
+            stats = self.udpServer.getIngressStats()
+            yield GaugeMetricFamily(
+                "besim_udp_queue_depth",
+                "Datagrams waiting in the UDP ingress queues",
+                value=stats["queue_depth"],
+            )
+            yield CounterMetricFamily(
+                "besim_udp_queue_dropped",
+                "Datagrams dropped because the UDP ingress queue was full",
+                value=stats["dropped"],
+            )
+            scheduler = self.udpServer.scheduler.getStats()
+            yield GaugeMetricFamily(
+                "besim_scheduler_pending",
+                "Deferred device actions waiting to run",
+                value=scheduler["pending"],
+            )
+
+        if self.dbPool is not None:
+            pool = self.dbPool.getStats()
+            connections = GaugeMetricFamily(
+                "besim_db_pool_connections",
+                "Database connections in the pool",
+                labels=["state"],
+            )
+            connections.add_metric(["idle"], pool["idle"])
+            connections.add_metric(["leased"], pool["leased"])
+            yield connections
+
+        if self.dbWriter is not None:
+            yield GaugeMetricFamily(
+                "besim_db_write_queue_depth",
+                "Rows waiting for the database writer",
+                value=self.dbWriter.queue.qsize(),
+            )
+
+        if self.dbResults is not None:
+            stats = self.dbResults.getStats()
+            results = CounterMetricFamily(
+                "besim_db_result_cache_requests",
+                "History queries by result cache outcome",
+                labels=["result"],
+            )
+            results.add_metric(["hit"], stats["hits"])
+            results.add_metric(["miss"], stats["misses"])
+            yield results
+
+        if self.weatherCacheInfo is not None:
+            info = self.weatherCacheInfo()
+            weather = CounterMetricFamily(
+                "besim_weather_cache_requests",
+                "Weather lookups by cache result",
+                labels=["result"],
+            )
+            weather.add_metric(["hit"], info.hits)
+            weather.add_metric(["miss"], info.misses)
+            yield weather
+
+
+COLLECTOR = BesimCollector()
+REGISTRY.register(COLLECTOR)
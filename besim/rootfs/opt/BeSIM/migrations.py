@@ -0,0 +1,203 @@
+#
+# Versioned schema migrations, tracked in the sqlite user_version
+#
+import logging
+import sqlite3
+import time
+from typing import Callable, NamedTuple
+
+from partitions import FulltextTables, PartitionTables
+from dedup import DeduplicateTables
+
+logger = logging.getLogger(__name__)
+
+# Version of the tables created by Database.create_tables, the first migration
+# starts from here
+BASE_VERSION = 7
+
+PROGRESS_INTERVAL = 5.0  # seconds between progress messages of a long step
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL statements, or callables taking the sqlite3.Connection for data migrations
+    steps: tuple[str | Callable[[sqlite3.Connection], None], ...]
+
+
+# ISO 8601 TEXT (with utc offset) to epoch milliseconds, sqlite < 3.42 has no unixepoch(.., 'subsec')
+EPOCH_MS = "cast(round((julianday({0}) - 2440587.5) * 86400000) as integer)"
+# Degrees to tenths of degree
+TENTHS = "cast(round({0} * 10) as integer)"
+
+
+def Rebuild(table: str, columns: str, select: str, indexes: tuple[str, ...]) -> tuple:
+    # sqlite can't change a column type in place: copy to a new table and swap.
+    # rowid is kept, the REST api exposes it. Rows without a valid ts are dropped
+    names = ", ".join(column.split()[0] for column in columns.split(","))
+    return (
+        f"create table {table}_new({columns})",
+        f"insert into {table}_new(rowid, {names}) select rowid, {select} from {table} where julianday(ts) is not null",
+        f"drop table {table}",
+        f"alter table {table}_new rename to {table}",
+    ) + indexes
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        8,
+        "Index ts on every table",
+        (
+            "create index if not exists besim_outside_temperature_ts on besim_outside_temperature(ts)",
+            "create index if not exists besim_temperature_ts on besim_temperature(ts)",
+            "create index if not exists web_traces_ts on web_traces(ts)",
+            "create index if not exists unknown_udp_ts on unknown_udp(ts)",
+            "create index if not exists unknown_api_ts on unknown_api(ts)",
+        ),
+    ),
+    Migration(
+        9,
+        "Index (thermostat, ts) on besim_temperature",
+        (
+            "create index if not exists besim_temperature_thermostat_ts on besim_temperature(thermostat, ts)",
+        ),
+    ),
+    Migration(
+        10,
+        "Integer epoch ms timestamps, integer room id and temperatures in tenths of degree",
+        Rebuild(
+            "besim_outside_temperature",
+            "ts INTEGER NOT NULL, temp INTEGER",
+            f"{EPOCH_MS.format('ts')}, {TENTHS.format('temp')}",
+            (
+                "create index besim_outside_temperature_ts on besim_outside_temperature(ts)",
+            ),
+        )
+        + Rebuild(
+            "besim_temperature",
+            "ts INTEGER NOT NULL, thermostat INTEGER, temp INTEGER, settemp INTEGER, heating INTEGER",
+            f"{EPOCH_MS.format('ts')}, cast(thermostat as integer), {TENTHS.format('temp')}, {TENTHS.format('settemp')}, cast(heating as integer)",
+            (
+                "create index besim_temperature_ts on besim_temperature(ts)",
+                "create index besim_temperature_thermostat_ts on besim_temperature(thermostat, ts)",
+            ),
+        )
+        + Rebuild(
+            "web_traces",
+            "ts INTEGER NOT NULL, source TEXT, adapterMap TEXT, host TEXT, uri TEXT, elapsed NUMERIC, response_status TEXT",
+            f"{EPOCH_MS.format('ts')}, source, adapterMap, host, uri, elapsed, response_status",
+            ("create index web_traces_ts on web_traces(ts)",),
+        )
+        + Rebuild(
+            "unknown_udp",
+            "ts INTEGER NOT NULL, source TEXT, type TEXT, code INTEGER, payload BLOB, unparsed_payload BLOB, raw_data BLOB",
+            f"{EPOCH_MS.format('ts')}, source, type, code, payload, unparsed_payload, raw_data",
+            ("create index unknown_udp_ts on unknown_udp(ts)",),
+        )
+        + Rebuild(
+            "unknown_api",
+            "ts INTEGER NOT NULL, source TEXT, host TEXT, method TEXT, uri TEXT, headers TEXT, body BLOB, rm_resp_code TEXT, rm_res_body TEXT",
+            f"{EPOCH_MS.format('ts')}, source, host, method, uri, headers, body, rm_resp_code, rm_res_body",
+            ("create index unknown_api_ts on unknown_api(ts)",),
+        ),
+    ),
+    Migration(
+        11,
+        "Hourly and daily temperature rollups",
+        tuple(
+            statement
+            for resolution, size in (("hour", 3600 * 1000), ("day", 86400 * 1000))
+            for statement in (
+                f"create table besim_temperature_{resolution}(thermostat INTEGER NOT NULL, ts INTEGER NOT NULL, samples INTEGER, temp_min INTEGER, temp_max INTEGER, temp_sum INTEGER, settemp_sum INTEGER, heating_samples INTEGER, PRIMARY KEY (thermostat, ts)) WITHOUT ROWID",
+                f"insert into besim_temperature_{resolution} select thermostat, ts - ts % {size}, count(*), min(temp), max(temp), total(temp), total(settemp), total(heating > 0) from besim_temperature where temp is not null group by 1, 2",
+                f"create table besim_outside_temperature_{resolution}(ts INTEGER NOT NULL PRIMARY KEY, samples INTEGER, temp_min INTEGER, temp_max INTEGER, temp_sum INTEGER) WITHOUT ROWID",
+                f"insert into besim_outside_temperature_{resolution} select ts - ts % {size}, count(*), min(temp), max(temp), total(temp) from besim_outside_temperature where temp is not null group by 1",
+            )
+        ),
+    ),
+    Migration(
+        12,
+        "Monthly partitions of the time series tables",
+        (PartitionTables,),
+    ),
+    Migration(
+        13,
+        "Full-text index of web_traces",
+        (FulltextTables,),
+    ),
+    Migration(
+        14,
+        "One row per distinct unknown UDP message and API call",
+        (DeduplicateTables,),
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version if MIGRATIONS else BASE_VERSION
+
+
+class MigrationRunner:
+    """
+    Applies the migrations above `fromVersion` in order. Every migration runs
+    in its own transaction together with the user_version update, so an
+    interrupted upgrade restarts from the last completed version and the
+    other connections only wait for one step at a time.
+    """
+
+    def __init__(self, migrations: list[Migration] = MIGRATIONS) -> None:
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.current: Migration | None = None
+        self.started = 0.0
+
+    def pending(self, fromVersion: int) -> list[Migration]:
+        return [m for m in self.migrations if m.version > fromVersion]
+
+    def run(self, sqlite: sqlite3.Connection, fromVersion: int) -> int:
+        pending = self.pending(fromVersion)
+        version = fromVersion
+        for index, migration in enumerate(pending, start=1):
+            logger.warning(
+                f"Database migration {index}/{len(pending)} to version {migration.version}: {migration.description}"
+            )
+            self.current = migration
+            self.started = time.monotonic()
+            lastReport = [self.started]
+
+            def progress() -> int:
+                now = time.monotonic()
+                if now - lastReport[0] >= PROGRESS_INTERVAL:
+                    lastReport[0] = now
+                    logger.warning(
+                        f"Database migration to version {migration.version} running for {now - self.started:.0f}s"
+                    )
+                return 0
+
+            sqlite.set_progress_handler(progress, 100000)
+            try:
+                with sqlite:
+                    for step in migration.steps:
+                        if callable(step):
+                            step(sqlite)
+                        else:
+                            sqlite.execute(step)
+                    sqlite.execute(f"pragma user_version = {migration.version}")
+            finally:
+                sqlite.set_progress_handler(None, 0)
+                self.current = None
+            version = migration.version
+            logger.warning(
+                f"Database migration to version {version} done in {time.monotonic() - self.started:.1f}s"
+            )
+        return version
+
+    def getStatus(self) -> dict:
+        current = self.current
+        return {
+            "running": current is not None,
+            "version": current.version if current is not None else None,
+            "description": current.description if current is not None else None,
+            "elapsed": (
+                round(time.monotonic() - self.started, 1)
+                if current is not None
+                else None
+            ),
+        }
@@ -0,0 +1,77 @@
+#
+# Cheap packet logging for the UDP hot path: lazy hexdumps, a ring buffer
+# of the last raw frames and rate limited warnings
+#
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import hexdump
+
+PACKET_TRACE_SIZE = int(os.getenv("BESIM_PACKET_TRACE_SIZE", "200"))
+UNEXPECTED_WARN_INTERVAL = float(os.getenv("BESIM_UNEXPECTED_WARN_INTERVAL", "300"))
+
+
+class HexDump:
+    """Formats the data only if the log record is actually emitted"""
+
+    __slots__ = ("data", "sep")
+
+    def __init__(self, data: bytes, sep=" ") -> None:
+        self.data = data
+        self.sep = sep
+
+    def __str__(self) -> str:
+        return hexdump.dump(self.data, sep=self.sep)
+
+
+class PacketTrace:
+    """The last `size` raw frames seen by the UDP server, formatted on demand"""
+
+    def __init__(self, size: int = PACKET_TRACE_SIZE) -> None:
+        self.frames: deque = deque(maxlen=size)
+
+    def record(self, direction: str, addr, data: bytes) -> None:
+        # deque.append is atomic, no lock needed
+        self.frames.append((time.time(), direction, addr, data))
+
+    def dump(self) -> list[dict]:
+        return [
+            {
+                "ts": datetime.fromtimestamp(ts, timezone.utc).astimezone().isoformat(),
+                "direction": direction,
+                "peer": f"{addr[0]}:{addr[1]}",
+                "length": len(data),
+                "data": hexdump.dump(data, sep=""),
+            }
+            for ts, direction, addr, data in list(self.frames)
+        ]
+
+
+class RateLimitedLogger:
+    """Emits a warning for a key at most once per interval, counting the suppressed ones"""
+
+    def __init__(
+        self, logger: logging.Logger, interval: float = UNEXPECTED_WARN_INTERVAL
+    ) -> None:
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last: dict = {}
+
+    def warning(self, key, msg: str, *args) -> None:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.last.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return
+            suppressed = entry[1] if entry is not None else 0
+            self.last[key] = [now, 0]
+        if suppressed:
+            msg += " (%d similar warnings suppressed)"
+            args += (suppressed,)
+        self.logger.warning(msg, *args)
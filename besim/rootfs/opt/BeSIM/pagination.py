@@ -0,0 +1,130 @@
+#
+# Keyset pagination of the call history and cached total counts
+#
+import threading
+from collections import Counter, OrderedDict
+
+COUNT_CACHE_SIZE = 256  # cached totals, oldest dropped first
+
+# Sort keys a page may be ordered by, as (expression, result column). Only
+# indexed columns are allowed, so every page costs the same; the last one is
+# unique and breaks the ties
+CALL_SORT = {
+    "ts": (("ts", "ts"), ("id", "rowid")),
+    "rowid": (("id", "rowid"),),
+}
+CALL_GROUP_SORT = {
+    "ts": (("max(ts)", "ts"), ("max(id)", "rowId")),
+    "rowid": (("max(id)", "rowId"),),
+}
+
+
+def SortKeys(sort: str | None, columns: dict) -> tuple[tuple, bool]:
+    # "ts desc" -> (sort keys, descending). Newest first by default
+    parts = (sort or "").split()
+    if not parts:
+        parts = ["ts", "desc"]
+    if (
+        len(parts) > 2
+        or parts[0] not in columns
+        or (len(parts) == 2 and parts[1].lower() not in ("asc", "desc"))
+    ):
+        raise ValueError(f"Invalid sort {sort!r}, allowed {list(columns)}")
+    return columns[parts[0]], len(parts) == 2 and parts[1].lower() == "desc"
+
+
+def OrderBy(keys: tuple, descending: bool) -> str:
+    direction = "desc" if descending else "asc"
+    return ", ".join(f"{expression} {direction}" for expression, _ in keys)
+
+
+def CursorValues(keys: tuple, cursor: str) -> tuple:
+    try:
+        values = tuple(int(value) for value in cursor.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor!r}") from None
+    if len(values) != len(keys):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return values
+
+
+def KeysetClause(keys: tuple, descending: bool, cursor: str | None) -> tuple:
+    # Rows after the cursor, as a row value comparison and its values
+    if not cursor:
+        return "", ()
+    values = CursorValues(keys, cursor)
+    expressions = ", ".join(expression for expression, _ in keys)
+    placeholders = ", ".join("?" * len(keys))
+    return (
+        f"({expressions}) {'<' if descending else '>'} ({placeholders})",
+        values,
+    )
+
+
+def SortRows(
+    rows: list, keys: tuple, descending: bool, cursor: str | None = None
+) -> list:
+    # In memory ORDER BY and KeysetClause, on the result columns of the keys
+    def key(row):
+        return tuple(row[column] for _, column in keys)
+
+    if cursor:
+        after = CursorValues(keys, cursor)
+        rows = [
+            row
+            for row in rows
+            if (key(row) < after if descending else key(row) > after)
+        ]
+    return sorted(rows, key=key, reverse=descending)
+
+
+def NextCursor(rows: list | None, keys: tuple, limit: int) -> str | None:
+    # Cursor of the last row of a full page, before ApiRows formats ts
+    if not rows or len(rows) < limit:
+        return None
+    return ",".join(str(rows[-1][column]) for _, column in keys)
+
+
+class CountCache:
+    """
+    Total row counts of a query, cached until the table it reads changes.
+    Every insert bumps the table generation, cached totals of an older
+    generation are recomputed on next use.
+    """
+
+    def __init__(self, maxSize: int = COUNT_CACHE_SIZE) -> None:
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.generations: Counter = Counter()
+        self.cache: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, *tables: str) -> None:
+        with self.lock:
+            self.generations.update(tables)
+
+    def get(self, table: str, key, compute):
+        with self.lock:
+            generation = self.generations[table]
+            cached = self.cache.get((table, key))
+            if cached is not None and cached[0] == generation:
+                self.cache.move_to_end((table, key))
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        # Computed unlocked, a concurrent insert leaves it with the older generation
+        value = compute()
+        with self.lock:
+            self.cache[(table, key)] = (generation, value)
+            self.cache.move_to_end((table, key))
+            while len(self.cache) > self.maxSize:
+                self.cache.popitem(last=False)
+        return value
+
+    def getStats(self) -> dict:
+        return {
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
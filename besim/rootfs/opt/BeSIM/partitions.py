@@ -0,0 +1,221 @@
+#
+# Monthly partitions of the time series tables. Each table is a view over
+# UNION ALL of <table>_pYYYYMM tables, so retention drops whole months
+# instead of deleting rows
+#
+import logging
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from fulltext import FULLTEXT, CreateFulltext
+
+logger = logging.getLogger(__name__)
+
+# Columns of every partitioned table (besides id) and extra indexes, ts is always indexed
+PARTITIONED: dict[str, tuple[str, tuple[str, ...]]] = {
+    "besim_outside_temperature": ("ts INTEGER NOT NULL, temp INTEGER", ()),
+    "besim_temperature": (
+        "ts INTEGER NOT NULL, thermostat INTEGER, temp INTEGER, settemp INTEGER, heating INTEGER",
+        ("thermostat, ts",),
+    ),
+    "web_traces": (
+        "ts INTEGER NOT NULL, source TEXT, adapterMap TEXT, host TEXT, uri TEXT, elapsed NUMERIC, response_status TEXT",
+        (),
+    ),
+}
+
+
+def ColumnNames(base: str) -> str:
+    return ", ".join(c.split()[0] for c in PARTITIONED[base][0].split(","))
+
+
+def MonthOf(ts: int) -> int:
+    # YYYYMM of an epoch ms timestamp, UTC
+    day = datetime.fromtimestamp(ts / 1000, timezone.utc)
+    return day.year * 100 + day.month
+
+
+def MonthRange(month: int) -> tuple[int, int]:
+    # [start, end) in epoch ms
+    year, month = divmod(month, 100)
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def PartitionName(base: str, month: int) -> str:
+    return f"{base}_p{month}"
+
+
+def ListPartitions(sqlite: sqlite3.Connection, base: str) -> list[int]:
+    pattern = re.compile(rf"^{base}_p(\d{{6}})$")
+    rows = sqlite.execute(
+        "select name from sqlite_master where type = 'table' and name like ?",
+        (f"{base}_p%",),
+    ).fetchall()
+    return sorted(int(m.group(1)) for (name,) in rows if (m := pattern.match(name)))
+
+
+def CreatePartition(sqlite: sqlite3.Connection, base: str, month: int) -> str:
+    # ids continue from the other partitions, the REST api uses them as row ids
+    columns, indexes = PARTITIONED[base]
+    name = PartitionName(base, month)
+    sqlite.execute(
+        f"create table if not exists {name}(id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+    )
+    # sqlite_sequence exists once an AUTOINCREMENT table does
+    lastId = sqlite.execute(
+        "select max(seq) from sqlite_sequence where name glob ?",
+        (f"{base}_p[0-9]*",),
+    ).fetchone()
+    sqlite.execute(f"create index if not exists {name}_ts on {name}(ts)")
+    for index in indexes:
+        suffix = index.replace(", ", "_")
+        sqlite.execute(f"create index if not exists {name}_{suffix} on {name}({index})")
+    if base in FULLTEXT:
+        CreateFulltext(sqlite, name, FULLTEXT[base])
+    if lastId is not None and lastId[0] is not None:
+        sqlite.execute(
+            "insert into sqlite_sequence(name, seq) select ?, ? where not exists (select 1 from sqlite_sequence where name = ?)",
+            (name, lastId[0], name),
+        )
+    return name
+
+
+def CreateView(sqlite: sqlite3.Connection, base: str) -> None:
+    months = ListPartitions(sqlite, base)
+    if not months:
+        CreatePartition(sqlite, base, MonthOf(time.time_ns() // 1_000_000))
+        months = ListPartitions(sqlite, base)
+    names = ColumnNames(base)
+    union = " union all ".join(
+        f"select id, {names} from {PartitionName(base, month)}" for month in months
+    )
+    sqlite.execute(f"drop view if exists {base}")
+    sqlite.execute(f"create view {base} as {union}")
+
+
+def PartitionTables(sqlite: sqlite3.Connection) -> None:
+    # Migration step: move the rows of the plain tables to monthly partitions
+    for base in PARTITIONED:
+        rc = sqlite.execute(
+            "select type from sqlite_master where name = ?", (base,)
+        ).fetchone()
+        if rc is None or rc[0] != "table":
+            continue
+        first, last = sqlite.execute(f"select min(ts), max(ts) from {base}").fetchone()
+        month = MonthOf(first) if first is not None else None
+        names = ColumnNames(base)
+        while month is not None and MonthRange(month)[0] <= last:
+            start, end = MonthRange(month)
+            name = CreatePartition(sqlite, base, month)
+            sqlite.execute(
+                f"insert into {name}(id, {names}) select rowid, {names} from {base} where ts >= ? and ts < ?",
+                (start, end),
+            )
+            month = MonthOf(end)
+        sqlite.execute(f"drop table {base}")
+        CreateView(sqlite, base)
+
+
+def FulltextTables(sqlite: sqlite3.Connection) -> None:
+    # Migration step: index the partitions created before the full-text indexes
+    for base, columns in FULLTEXT.items():
+        for month in ListPartitions(sqlite, base):
+            name = CreateFulltext(sqlite, PartitionName(base, month), columns)
+            sqlite.execute(f"insert into {name}({name}) values ('rebuild')")
+
+
+class Partitions:
+    """
+    Routes inserts to the partition of their month, creating it (and the
+    view over the partitions) on first use, and drops expired months.
+    """
+
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.known: dict[str, set[int]] = {}
+
+    def load(self) -> None:
+        conn = self.pool.acquire()
+        try:
+            sqlite = conn.getConn()
+            with self.lock:
+                self.known = {
+                    base: set(ListPartitions(sqlite, base)) for base in PARTITIONED
+                }
+        finally:
+            conn.close()
+
+    def table(self, base: str, ts: int) -> str:
+        month = MonthOf(ts)
+        if month not in self.known.get(base, ()):
+            with self.lock:
+                if base not in self.known or month not in self.known[base]:
+                    self._create(base, month)
+        return PartitionName(base, month)
+
+    def _create(self, base: str, month: int) -> None:
+        conn = self.pool.acquire()
+        try:
+            sqlite = conn.getConn()
+            with sqlite:
+                CreatePartition(sqlite, base, month)
+                CreateView(sqlite, base)
+                self.known[base] = set(ListPartitions(sqlite, base))
+            logger.info(f"Created partition {PartitionName(base, month)}")
+        finally:
+            conn.close()
+
+    def between(self, base: str, start: int, end: int) -> list[str]:
+        # Partitions overlapping [start, end], oldest first
+        return [
+            PartitionName(base, month)
+            for month in sorted(self.known.get(base, ()))
+            if MonthRange(month)[1] > start and MonthRange(month)[0] <= end
+        ]
+
+    def match(self, base: str, start: int, end: int) -> tuple[str, int]:
+        # Ids matching a full-text query in the partitions overlapping
+        # [start, end], and how many times the query must be bound
+        names = self.between(base, start, end)
+        if not names:
+            return "select null where 0", 0
+        return (
+            " union all ".join(
+                f"select rowid from {name}_fts where {name}_fts match ?"
+                for name in names
+            ),
+            len(names),
+        )
+
+    def drop_before(self, ts: int) -> dict:
+        # Whole months before ts are dropped, the month of ts is trimmed
+        rc = {"dropped": [], "deleted": 0}
+        conn = self.pool.acquire()
+        try:
+            sqlite = conn.getConn()
+            with self.lock, sqlite:
+                for base in PARTITIONED:
+                    months = ListPartitions(sqlite, base)
+                    for month in months:
+                        start, end = MonthRange(month)
+                        name = PartitionName(base, month)
+                        if end <= ts and month != months[-1]:
+                            if base in FULLTEXT:
+                                sqlite.execute(f"drop table {name}_fts")
+                            sqlite.execute(f"drop table {name}")
+                            rc["dropped"].append(name)
+                        elif start < ts:
+                            rc["deleted"] += sqlite.execute(
+                                f"delete from {name} where ts < ?", (ts,)
+                            ).rowcount
+                    CreateView(sqlite, base)
+                    self.known[base] = set(ListPartitions(sqlite, base))
+        finally:
+            conn.close()
+        return rc
@@ -0,0 +1,275 @@
+#
+# Low overhead latency tracking for the UDP hot path and an on-demand profiler
+#
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("BESIM_PROFILE_DIR", "/config")
+
+PHASES = ("decode", "handler", "db", "send")
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of nanosecond values: every power of two is split in
+    2**SUB_BITS linear buckets, so percentiles are within ~6% of the real value
+    whatever the magnitude.
+    """
+
+    SUB_BITS = 4
+    BUCKETS = 64 << SUB_BITS
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min: int | None = None
+        self.max = 0
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        bits = value.bit_length()
+        if bits <= cls.SUB_BITS + 1:
+            return value
+        shift = bits - cls.SUB_BITS - 1
+        return ((shift + 1) << cls.SUB_BITS) + (value >> shift) - (1 << cls.SUB_BITS)
+
+    @classmethod
+    def lowest(cls, index: int) -> int:
+        if index < 2 << cls.SUB_BITS:
+            return index
+        shift = (index >> cls.SUB_BITS) - 1
+        return ((index & ((1 << cls.SUB_BITS) - 1)) + (1 << cls.SUB_BITS)) << shift
+
+    def record(self, value: int) -> None:
+        value = max(0, value)
+        with self.lock:
+            self.counts[self.index(value)] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, round(self.count * p / 100.0))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.lowest(index), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            if self.count == 0:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "mean_us": round(self.total / self.count / 1000, 1),
+                "min_us": round((self.min or 0) / 1000, 1),
+                "p50_us": round(self.percentile(50) / 1000, 1),
+                "p90_us": round(self.percentile(90) / 1000, 1),
+                "p99_us": round(self.percentile(99) / 1000, 1),
+                "p999_us": round(self.percentile(99.9) / 1000, 1),
+                "max_us": round(self.max / 1000, 1),
+            }
+
+
+class PhaseTimer:
+    def __init__(self) -> None:
+        self.start = time.perf_counter_ns()
+        self.phases: dict[str, int] = {"decode": 0, "db": 0, "send": 0}
+
+
+class PhaseStats:
+    """
+    Splits the time spent on a message in decode, db, send and handler (what
+    is left) phases, and keeps one histogram per message type and phase.
+    The timer lives in a thread local, so code outside the UDP workers pays
+    a single attribute lookup.
+    """
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.histograms: dict[str, dict[str, LatencyHistogram]] = {}
+
+    def begin(self) -> PhaseTimer:
+        timer = self.local.timer = PhaseTimer()
+        return timer
+
+    def mark(self, phase: str) -> None:
+        # Time elapsed since begin() (used once, for decode)
+        timer: PhaseTimer | None = getattr(self.local, "timer", None)
+        if timer is not None:
+            timer.phases[phase] = time.perf_counter_ns() - timer.start
+
+    @contextmanager
+    def phase(self, phase: str):
+        timer: PhaseTimer | None = getattr(self.local, "timer", None)
+        if timer is None:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            timer.phases[phase] += time.perf_counter_ns() - start
+
+    def end(self, msg: str) -> None:
+        timer: PhaseTimer | None = getattr(self.local, "timer", None)
+        if timer is None:
+            return
+        self.local.timer = None
+        total = time.perf_counter_ns() - timer.start
+        phases = timer.phases | {"handler": total - sum(timer.phases.values())}
+
+        histograms = self.histograms.get(msg)
+        if histograms is None:
+            with self.lock:
+                histograms = self.histograms.setdefault(
+                    msg, {phase: LatencyHistogram() for phase in PHASES + ("total",)}
+                )
+        for phase, value in phases.items():
+            histograms[phase].record(value)
+        histograms["total"].record(total)
+
+    def snapshot(self) -> dict:
+        return {
+            msg: {phase: histogram.snapshot() for phase, histogram in phases.items()}
+            for msg, phases in list(self.histograms.items())
+        }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {}
+
+
+PHASE_STATS = PhaseStats()
+
+
+class HotPathProfiler:
+    """
+    Runtime switch to profile the UDP workers for a few seconds, either with
+    cProfile (exact, slower) or by sampling the thread stacks (cheap).
+    Results are written in `directory`.
+
+    Only one cProfile profiler can be enabled at a time (python 3.12), so in
+    cprofile mode the workers take turns until the profiling ends.
+    """
+
+    MODES = ("cprofile", "sampling")
+
+    def __init__(self, directory: str = PROFILE_DIR) -> None:
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.active = False
+        self.mode: str | None = None
+        self.until = 0.0
+        self.lastResult: list[str] = []
+        self.profile: cProfile.Profile | None = None
+        self.profileLock = threading.Lock()
+        self.samples: Counter = Counter()
+        self.interval = 0.005
+
+    def start(self, seconds: float, mode: str = "cprofile", interval=0.005) -> dict:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profiler mode {mode}")
+        with self.lock:
+            if self.active:
+                raise RuntimeError("Profiler already running")
+            self.active = True
+            self.mode = mode
+            self.until = time.time() + seconds
+            self.profile = cProfile.Profile() if mode == "cprofile" else None
+            self.samples = Counter()
+            self.interval = interval
+        if mode == "sampling":
+            threading.Thread(target=self._sample, name="profiler", daemon=True).start()
+        timer = threading.Timer(seconds, self.stop)
+        timer.daemon = True
+        timer.start()
+        logger.warning(f"Profiling UDP workers with {mode} for {seconds}s")
+        return self.status()
+
+    def runcall(self, fn, *args):
+        if not self.active or self.mode != "cprofile":
+            return fn(*args)
+        with self.profileLock:
+            if self.profile is None:
+                return fn(*args)
+            return self.profile.runcall(fn, *args)
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        names = {}
+        while self.active:
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self) -> list[str]:
+        with self.lock:
+            if not self.active:
+                return self.lastResult
+            self.active = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory, f"besim-profile-{datetime.now():%Y%m%d-%H%M%S}"
+        )
+        files = []
+        if self.mode == "cprofile":
+            with self.profileLock:
+                profile, self.profile = self.profile, None
+            if profile is not None and profile.getstats():
+                pstats.Stats(profile).dump_stats(f"{base}.prof")
+                with open(f"{base}.txt", "w") as f:
+                    pstats.Stats(f"{base}.prof", stream=f).sort_stats(
+                        "cumulative"
+                    ).print_stats(50)
+                files = [f"{base}.prof", f"{base}.txt"]
+        else:
+            # Collapsed stacks, as used by flamegraph.pl and speedscope
+            with open(f"{base}.collapsed.txt", "w") as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            files = [f"{base}.collapsed.txt"]
+
+        logger.warning(f"Profiling done: {files}")
+        self.lastResult = files
+        return files
+
+    def status(self) -> dict:
+        return {
+            "active": self.active,
+            "mode": self.mode,
+            "remaining": (
+                max(0.0, round(self.until - time.time(), 1)) if self.active else 0
+            ),
+            "files": self.lastResult,
+        }
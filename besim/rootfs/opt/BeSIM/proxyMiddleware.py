@@ -17,6 +17,7 @@ import typing as t
 import hexdump
 
 from database import Database
+from metrics import PROXY_UPSTREAM_SECONDS
 import time
 
 BEHAVIOUR = Enum(
@@ -219,19 +220,20 @@ class ProxyMiddleware(object):
                     )
                 )
             )
-            self.http_connection[http_host].connect()
-            self.http_connection[http_host].request(
-                env["REQUEST_METHOD"],
-                env["REQUEST_URI"],
-                proxy_body,
-                {x: y for x, y in req_headers.items()},
-                # {x: y for x, y in req.headers.to_wsgi_list()}
-            )
+            with PROXY_UPSTREAM_SECONDS.labels(http_host, behaviour.name).time():
+                self.http_connection[http_host].connect()
+                self.http_connection[http_host].request(
+                    env["REQUEST_METHOD"],
+                    env["REQUEST_URI"],
+                    proxy_body,
+                    {x: y for x, y in req_headers.items()},
+                    # {x: y for x, y in req.headers.to_wsgi_list()}
+                )
 
-            resp_org: http.client.HTTPResponse = self.http_connection[
-                http_host
-            ].getresponse()
-            body_org: str = "".join([chr(b) for b in resp_org.read()])
+                resp_org: http.client.HTTPResponse = self.http_connection[
+                    http_host
+                ].getresponse()
+                body_org: str = "".join([chr(b) for b in resp_org.read()])
             logging.debug(
                 pformat(("PROXY_RESPONSE", resp_org.headers.items(), body_org))
             )
@@ -2,6 +2,8 @@ import binascii
 import io
 import logging
 import os
+import threading
+from collections import Counter
 from typing import Optional
 
 # from pprint import pformat
@@ -19,21 +21,23 @@ from udpserver import (
     Wrapper,
 )
 from database import Database
+from metrics import UDP_PACKETS
+from profiling import PHASE_STATS
+from packetTrace import HexDump
 import time
 
 
 class ProxyUdpServer(UdpServer):
 
-    knocks = 0
-
     def __init__(
         self,
         addr,
         upstream: str,
         debugmode=False,
         datalog: Optional[io.TextIOWrapper] = None,
+        **kwargs,
     ):
-        super().__init__(addr, datalog=datalog)
+        super().__init__(addr, datalog=datalog, **kwargs)
         upstream_resolver = dns.resolver.Resolver()
         upstream_resolver.nameservers = [upstream]
         upstream_ip = next(
@@ -42,6 +46,13 @@ class ProxyUdpServer(UdpServer):
         logging.info(f"Upstream DNS Check: api.besmart-home.com = {upstream_ip}")
         self.cloud_addr = (upstream_ip, 6199)
         self.debugmode = debugmode
+        # Knocks (single 0x58 bytes) counted per peer until its next frame
+        self.knocks: Counter = Counter()
+        self.knocksLock = threading.Lock()
+
+    def shardOf(self, data: bytes, addr) -> int:
+        # By peer: a frame must reach the worker that counted the knocks before it
+        return hash(addr) % len(self.queues)
 
     def run(self):
         logging.info(f"Proxy UDP server is running to {self.cloud_addr}")
@@ -50,22 +61,26 @@ class ProxyUdpServer(UdpServer):
     def send_ENCODED_FRAME(self, addr, payload, response=0, write=0):
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.DEVICE_TIME, response, write=write)
-        logging.info(f"Sending {wrapper}")
+        logging.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logging.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logging.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return
 
     def handleCloudMsg(self, data: bytes, addr) -> str:
         # sourcery skip: extract-method, merge-comparisons
         if self.datalog is not None:
-            self.datalog.write(f'"C","{addr}","{hexdump.dump(data, sep='')}"\r\n')
-            self.datalog.flush()
-            os.fsync(self.datalog)
+            with self.datalogLock:
+                self.datalog.write(f'"C","{addr}","{hexdump.dump(data, sep='')}"\r\n')
+                self.datalog.flush()
+                os.fsync(self.datalog)
 
         frame = Frame()
         epayload = frame.decode(data)
+        if epayload is None:
+            self.metrics.countMalformed(frame.error)
+            return ""
         seq = frame.seq
         length = len(epayload) if epayload is not None else 0
 
@@ -76,9 +91,11 @@ class ProxyUdpServer(UdpServer):
 
         wrapper = Wrapper(from_cloud=True)
         payload = wrapper.decodeUL(epayload)
+        PHASE_STATS.mark("decode")
+        UDP_PACKETS.labels(MsgId(wrapper.msgType).name, "in").inc()
 
         msgLen = len(payload)
-        logging.info(f"Cloud: {seq=} {wrapper} {length=} {msgLen=}")
+        logging.info("Cloud: seq=%r %s length=%r msgLen=%r", seq, wrapper, length, msgLen)
 
         unpack = Unpacker(payload)
 
@@ -129,9 +146,10 @@ class ProxyUdpServer(UdpServer):
             cseq, unk1, unk2, deviceid, room, day, *prog = unpack(
                 "<BBHIIH24B"
             )  # 1 1 2 4 4 2
-            logging.info(
-                f"Cloud {MsgId(wrapper.msgType).name=} {wrapper.msgType=:x} {cseq=:x} {unk1=:x} {unk2=:x} {deviceid=} {room=} {day=} prog={ [ hex(l) for l in prog ] }"
-            )
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(
+                    f"Cloud {MsgId(wrapper.msgType).name=} {wrapper.msgType=:x} {cseq=:x} {unk1=:x} {unk2=:x} {deviceid=} {room=} {day=} prog={ [ hex(l) for l in prog ] }"
+                )
             roomStatus = getRoomStatus(deviceid, room)
             roomStatus["days"][day] = prog
 
@@ -207,19 +225,27 @@ class ProxyUdpServer(UdpServer):
     def handleMsg(self, data, addr):
 
         if len(data) == 1 and data[0] == 0x58:
-            self.knocks += 1
+            with self.knocksLock:
+                self.knocks[addr] += 1
             return
         time1: float = time.time()
         cret = "OK"
-        ret = hexdump.dump(data, sep="")
+        ret = None
         try:
-            if addr == self.cloud_addr or self.knocks >= 3:
-                self.knocks = 0
+            with self.knocksLock:
+                cloud = addr == self.cloud_addr or self.knocks[addr] >= 3
+                if cloud:
+                    self.knocks.pop(addr, None)
+            if cloud:
                 ret = self.handleCloudMsg(data, addr)
                 return ret
             if not self.debugmode:
                 logging.debug(
-                    f"Cloud replicate message {len(data)} bytes : {hexdump.dump(data, sep='')} from {self.addr} to {self.cloud_addr}"
+                    "Cloud replicate message %d bytes : %s from %s to %s",
+                    len(data),
+                    HexDump(data, sep=""),
+                    self.addr,
+                    self.cloud_addr,
                 )
                 self.sendto(data, self.cloud_addr)
             ret = super().handleMsg(data, addr)
@@ -229,10 +255,11 @@ class ProxyUdpServer(UdpServer):
             raise e
         finally:
             time2: float = time.time()
+            if ret is None:
+                # Only build the hexdump when the handler failed
+                ret = hexdump.dump(data, sep="")
             # logging.info(pformat((args, kwargs, ret)))
-            logging.debug(
-                "{:s} function took {:.3f} ms".format(ret, (time2 - time1) * 1000.0)
-            )
+            logging.debug("%s function took %.3f ms", ret, (time2 - time1) * 1000.0)
             Database().log_traces(
                 source="UDP",
                 host=str(addr[0]),
@@ -2,7 +2,7 @@
 # import queue
 # import token
 # from attr import field
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file, stream_with_context
 from flask_restful import Api, Resource
 from flask_cors import CORS
 import json
@@ -12,13 +12,17 @@ import os
 import requests
 from cachetools import cached, TTLCache
 from threading import RLock
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from webargs import fields
+from webargs import fields, validate
 from webargs.flaskparser import use_kwargs, use_args
 
 from udpserver import MsgId, UdpServer
 from status import getStatus, getDeviceStatus, getRoomStatus
 from database import Database
+from export import EXPORTS, FORMATS, EncodeChunks, GzipChunks
+from metrics import COLLECTOR
+from profiling import PHASE_STATS
 from flask import render_template
 
 
@@ -47,7 +51,7 @@ def getUdpServer() -> UdpServer:
     return app.config["udpServer"]
 
 
-@cached(cache=TTLCache(maxsize=1, ttl=3600), lock=RLock())
+@cached(cache=TTLCache(maxsize=1, ttl=3600), lock=RLock(), info=True)
 def getWeather():
     # Uses met.no to get the weather at the servers' latitude, longitude
     # See https://api.met.no/doc/TermsOfService and https://api.met.no/doc/License
@@ -84,6 +88,9 @@ def getWeather():
     return js, 200
 
 
+COLLECTOR.weatherCacheInfo = getWeather.cache_info  # type: ignore
+
+
 #
 # Endpoints to replicate Besmart/Cloudwarm behaviour
 #
@@ -149,6 +156,11 @@ def index() -> str:
     return render_template("index.html", token=getStatus()["token"])
 
 
+@app.route("/metrics")
+def metrics() -> Response:
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
 @app.route("/favicon.ico")
 def favicon():
     return send_file(os.path.join(app.static_folder, "favicon", "favicon.ico"))  # type: ignore
@@ -332,14 +344,26 @@ class WeatherHistory(Resource):
         {
             "from": fields.Str(),
             "to": fields.Str(),
+            "points": fields.Int(validate=validate.Range(min=1)),
+            "resolution": fields.Str(
+                validate=validate.OneOf(["auto", "raw", "hour", "day"])
+            ),
+            "format": fields.Str(validate=validate.OneOf(["rows", "columnar"])),
         },
         location="query",
     )
     def get(self, query):
         getWeather()
-        return Database().get_outside_temperature(
-            query.get("from", None), query.get("to", None)
-        )
+        try:
+            return Database().get_outside_temperature(
+                query.get("from", None),
+                query.get("to", None),
+                points=query.get("points", None),
+                resolution=query.get("resolution", None),
+                format=query.get("format", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
 
 
 class TemperatureHistory(Resource):
@@ -347,13 +371,26 @@ class TemperatureHistory(Resource):
         {
             "from": fields.Str(),
             "to": fields.Str(),
+            "points": fields.Int(validate=validate.Range(min=1)),
+            "resolution": fields.Str(
+                validate=validate.OneOf(["auto", "raw", "hour", "day"])
+            ),
+            "format": fields.Str(validate=validate.OneOf(["rows", "columnar"])),
         },
         location="query",
     )
     def get(self, query, deviceid, roomid):
-        return Database().get_temperature(
-            roomid, query.get("from", None), query.get("to", None)
-        )
+        try:
+            return Database().get_temperature(
+                roomid,
+                query.get("from", None),
+                query.get("to", None),
+                points=query.get("points", None),
+                resolution=query.get("resolution", None),
+                format=query.get("format", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
 
 
 class CallHistory(Resource):
@@ -364,21 +401,28 @@ class CallHistory(Resource):
             "to": fields.Str(),
             "sort": fields.Str(),
             "filter": fields.Str(),
-            "limit": fields.Int(),
-            "offset": fields.Int(),
+            "limit": fields.Int(validate=validate.Range(min=1)),
+            "offset": fields.Int(validate=validate.Range(min=0)),
+            "cursor": fields.Str(),
+            "q": fields.Str(),
         },
         location="query",
     )
     def get(self, query):
         #  logger.debug(pformat(query))
-        return Database().get_calls_group(
-            date_from=query.get("from", None),
-            date_to=query.get("to", None),
-            sort=query.get("sort", "").replace(",", " "),
-            filter=json.loads(query.get("filter", "{}")),
-            limit=query.get("limit", 100),
-            offset=query.get("offset", 0),
-        )
+        try:
+            return Database().get_calls_group(
+                date_from=query.get("from", None),
+                date_to=query.get("to", None),
+                sort=query.get("sort", "").replace(",", " "),
+                filter=json.loads(query.get("filter", "{}")),
+                limit=query.get("limit", 100),
+                offset=query.get("offset", 0),
+                cursor=query.get("cursor", None),
+                q=query.get("q", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
 
 
 class UnknownUDP(Resource):
@@ -391,10 +435,13 @@ class UnknownUDP(Resource):
     )
     def get(self, query):
         #  logger.debug(pformat(query))
-        return Database().get_unknown_udp(
-            date_from=query.get("from", None),
-            date_to=query.get("to", None),
-        )
+        try:
+            return Database().get_unknown_udp(
+                date_from=query.get("from", None),
+                date_to=query.get("to", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
 
 
 class UnknownAPI(Resource):
@@ -408,12 +455,96 @@ class UnknownAPI(Resource):
     )
     def get(self, query):
         #  logger.debug(pformat(query))
-        return Database().get_unknown_api(
-            date_from=query.get("from", None),
-            date_to=query.get("to", None),
+        try:
+            return Database().get_unknown_api(
+                date_from=query.get("from", None),
+                date_to=query.get("to", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+
+class Export(Resource):
+    @use_args(
+        {
+            "from": fields.Str(),
+            "to": fields.Str(),
+            "format": fields.Str(validate=validate.OneOf(list(FORMATS))),
+            "gzip": fields.Bool(),
+            "room": fields.Int(),
+            "protocol": fields.Str(validate=validate.OneOf(["udp", "api"])),
+        },
+        location="query",
+    )
+    def get(self, query, kind):
+        # Streamed with chunked transfer, the history is never built in memory
+        if kind == "unknown":
+            kind = f"unknown_{query.get('protocol', 'udp')}"
+        format = query.get("format", "ndjson")
+        columns = EXPORTS[kind][1]
+        try:
+            batches = Database().export(
+                kind,
+                query.get("from", None),
+                query.get("to", None),
+                room=query.get("room", None),
+            )
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        chunks = EncodeChunks(format, columns, batches)
+        filename = f"{kind}.{format}"
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        if query.get("gzip", False):
+            chunks = GzipChunks(chunks)
+            headers["Content-Encoding"] = "gzip"
+        return Response(
+            stream_with_context(chunks), mimetype=FORMATS[format], headers=headers
         )
 
 
+class DbStatus(Resource):
+    def get(self):
+        return Database().get_status()
+
+
+class UdpStats(Resource):
+    def get(self):
+        return getUdpServer().getIngressStats()
+
+
+class UdpMetrics(Resource):
+    def get(self):
+        return getUdpServer().getMetrics()
+
+
+class UdpLatency(Resource):
+    def get(self):
+        return PHASE_STATS.snapshot()
+
+    def delete(self):
+        PHASE_STATS.reset()
+        return {"message": "OK"}, 200
+
+
+class UdpTrace(Resource):
+    def get(self):
+        return getUdpServer().trace.dump()
+
+
+class UdpProfile(Resource):
+    def get(self):
+        return getUdpServer().profiler.status()
+
+    def put(self):
+        data = request.json or {}
+        try:
+            return getUdpServer().profiler.start(
+                float(data.get("seconds", 30)), data.get("mode", "cprofile")
+            )
+        except (ValueError, RuntimeError) as e:
+            return {"message": str(e)}, 400
+
+
 api.add_resource(Devices, "/api/v1.0/devices", endpoint="devices")
 api.add_resource(
     Device,
@@ -621,6 +752,48 @@ api.add_resource(
     endpoint="call_unknown_api",
 )
 
+api.add_resource(
+    Export,
+    "/api/v1.0/export/<any(temperature,weather,calls,unknown):kind>",
+    endpoint="export",
+)
+
+api.add_resource(
+    DbStatus,
+    "/api/v1.0/db/status",
+    endpoint="db_status",
+)
+
+api.add_resource(
+    UdpStats,
+    "/api/v1.0/udp/stats",
+    endpoint="udp_stats",
+)
+
+api.add_resource(
+    UdpMetrics,
+    "/api/v1.0/udp/metrics",
+    endpoint="udp_metrics",
+)
+
+api.add_resource(
+    UdpLatency,
+    "/api/v1.0/udp/latency",
+    endpoint="udp_latency",
+)
+
+api.add_resource(
+    UdpTrace,
+    "/api/v1.0/udp/trace",
+    endpoint="udp_trace",
+)
+
+api.add_resource(
+    UdpProfile,
+    "/api/v1.0/udp/profile",
+    endpoint="udp_profile",
+)
+
 
 # OpenTherm parameters
 for endpoint in [
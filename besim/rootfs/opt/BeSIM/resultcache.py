@@ -0,0 +1,100 @@
+#
+# Results of the temperature history queries, cached until a newer sample of
+# the same thermostat (or table) is inserted. Windows that ended long ago
+# can't change any more and are kept until evicted
+#
+import math
+import os
+import threading
+from collections import Counter
+
+from cachetools import TLRUCache
+
+from rollups import RESOLUTIONS, ROLLUP_FLUSH_INTERVAL
+
+RESULT_CACHE_SIZE = int(os.getenv("BESIM_RESULT_CACHE_SIZE", "128"))  # results
+RESULT_CACHE_TTL = float(os.getenv("BESIM_RESULT_CACHE_TTL", "60"))  # seconds
+# A window is closed once the rollup bucket holding its end is complete, was
+# flushed by the accumulator and committed by the write-behind queue
+RESULT_CACHE_SETTLE = (
+    max(RESOLUTIONS.values()) + (ROLLUP_FLUSH_INTERVAL + 60) * 1000
+)  # ms
+
+# Inserted table: (cached table, index of the thermostat in the inserted values)
+RESULT_SOURCES: dict[str, tuple[str, int | None]] = {
+    "besim_temperature": ("besim_temperature", 1),
+    "besim_outside_temperature": ("besim_outside_temperature", None),
+}
+for resolution in RESOLUTIONS:
+    RESULT_SOURCES[f"besim_temperature_{resolution}"] = ("besim_temperature", 0)
+    RESULT_SOURCES[f"besim_outside_temperature_{resolution}"] = (
+        "besim_outside_temperature",
+        None,
+    )
+
+
+class ResultCache:
+    """
+    Bounded LRU of query results. Open windows expire after the TTL, or as
+    soon as a new sample (or rollup) of their source, a table or a thermostat
+    in it, is committed; closed ones never expire. Cached results are shared
+    between callers and must not be modified.
+    """
+
+    def __init__(
+        self, maxSize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL
+    ) -> None:
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.generations: Counter = Counter()
+        self.cache = TLRUCache(maxsize=maxSize, ttu=self._expires)
+        self.hits = 0
+        self.misses = 0
+
+    def _expires(self, key, value, now) -> float:
+        closed = value[1]
+        return math.inf if closed else now + self.ttl
+
+    def invalidate(self, table: str, source=None) -> None:
+        with self.lock:
+            self.generations[(table, source)] += 1
+
+    def committed(self, table: str, rows: list) -> None:
+        # Rows that became visible to the queries, raw samples or rollups
+        if table not in RESULT_SOURCES:
+            return
+        source, column = RESULT_SOURCES[table]
+        thermostats = (
+            {None} if column is None else {str(values[column]) for values in rows}
+        )
+        with self.lock:
+            for thermostat in thermostats:
+                self.generations[(source, thermostat)] += 1
+
+    def clear(self) -> None:
+        # After a purge, closed windows may have lost rows too
+        with self.lock:
+            self.cache.clear()
+
+    def get(self, source: tuple, key, closed: bool, compute):
+        with self.lock:
+            generation = self.generations[source]
+            cached = self.cache.get((source, key))
+            if cached is not None and (cached[1] or cached[0] == generation):
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+        # Computed unlocked, a concurrent insert leaves it with the older generation
+        value = compute()
+        with self.lock:
+            self.cache[(source, key)] = (generation, closed, value)
+        return value
+
+    def getStats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests, 3) if requests else None,
+        }
@@ -0,0 +1,252 @@
+#
+# In-memory storage backend (db_backend: memory): the recent telemetry and
+# traces are kept in fixed-size ring buffers of typed arrays and written out
+# to SQLite in large batches every db_memory_flush seconds, or never
+#
+import array
+import itertools
+import math
+import os
+import threading
+from typing import Callable
+
+import numpy as np
+
+DB_MEMORY_ROWS = int(os.getenv("BESIM_DB_MEMORY_ROWS", "50000"))  # rows per table
+DB_MEMORY_FLUSH = int(os.getenv("BESIM_DB_MEMORY_FLUSH", "900"))  # seconds, 0 = never
+
+# table: columns in insert order as (name, array typecode), None for text
+RINGS: dict[str, tuple[tuple[str, str | None], ...]] = {
+    "besim_outside_temperature": (("ts", "q"), ("temp", "h")),
+    "besim_temperature": (
+        ("ts", "q"),
+        ("thermostat", "q"),
+        ("temp", "h"),
+        ("settemp", "h"),
+        ("heating", "b"),
+    ),
+    "web_traces": (
+        ("ts", "q"),
+        ("source", None),
+        ("adapterMap", None),
+        ("host", None),
+        ("uri", None),
+        ("elapsed", "d"),
+        ("response_status", None),
+    ),
+}
+
+# Ids given to the rows not written yet, after any SQLite id
+RING_ID_BASE = 2**62
+
+# Stored in place of None
+NULLS = {"q": -(2**63), "h": -(2**15), "b": -(2**7), "d": math.nan}
+
+
+class RingBuffer:
+    """
+    The last `capacity` rows of a table, column by column in preallocated
+    arrays (lists for the text columns). Once full, every append overwrites
+    the oldest row. Rows are numbered in append order, `flushed` is the
+    first one not written to SQLite yet; rows overwritten before being
+    written are counted as lost. The first column is the epoch ms ts.
+    """
+
+    def __init__(
+        self, columns: tuple[tuple[str, str | None], ...], capacity: int
+    ) -> None:
+        self.names = tuple(name for name, _ in columns)
+        self.types = tuple(code for _, code in columns)
+        self.capacity = max(1, capacity)
+        self.columns: list = [
+            (
+                array.array(code, [NULLS[code]]) * self.capacity
+                if code is not None
+                else [None] * self.capacity
+            )
+            for code in self.types
+        ]
+        self.lock = threading.Lock()
+        self.count = 0
+        self.flushed = 0
+        self.lost = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, values: tuple) -> None:
+        with self.lock:
+            i = self.count % self.capacity
+            for column, code, value in zip(self.columns, self.types, values):
+                if value is None:
+                    value = NULLS[code] if code is not None else None
+                elif code == "d":
+                    value = float(value)
+                elif code is not None:
+                    value = int(value)
+                column[i] = value
+            self.count += 1
+            if self.count - self.flushed > self.capacity:
+                self.flushed += 1
+                self.lost += 1
+
+    def _value(self, column: int, i: int):
+        value = self.columns[column][i]
+        code = self.types[column]
+        if code == "d":
+            return None if math.isnan(value) else value
+        if code is not None and value == NULLS[code]:
+            return None
+        return value
+
+    def _pending(self) -> np.ndarray:
+        # Numbers of the rows not written yet, oldest first
+        return np.arange(self.flushed, self.count)
+
+    def _match(self, rows: np.ndarray, tsFrom: int, tsTo: int, equals: dict):
+        slots = rows % self.capacity
+        ts = np.frombuffer(self.columns[0], dtype=self.types[0])[slots]
+        mask = (ts >= tsFrom) & (ts <= tsTo)
+        for name, value in equals.items():
+            column = self.names.index(name)
+            values = np.frombuffer(self.columns[column], dtype=self.types[column])
+            mask &= values[slots] == value
+        return rows[mask]
+
+    def select(
+        self,
+        tsFrom: int,
+        tsTo: int,
+        columns: tuple[str, ...] | None = None,
+        last: bool = False,
+        ids: str | None = None,
+        **equals,
+    ) -> list[dict]:
+        # Pending rows with ts in [tsFrom, tsTo] and the numeric columns in
+        # `equals` matching, as dicts of `columns`, with their RING_ID_BASE
+        # based id first when `ids` names it. Only the newest with last=True
+        wanted = [self.names.index(name) for name in columns or self.names]
+        with self.lock:
+            rows = self._match(self._pending(), tsFrom, tsTo, equals)
+            if last:
+                rows = rows[-1:]
+            selected = []
+            for row in rows:
+                slot = int(row) % self.capacity
+                values = {ids: RING_ID_BASE + int(row)} if ids else {}
+                for c in wanted:
+                    values[self.names[c]] = self._value(c, slot)
+                selected.append(values)
+            return selected
+
+    def total(self, tsFrom: int, tsTo: int, **equals) -> int:
+        with self.lock:
+            return len(self._match(self._pending(), tsFrom, tsTo, equals))
+
+    def pending(self) -> tuple[int, list[tuple]]:
+        # (number of the row after the last one, pending rows as tuples)
+        with self.lock:
+            rows = [
+                tuple(
+                    self._value(c, int(row) % self.capacity)
+                    for c in range(len(self.names))
+                )
+                for row in self._pending()
+            ]
+            return self.count, rows
+
+    def markFlushed(self, end: int) -> None:
+        with self.lock:
+            self.flushed = max(self.flushed, end)
+
+    def getStats(self) -> dict:
+        return {
+            "rows": len(self),
+            "pending": self.count - self.flushed,
+            "lost": self.lost,
+        }
+
+
+class MemoryStore:
+    """
+    The ring buffers of the RINGS tables. flush() writes their pending rows
+    to SQLite, one executemany per partition in a single transaction. A
+    reader merging SQLite rows with the pending ones goes through read(),
+    which runs it again if a flush moved rows from one to the other meanwhile,
+    or snapshot() when it holds a read transaction instead.
+    """
+
+    def __init__(self, partitions, capacity: int = DB_MEMORY_ROWS) -> None:
+        self.partitions = partitions
+        self.rings = {
+            table: RingBuffer(columns, capacity) for table, columns in RINGS.items()
+        }
+        self.flushLock = threading.Lock()
+        self.version = 0
+        self.flushes = 0
+        self.written = 0
+
+    def append(self, table: str, values: tuple) -> None:
+        self.rings[table].append(values)
+
+    def read(self, query: Callable):
+        while True:
+            with self.flushLock:
+                version = self.version
+            result = query()
+            if self.version == version:
+                return result
+
+    def snapshot(self, conn, query: Callable):
+        # query() with the read transaction of `conn` started at the same
+        # point, so that rows flushed later are seen by neither
+        with self.flushLock:
+            conn.getConn().execute("select count(*) from sqlite_master").fetchone()
+            return query()
+
+    def flush(self, conn, tables=None) -> list[str]:
+        # Tables that got rows
+        written = []
+        with self.flushLock:
+            self.version += 1
+            try:
+                # Partitions are looked up (and created) before the transaction
+                batches = []
+                for table in tables or self.rings:
+                    ring = self.rings[table]
+                    end, rows = ring.pending()
+                    if not rows:
+                        continue
+                    names = ", ".join(ring.names)
+                    placeholders = ", ".join("?" * len(ring.names))
+                    groups = [
+                        (
+                            f"insert into {partition}({names}) values ({placeholders})",
+                            list(group),
+                        )
+                        for partition, group in itertools.groupby(
+                            rows, key=lambda row: self.partitions.table(table, row[0])
+                        )
+                    ]
+                    batches.append((table, ring, end, groups, len(rows)))
+                sqlite = conn.getConn()
+                with sqlite:
+                    for _, _, _, groups, _ in batches:
+                        for sql, rows in groups:
+                            sqlite.executemany(sql, rows)
+                for table, ring, end, _, count in batches:
+                    ring.markFlushed(end)
+                    written.append(table)
+                    self.written += count
+                if written:
+                    self.flushes += 1
+            finally:
+                self.version += 1
+        return written
+
+    def getStats(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "written": self.written,
+            "tables": {table: ring.getStats() for table, ring in self.rings.items()},
+        }
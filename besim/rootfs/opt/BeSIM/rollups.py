@@ -0,0 +1,108 @@
+#
+# Hourly and daily temperature rollups, accumulated in memory from every
+# sample and merged into the rollup tables with upserts
+#
+import os
+import threading
+import time
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS  # UTC days
+
+ROLLUP_FLUSH_INTERVAL = int(os.getenv("BESIM_ROLLUP_FLUSH_INTERVAL", "300"))  # s
+
+RESOLUTIONS = {"hour": HOUR_MS, "day": DAY_MS}
+
+TEMPERATURE_UPSERT = (
+    "insert into {table}(thermostat, ts, samples, temp_min, temp_max, temp_sum, settemp_sum, heating_samples) values (?,?,?,?,?,?,?,?) "
+    "on conflict(thermostat, ts) do update set samples = samples + excluded.samples, "
+    "temp_min = min(temp_min, excluded.temp_min), temp_max = max(temp_max, excluded.temp_max), "
+    "temp_sum = temp_sum + excluded.temp_sum, settemp_sum = settemp_sum + excluded.settemp_sum, "
+    "heating_samples = heating_samples + excluded.heating_samples"
+)
+OUTSIDE_UPSERT = (
+    "insert into {table}(ts, samples, temp_min, temp_max, temp_sum) values (?,?,?,?,?) "
+    "on conflict(ts) do update set samples = samples + excluded.samples, "
+    "temp_min = min(temp_min, excluded.temp_min), temp_max = max(temp_max, excluded.temp_max), "
+    "temp_sum = temp_sum + excluded.temp_sum"
+)
+
+
+class Bucket:
+    __slots__ = ("samples", "tmin", "tmax", "tsum", "ssum", "heating")
+
+    def __init__(self) -> None:
+        self.samples = 0
+        self.tmin: int | None = None
+        self.tmax: int | None = None
+        self.tsum = 0
+        self.ssum = 0
+        self.heating = 0
+
+    def add(self, temp: int, settemp: int = 0, heating: int = 0) -> None:
+        self.samples += 1
+        self.tmin = temp if self.tmin is None else min(self.tmin, temp)
+        self.tmax = temp if self.tmax is None else max(self.tmax, temp)
+        self.tsum += temp
+        self.ssum += settemp
+        self.heating += 1 if heating else 0
+
+
+class RollupAccumulator:
+    """
+    Keeps the partial hourly/daily buckets touched since the last flush. A
+    flush returns them as (table, sql, values) upserts, that add to the rows
+    already in the database, so buckets may be flushed any number of times.
+    Temperatures are integer tenths of degree, timestamps epoch ms.
+    """
+
+    def __init__(self, flushInterval: int = ROLLUP_FLUSH_INTERVAL) -> None:
+        self.flushInterval = flushInterval
+        self.lock = threading.Lock()
+        self.pending: dict[tuple, Bucket] = {}
+        self.lastFlush = time.monotonic()
+
+    def addTemperature(
+        self, thermostat: int, ts: int, temp: int, settemp: int, heating: int
+    ) -> None:
+        with self.lock:
+            for resolution, size in RESOLUTIONS.items():
+                key = ("besim_temperature", resolution, thermostat, ts - ts % size)
+                bucket = self.pending.get(key)
+                if bucket is None:
+                    bucket = self.pending[key] = Bucket()
+                bucket.add(temp, settemp, heating)
+
+    def addOutside(self, ts: int, temp: int) -> None:
+        with self.lock:
+            for resolution, size in RESOLUTIONS.items():
+                key = ("besim_outside_temperature", resolution, None, ts - ts % size)
+                bucket = self.pending.get(key)
+                if bucket is None:
+                    bucket = self.pending[key] = Bucket()
+                bucket.add(temp)
+
+    def due(self, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return bool(self.pending) and now - self.lastFlush >= self.flushInterval
+
+    def drain(self) -> list[tuple[str, str, tuple]]:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.lastFlush = time.monotonic()
+        rc = []
+        for (kind, resolution, thermostat, ts), b in pending.items():
+            table = f"{kind}_{resolution}"
+            if kind == "besim_temperature":
+                values = (thermostat, ts, b.samples, b.tmin, b.tmax, b.tsum, b.ssum)
+                rc.append(
+                    (
+                        table,
+                        TEMPERATURE_UPSERT.format(table=table),
+                        values + (b.heating,),
+                    )
+                )
+            else:
+                values = (ts, b.samples, b.tmin, b.tmax, b.tsum)
+                rc.append((table, OUTSIDE_UPSERT.format(table=table), values))
+        return rc
@@ -0,0 +1,128 @@
+#
+# Deferred device actions (fake boost expiry, delayed refreshes, retries)
+# run on time by a single timer thread and a bounded pool of workers
+#
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_WORKERS = int(os.getenv("BESIM_SCHEDULER_WORKERS", "2"))
+
+
+class Scheduler:
+    """
+    Heap of pending actions, each identified by a key (e.g. ("fakeboost",
+    deviceid, room)). A key is pending at most once: scheduling it again
+    moves it, or is ignored with replace=False. The timer thread only pops
+    due actions, the (blocking) work runs in the worker pool.
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS) -> None:
+        self.workers = max(1, workers)
+        self.cond = threading.Condition()
+        self.heap: list[tuple[float, int, Hashable]] = []
+        self.pending: dict[Hashable, tuple[float, int, Callable, tuple]] = {}
+        self.running: set = set()
+        self.counter = itertools.count()
+        self.executor: ThreadPoolExecutor | None = None
+        self.thread: threading.Thread | None = None
+        self.stopped = False
+        self.fired = 0
+
+    def start(self) -> None:
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.stopped = False
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="scheduler"
+            )
+            self.thread = threading.Thread(
+                target=self._run, name="scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def schedule(
+        self, key: Hashable, delay: float, fn: Callable, *args, replace=True
+    ) -> bool:
+        """Run fn(*args) in `delay` seconds, returns False if the key was left untouched"""
+        with self.cond:
+            if not replace and (key in self.pending or key in self.running):
+                return False
+            when = time.monotonic() + max(0.0, delay)
+            seq = next(self.counter)
+            self.pending[key] = (when, seq, fn, args)
+            heapq.heappush(self.heap, (when, seq, key))
+            self.cond.notify()
+            return True
+
+    def cancel(self, key: Hashable) -> bool:
+        # The heap entry stays behind and is skipped when popped
+        with self.cond:
+            return self.pending.pop(key, None) is not None
+
+    def due(self, key: Hashable) -> float | None:
+        # Seconds until the key fires, None if it is not pending
+        with self.cond:
+            entry = self.pending.get(key)
+            return None if entry is None else max(0.0, entry[0] - time.monotonic())
+
+    def _run(self) -> None:
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                when, seq, key = self.heap[0]
+                entry = self.pending.get(key)
+                if entry is None or entry[1] != seq:
+                    # Cancelled or moved
+                    heapq.heappop(self.heap)
+                    continue
+                now = time.monotonic()
+                if when > now:
+                    self.cond.wait(when - now)
+                    continue
+                heapq.heappop(self.heap)
+                del self.pending[key]
+                self.running.add(key)
+                self.fired += 1
+                assert self.executor is not None
+                self.executor.submit(self._call, key, entry[2], entry[3])
+
+    def _call(self, key: Hashable, fn: Callable, args: tuple) -> Any:
+        try:
+            return fn(*args)
+        except Exception:
+            logger.error(f"Scheduled {key} failed: {traceback.format_exc()}")
+        finally:
+            with self.cond:
+                self.running.discard(key)
+
+    def getStats(self) -> dict:
+        with self.cond:
+            return {
+                "workers": self.workers,
+                "pending": len(self.pending),
+                "running": len(self.running),
+                "fired": self.fired,
+            }
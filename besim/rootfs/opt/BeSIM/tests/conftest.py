@@ -0,0 +1,32 @@
+import contextlib
+import pytest
+from database import Database, Singleton
+from databaseConnection import DatabaseType
+
+
+@contextlib.contextmanager
+def TempDatabase(path, backend=DatabaseType.SQLITE3, migrate=True):
+    # The Database singleton on a new file, dropped again on exit
+    Singleton._instances.pop(Database, None)
+    database = Database(name=str(path), backend=backend)
+    if migrate:
+        database.check_migrations()
+    try:
+        yield database
+    finally:
+        database.close()
+        Singleton._instances.pop(Database, None)
+
+
+@pytest.fixture(scope="session")
+def openDatabase():
+    # For the tests and fixtures that need a database of their own
+    return TempDatabase
+
+
+@pytest.fixture
+def database(request, tmp_path):
+    # Migrated, on the sqlite3 backend unless parametrized indirectly with the
+    # TempDatabase options, e.g. {"backend": DatabaseType.MEMORY}
+    with TempDatabase(tmp_path / "besim.db", **getattr(request, "param", {})) as db:
+        yield db
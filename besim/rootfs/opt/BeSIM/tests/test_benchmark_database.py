@@ -0,0 +1,238 @@
+#
+# Benchmarks of the database layer (pytest-benchmark) on a generated history
+# in a temp dir:
+#   BESIM_BENCHMARK_ROWS=10000,1000000,10000000 pytest tests/test_benchmark_database.py --benchmark-only
+# BESIM_BENCHMARK_ROWS are the history sizes, 10000 by default
+#
+import itertools
+import math
+import os
+import random
+
+import pytest
+from database import Database, EpochMs, ScaleTemp
+from databaseConnection import DatabaseConnection, DatabaseType
+from deadband import DeadbandRecorder
+from rollups import DAY_MS
+
+SIZES = [int(size) for size in os.getenv("BESIM_BENCHMARK_ROWS", "10000").split(",")]
+INSERT_BATCH = 1000  # rows per benchmarked round
+SAMPLE_INTERVAL = 15 * 1000  # ms between generated rows
+THERMOSTATS = 4
+HOSTS = ("api.besmart-home.com", "www.cloudwarm.net", "time.cloudwarm.net")
+URIS = ("/fwUpgrade/PR06549/version.txt", "/api/v1.0/status", "/WifiBoxInterface")
+
+# A simulated device-day (yesterday, UTC): one sample per room every minute,
+# a proxied call every 5 minutes and the outside temperature every hour
+DAY_ROOMS = 4
+DAY_SAMPLES = 24 * 60
+DAY_TRACE_EVERY = 5
+DAY_OUTSIDE_EVERY = 60
+DAY_SETTEMP = 21.0
+
+TEMPERATURE_COLUMNS = "ts, thermostat, temp, settemp, heating"
+OUTSIDE_COLUMNS = "ts, temp"
+TRACE_COLUMNS = "ts, source, adapterMap, host, uri, elapsed, response_status"
+
+
+BACKENDS = pytest.mark.parametrize(
+    "database",
+    [{"backend": DatabaseType.SQLITE3}, {"backend": DatabaseType.MEMORY}],
+    indirect=True,
+    ids=["sqlite3", "memory"],
+)
+
+
+def DbSize(path) -> int:
+    return sum(
+        os.path.getsize(f"{path}{suffix}")
+        for suffix in ("", "-wal")
+        if os.path.exists(f"{path}{suffix}")
+    )
+
+
+def Throughput(benchmark, rows: int) -> None:
+    if benchmark.stats:
+        benchmark.extra_info["rows_per_second"] = round(rows / benchmark.stats["mean"])
+
+
+def Insert(database: Database, tables) -> None:
+    # (base table, columns, rows in ts order) into the partitions of their ts
+    conn = database.get_connection()
+    sqlite = conn.getConn()
+    for base, columns, rows in tables:
+        placeholders = ", ".join("?" * (columns.count(",") + 1))
+        for partition, group in itertools.groupby(
+            rows, key=lambda row: database.partitions.table(base, row[0])
+        ):
+            with sqlite:
+                sqlite.executemany(
+                    f"insert into {partition}({columns}) values ({placeholders})",
+                    group,
+                )
+    conn.close()
+
+
+def Populate(database: Database, size: int) -> None:
+    # `size` temperature samples and as many traces, the newest now
+    rng = random.Random(size)
+    now = EpochMs()
+    start = now - size * SAMPLE_INTERVAL
+    temperature = (
+        (
+            start + i * SAMPLE_INTERVAL,
+            i % THERMOSTATS,
+            rng.randint(160, 240),
+            210,
+            i % 2,
+        )
+        for i in range(size)
+    )
+    traces = (
+        (
+            start + i * SAMPLE_INTERVAL,
+            f"10.0.0.{i % 8}",
+            "besmart",
+            rng.choice(HOSTS),
+            rng.choice(URIS),
+            rng.randint(5, 500),
+            rng.choice(("200", "200", "200", "404", "500")),
+        )
+        for i in range(size)
+    )
+    Insert(
+        database,
+        (
+            ("besim_temperature", TEMPERATURE_COLUMNS, temperature),
+            ("web_traces", TRACE_COLUMNS, traces),
+        ),
+    )
+    conn = database.get_connection()
+    conn.run_pragma("optimize")
+    conn.close()
+
+
+def DeviceDay(database: Database) -> tuple:
+    # The rows the addon writes in a device-day, samples filtered by the
+    # DeadbandRecorder, while all of them go to the rollup accumulator
+    start = EpochMs() // DAY_MS * DAY_MS - DAY_MS
+    recorder = DeadbandRecorder()
+    settemp = ScaleTemp(DAY_SETTEMP)
+    temperature, outside, traces = [], [], []
+    for minute in range(DAY_SAMPLES):
+        ts = start + minute * 60 * 1000
+        for room in range(DAY_ROOMS):
+            # A daily swing of +-1.5 degC around the set temperature
+            temp = round(DAY_SETTEMP + 1.5 * math.sin(minute / 229 + room), 1)
+            heating = int(temp < DAY_SETTEMP)
+            database.rollups.addTemperature(room, ts, ScaleTemp(temp), settemp, heating)
+            if recorder.accept(room, temp, DAY_SETTEMP, heating, now=ts / 1000):
+                temperature.append((ts, room, ScaleTemp(temp), settemp, heating))
+        if minute % DAY_TRACE_EVERY == 0:
+            traces.append((ts, "10.0.0.1", "besmart", HOSTS[0], URIS[1], 42, "200"))
+        if minute % DAY_OUTSIDE_EVERY == 0:
+            temp = ScaleTemp(5.0 + minute / 600)
+            database.rollups.addOutside(ts, temp)
+            outside.append((ts, temp))
+    return (
+        ("besim_temperature", TEMPERATURE_COLUMNS, temperature),
+        ("besim_outside_temperature", OUTSIDE_COLUMNS, outside),
+        ("web_traces", TRACE_COLUMNS, traces),
+    )
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}rows")
+def history(request, tmp_path_factory, openDatabase):
+    with openDatabase(tmp_path_factory.mktemp("history") / "besim.db") as database:
+        Populate(database, request.param)
+        yield database
+
+
+@BACKENDS
+def test_log_temperature(benchmark, database):
+    def insert():
+        for i in range(INSERT_BATCH):
+            database.log_temperature(i % THERMOSTATS, 20.0 + i % 10 / 10, 21.0, i % 2)
+        database.flush()
+
+    benchmark(insert)
+    Throughput(benchmark, INSERT_BATCH)
+
+
+@BACKENDS
+def test_log_traces(benchmark, database):
+    def insert():
+        for i in range(INSERT_BATCH):
+            database.log_traces(
+                "10.0.0.1", HOSTS[i % 3], "besmart", URIS[i % 3], i, "200"
+            )
+        database.flush()
+
+    benchmark(insert)
+    Throughput(benchmark, INSERT_BATCH)
+
+
+@pytest.mark.parametrize("pooled", [True, False], ids=["pool", "connect"])
+def test_connection_overhead(benchmark, database, pooled):
+    def call():
+        conn = (
+            database.get_connection()
+            if pooled
+            else DatabaseConnection(DatabaseType.SQLITE3, database.name)
+        )
+        conn.fetchone("select 1")
+        conn.close()
+
+    benchmark(call)
+
+
+def test_get_temperature(benchmark, history):
+    # One day of a thermostat, computed every round
+    date_from = EpochMs() - 86400 * 1000
+    benchmark.pedantic(
+        history.get_temperature,
+        args=(1, date_from),
+        setup=history.results.clear,
+        rounds=20,
+        warmup_rounds=1,
+    )
+
+
+def test_get_calls(benchmark, history):
+    # First page of the last two weeks, total counted every round
+    benchmark.pedantic(
+        history.get_calls,
+        setup=lambda: history.counts.invalidate("web_traces"),
+        rounds=20,
+        warmup_rounds=1,
+    )
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"{size}rows")
+def test_purge(benchmark, database, size):
+    # Half of the history goes
+    Populate(database, size)
+    days = size * SAMPLE_INTERVAL / 2 / 86400000
+
+    rc = benchmark.pedantic(database.purge, args=(days,), rounds=1)
+
+    benchmark.extra_info["deleted"] = rc["deleted"]
+    benchmark.extra_info["dropped"] = len(rc["dropped"])
+
+
+def test_growth_per_device_day(benchmark, database):
+    path = database.name
+    database.run_maintenance()
+    before = DbSize(path)
+    tables = DeviceDay(database)
+
+    def day():
+        Insert(database, tables)
+        database.flush_rollups()
+        database.flush()
+
+    benchmark.pedantic(day, rounds=1)
+
+    database.run_maintenance()
+    benchmark.extra_info["bytes_per_device_day"] = DbSize(path) - before
+    benchmark.extra_info["samples_written"] = len(tables[0][2])
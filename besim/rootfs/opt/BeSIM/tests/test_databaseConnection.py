@@ -0,0 +1,179 @@
+import sqlite3
+import threading
+import pytest
+from databaseConnection import ConnectionPool, DatabaseType
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(
+        DatabaseType.SQLITE3, str(tmp_path / "test.db"), maxSize=2, timeout=0.1
+    )
+    yield pool
+    pool.closeAll()
+
+
+def test_pool_reuses_connection(pool):
+    # Arrange
+    conn = pool.acquire()
+    sqlite = conn.getConn()
+
+    # Act
+    conn.close()
+    again = pool.acquire()
+
+    # Assert
+    assert again.getConn() is sqlite
+    assert pool.getStats() == {"size": 1, "max_size": 2, "idle": 0, "leased": 1}
+    again.close()
+
+
+def test_pool_nested_lease(pool):
+    # Arrange
+    outer = pool.acquire()
+
+    # Act
+    inner = pool.acquire()
+    inner.close()
+
+    # Assert
+    assert inner is outer
+    assert pool.getStats()["leased"] == 1
+    outer.close()
+    assert pool.getStats()["idle"] == 1
+
+
+def test_pool_max_size(pool):
+    # Arrange
+    leased = []
+    ready = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        leased.append(pool.acquire())
+        ready.set()
+        done.wait(2)
+        leased[-1].close()
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        ready.clear()
+        thread.start()
+        ready.wait(2)
+
+    # Act / Assert
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    done.set()
+    for thread in threads:
+        thread.join()
+    pool.acquire().close()
+
+
+def test_pool_reclaims_leaked_connections(pool):
+    # Arrange
+    for _ in range(2):
+        thread = threading.Thread(target=pool.acquire)
+        thread.start()
+        thread.join()
+
+    # Act
+    conn = pool.acquire()
+
+    # Assert
+    assert conn.run_sql("select 1 as one") == [{"one": 1}]
+    conn.close()
+
+
+@pytest.fixture
+def rows(pool):
+    conn = pool.acquire()
+    conn.run_sql("create table t(a INTEGER, b TEXT)")
+    for i in range(5):
+        conn.run_sql("insert into t values (?, ?)", (i, str(i)))
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "format, batches, expected",
+    [
+        ("dict", False, [{"a": 0, "b": "0"}, {"a": 1, "b": "1"}, {"a": 2, "b": "2"}]),
+        ("tuple", False, [(0, "0"), (1, "1"), (2, "2")]),
+        ("tuple", True, [[(0, "0"), (1, "1")], [(2, "2")]]),
+        ("columnar", False, [{"a": [0, 1], "b": ["0", "1"]}, {"a": [2], "b": ["2"]}]),
+    ],
+)
+def test_stream_formats(rows, format, batches, expected):
+    # Act
+    stream = rows.stream(
+        "select a, b from t where a < ? order by a",
+        (3,),
+        format=format,
+        batchSize=2,
+        batches=batches,
+    )
+
+    # Assert
+    assert stream.columns == ["a", "b"]
+    assert list(stream) == expected
+    assert stream.rows == 3
+
+
+def test_stream_does_not_commit(rows):
+    # Arrange
+    rows.run_sql("select 1")
+    rows.getConn().execute("insert into t values (9, '9')")
+
+    # Act
+    list(rows.stream("select * from t"))
+
+    # Assert
+    assert rows.getConn().in_transaction
+    rows.rollback()
+    assert rows.fetchone("select count(*) as n from t")["n"] == 5
+
+
+def test_stream_invalid_format(rows):
+    with pytest.raises(ValueError):
+        rows.stream("select * from t", format="xml")
+
+
+@pytest.fixture
+def readPool(rows, tmp_path):
+    rows.commit()
+    pool = ConnectionPool(
+        DatabaseType.SQLITE3,
+        str(tmp_path / "test.db"),
+        pragmas=["query_only = 1"],
+        readOnly=True,
+        queryTimeout=0.05,
+    )
+    yield pool
+    pool.closeAll()
+
+
+def test_read_only_pool(readPool):
+    # Arrange
+    conn = readPool.acquire()
+
+    # Act / Assert
+    assert conn.fetchone("select count(*) as n from t")["n"] == 5
+    with pytest.raises(sqlite3.OperationalError):
+        conn.run_sql("insert into t values (9, '9')")
+    conn.close()
+
+
+def test_query_timeout(readPool):
+    # Arrange
+    conn = readPool.acquire()
+    endless = "with recursive n(i) as (select 1 union all select i + 1 from n) select count(*) from n"
+
+    # Act / Assert
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        conn.run_sql(endless)
+    assert conn.fetchone("select count(*) as n from t")["n"] == 5
+    stream = conn.stream("select * from t", batchSize=1)
+    assert len(list(stream)) == 5
+    assert conn.deadline is None
+    conn.close()
@@ -0,0 +1,83 @@
+import pytest
+from databaseConnection import ConnectionPool, DatabaseType
+from databaseWriter import DatabaseWriter
+
+INSERT = "insert into samples(ts, value) values (?,?)"
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(DatabaseType.SQLITE3, str(tmp_path / "test.db"))
+    conn = pool.acquire()
+    conn.run_sql("create table samples(ts TEXT, value NUMERIC)")
+    conn.close()
+    yield pool
+    pool.closeAll()
+
+
+def count(pool):
+    conn = pool.acquire()
+    rc = conn.fetchone("select count(*) as total from samples")["total"]
+    conn.close()
+    return rc
+
+
+@pytest.mark.parametrize("rows, batchSize", [(1, 500), (120, 50), (1000, 500)])
+def test_writer_batches(pool, rows, batchSize):
+    # Arrange
+    writer = DatabaseWriter(pool, batchSize=batchSize, interval=50)
+
+    # Act
+    for i in range(rows):
+        writer.put("samples", INSERT, (str(i), i))
+    writer.flush()
+
+    # Assert
+    assert count(pool) == rows
+    stats = writer.getStats()
+    assert stats["written"] == rows
+    assert stats["batches"] >= -(-rows // batchSize)
+    writer.stop()
+
+
+def test_writer_drains_on_stop(pool):
+    # Arrange
+    writer = DatabaseWriter(pool, interval=10000)
+    for i in range(10):
+        writer.put("samples", INSERT, (str(i), i))
+
+    # Act
+    writer.stop()
+
+    # Assert
+    assert count(pool) == 10
+
+
+def test_writer_bad_statement(pool):
+    # Arrange
+    writer = DatabaseWriter(pool, interval=50)
+
+    # Act
+    writer.put("samples", INSERT, ("0", 0))
+    writer.put("missing", "insert into missing(ts) values (?)", ("0",))
+    writer.put("samples", INSERT, ("1", 1))
+    writer.stop()
+
+    # Assert
+    assert count(pool) == 2
+    assert writer.getStats()["dropped"] == 1
+
+
+def test_writer_after_stop(pool):
+    # Arrange
+    writer = DatabaseWriter(pool, interval=50, queueSize=1)
+    writer.put("samples", INSERT, ("0", 0))
+    writer.stop()
+
+    # Act: neither queued for a thread that is gone nor blocked on the queue
+    for i in range(1, 4):
+        assert writer.put("samples", INSERT, (str(i), i))
+
+    # Assert
+    assert count(pool) == 4
+    assert writer.getStats()["queue_depth"] == 0
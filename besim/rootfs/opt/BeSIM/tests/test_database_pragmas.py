@@ -0,0 +1,36 @@
+import pytest
+
+# Left for the test to migrate
+UNMIGRATED = pytest.mark.parametrize(
+    "database", [{"migrate": False}], indirect=True, ids=["unmigrated"]
+)
+
+
+@UNMIGRATED
+def test_wal_and_pragmas(database):
+    # Arrange / Act
+    assert database.check_migrations()
+    conn = database.get_connection()
+
+    # Assert
+    assert conn.run_pragma("journal_mode")[0] == "wal"
+    assert conn.run_pragma("synchronous")[0] == 1  # NORMAL
+    assert conn.run_pragma("temp_store")[0] == 2  # MEMORY
+    assert conn.run_pragma("busy_timeout")[0] == 5000
+    assert conn.run_pragma("cache_size")[0] < 0
+    conn.close()
+
+
+@UNMIGRATED
+def test_maintenance(database):
+    # Arrange
+    database.check_migrations()
+    database.log_outside_temperature(12.5)
+    database.flush()
+
+    # Act
+    rc = database.run_maintenance()
+
+    # Assert
+    assert rc["wal_checkpoint"]["busy"] == 0
+    assert database.get_outside_temperature()[0]["temp"] == 12.5
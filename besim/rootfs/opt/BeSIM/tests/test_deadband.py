@@ -0,0 +1,49 @@
+import pytest
+from deadband import DeadbandRecorder
+
+
+@pytest.mark.parametrize(
+    "sample, now, accepted",
+    [
+        ((20.0, 21.0, 0), 10, False),
+        ((20.1, 21.0, 0), 10, False),
+        ((20.2, 21.0, 0), 10, True),
+        ((19.8, 21.0, 0), 10, True),
+        ((20.0, 21.5, 0), 10, True),
+        ((20.0, 21.0, 1), 10, True),
+        ((20.0, 21.0, 0), 900, True),
+    ],
+)
+def test_deadband(sample, now, accepted):
+    # Arrange
+    recorder = DeadbandRecorder(deadband=0.2, heartbeat=900)
+    assert recorder.accept(1, 20.0, 21.0, 0, now=0)
+
+    # Act / Assert
+    assert recorder.accept(1, *sample, now=now) == accepted
+
+
+def test_heartbeat_disabled():
+    recorder = DeadbandRecorder(deadband=0.2, heartbeat=0)
+    assert recorder.accept(1, 20.0, 21.0, 0, now=0)
+    assert recorder.accept(1, 20.0, 21.0, 0, now=1)
+
+
+def test_step_history(database):
+    # Arrange
+    conn = database.get_connection()
+    for ts, temp in [(1_000_000, 200), (1_600_000, 210)]:
+        table = database.partitions.table("besim_temperature", ts)
+        conn.run_sql(
+            f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, 1, ?, 210, 0)",
+            (ts, temp),
+        )
+    conn.close()
+
+    # Act
+    rows = database.get_temperature(1, 1_300_000, 1_700_000)
+
+    # Assert
+    assert [row["temp"] for row in rows] == [20.0, 21.0, 21.0]
+    assert rows[0]["ts"] == database.get_temperature(1, 1_300_000, 1_300_000)[0]["ts"]
+    assert len(database.get_temperature(1, 1_300_000, 1_700_000, step=False)) == 1
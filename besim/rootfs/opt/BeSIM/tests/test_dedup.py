@@ -0,0 +1,79 @@
+import sqlite3
+import zlib
+import pytest
+from dedup import ContentHash, DeduplicateTables
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        (("ab", "c"), ("a", "bc")),
+        ((None, "x"), ("", "x")),
+        ((b"\x01", 1), (b"\x01", 2)),
+    ],
+)
+def test_content_hash_distinct(a, b):
+    assert ContentHash(*a) != ContentHash(*b)
+
+
+def test_unknown_udp_upsert(database):
+    # Arrange
+    payload = bytes(range(16)) * 8
+
+    # Act
+    for _ in range(3):
+        database.log_unknown_udp("10.0.0.1", "PING", 7, b"raw", payload)
+    database.log_unknown_udp("10.0.0.2", "PING", 7, b"raw", payload)
+    database.flush()
+
+    # Assert
+    rows = database.get_unknown_udp()
+    assert [(row["source"], row["count"]) for row in rows] == [
+        ("10.0.0.2", 1),
+        ("10.0.0.1", 3),
+    ]
+    assert rows[1]["payload"] == payload.hex().upper()
+    assert rows[1]["first_seen"] <= rows[1]["ts"]
+    conn = database.get_connection()
+    stored = conn.fetchone("select payload from unknown_udp limit 1")["payload"]
+    conn.close()
+    assert len(stored) < len(payload)
+
+
+def test_unknown_api_upsert(database):
+    # Act
+    for _ in range(2):
+        database.log_unknown_api(
+            "10.0.0.1", "host", "POST", "/x", "{}", b"body", "200", "ok"
+        )
+    database.flush()
+
+    # Assert
+    rows = database.get_unknown_api()
+    assert len(rows) == 1
+    assert rows[0]["count"] == 2
+    assert bytes.fromhex(rows[0]["body"]) == b"body"
+
+
+def test_deduplicate_migration():
+    # Arrange
+    sqlite = sqlite3.connect(":memory:")
+    sqlite.execute(
+        "create table unknown_udp(ts INTEGER NOT NULL, source TEXT, type TEXT, code INTEGER, payload BLOB, unparsed_payload BLOB, raw_data BLOB)"
+    )
+    sqlite.executemany(
+        "insert into unknown_udp values (?, 'a', 'PING', 7, x'01', x'', x'02')",
+        [(1000,), (3000,), (2000,)],
+    )
+    sqlite.execute(
+        "create table unknown_api(ts INTEGER NOT NULL, source TEXT, host TEXT, method TEXT, uri TEXT, headers TEXT, body BLOB, rm_resp_code TEXT, rm_res_body TEXT)"
+    )
+
+    # Act
+    DeduplicateTables(sqlite)
+
+    # Assert
+    rows = sqlite.execute(
+        "select first_seen, last_seen, count, payload from unknown_udp"
+    ).fetchall()
+    assert rows == [(1000, 3000, 3, zlib.compress(b"\x01"))]
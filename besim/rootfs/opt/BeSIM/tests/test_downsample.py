@@ -0,0 +1,47 @@
+import math
+import numpy as np
+import pytest
+from downsample import Lttb, LttbIndices
+
+
+@pytest.mark.parametrize(
+    "points, expected", [(1, [0]), (2, [0, 9]), (10, list(range(10)))]
+)
+def test_lttb_small(points, expected):
+    x = np.arange(10, dtype=np.float64)
+    assert list(LttbIndices(x, x, points)) == expected
+
+
+def test_lttb_keeps_peaks():
+    # Arrange
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[500] = 10
+    y[700] = -10
+
+    # Act
+    kept = LttbIndices(x, y, 50)
+
+    # Assert
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert 500 in kept and 700 in kept
+    assert list(kept) == sorted(set(kept))
+
+
+def test_lttb_rows():
+    # Arrange
+    rows = [
+        {"ts": i * 1000, "temp": None if i % 7 == 0 else round(200 + 50 * math.sin(i))}
+        for i in range(100)
+    ]
+
+    # Act
+    sampled = Lttb(rows, 10)
+
+    # Assert
+    assert len(sampled) == 10
+    assert sampled[0] is rows[0] and sampled[-1] is rows[-1]
+    assert all(row["temp"] is not None for row in sampled[1:-1])
+    assert Lttb(rows, None) is rows
+    assert Lttb(rows, 100) is rows
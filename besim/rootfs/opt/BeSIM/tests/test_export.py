@@ -0,0 +1,81 @@
+import gzip
+import json
+import pytest
+from export import CsvChunks, GzipChunks, NdjsonChunks
+from restapi import app
+
+JAN = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+FEB = 1_706_745_600_000  # 2024-02-01T00:00:00Z
+
+
+def test_chunks():
+    # Arrange
+    batches = [[(1, "a"), (2, "b")], [(3, None)]]
+
+    # Act
+    ndjson = "".join(NdjsonChunks(("n", "s"), batches))
+    csv = list(CsvChunks(("n", "s"), batches))
+
+    # Assert
+    assert ndjson.splitlines()[2] == '{"n": 3, "s": null}'
+    assert csv == ["n,s\n1,a\n2,b\n", "3,\n"]
+    assert list(CsvChunks(("n", "s"), [])) == ["n,s\n"]
+    assert gzip.decompress(b"".join(GzipChunks(iter(csv)))) == b"n,s\n1,a\n2,b\n3,\n"
+
+
+@pytest.fixture
+def database(database):
+    conn = database.get_connection()
+    for ts, room, temp in [(FEB, 1, 205), (JAN, 1, 200), (JAN + 1, 2, 190)]:
+        table = database.partitions.table("besim_temperature", ts)
+        conn.run_sql(
+            f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, ?, ?, 210, 0)",
+            (ts, room, temp),
+        )
+    conn.close()
+    return database
+
+
+def test_export_batches(database):
+    # Act
+    batches = list(database.export("temperature", batchSize=1))
+
+    # Assert
+    assert [len(batch) for batch in batches] == [1, 1, 1]
+    assert [batch[0][2] for batch in batches] == [20.0, 19.0, 20.5]
+    assert database.readPool.getStats()["leased"] == 0
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_export_endpoint(database, compress):
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+
+    # Act
+    response = client.get(
+        "/api/v1.0/export/temperature",
+        query_string={"room": 1, "gzip": str(compress).lower()},
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+    body = gzip.decompress(response.data) if compress else response.data
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    assert [row["temp"] for row in rows] == [20.0, 20.5]
+    assert rows[0]["settemp"] == 21.0
+
+
+def test_export_csv(database):
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+
+    # Act
+    response = client.get("/api/v1.0/export/weather", query_string={"format": "csv"})
+
+    # Assert
+    assert response.status_code == 200
+    assert response.data == b"ts,temp\n"
@@ -0,0 +1,69 @@
+import pytest
+from fulltext import MatchQuery
+
+
+@pytest.mark.parametrize(
+    "q, filter, expected",
+    [
+        (None, None, ""),
+        ("dev", None, '"dev"*'),
+        ("api dev", None, '"api"* AND "dev"*'),
+        (None, {"host": "127.0"}, 'host : "127.0"*'),
+        ('a"b', {"uri": ""}, '"a""b"*'),
+    ],
+)
+def test_match_query(q, filter, expected):
+    assert MatchQuery("web_traces", q, filter) == expected
+
+
+def test_match_query_rejects_columns():
+    with pytest.raises(ValueError):
+        MatchQuery("web_traces", filter={"elapsed": "1"})
+
+
+@pytest.fixture
+def database(database):
+    database.log_traces("HTTP/1.1", "127.0.0.1", "local", "/api/v1.0/devices", 1, "200")
+    database.log_traces(
+        "HTTP/1.1", "api.besmart-home.com", "cloud", "/fwUpgrade/x.bin", 2, "404"
+    )
+    database.flush()
+    return database
+
+
+@pytest.mark.parametrize(
+    "q, filter, expected",
+    [
+        (None, None, ["api.besmart-home.com", "127.0.0.1"]),
+        ("dev", None, ["127.0.0.1"]),
+        ("besmart 404", None, ["api.besmart-home.com"]),
+        (None, {"host": "127.0"}, ["127.0.0.1"]),
+        (None, {"uri": "fwupgrade", "response_status": "200"}, []),
+    ],
+)
+def test_call_search(database, q, filter, expected):
+    # Act
+    rc = database.get_calls(q=q, filter=filter)
+
+    # Assert
+    assert [row["host"] for row in rc["data"]] == expected
+    assert rc["meta"]["total"] == len(expected)
+
+
+def test_purge_updates_index(database):
+    # Arrange
+    old = database.partitions.table("web_traces", 1_700_000_000_000)
+
+    # Act
+    rc = database.partitions.drop_before(2**42)
+
+    # Assert
+    assert old in rc["dropped"]
+    assert rc["deleted"] == 2
+    conn = database.get_connection()
+    tables = conn.run_sql(
+        "select name from sqlite_master where name like ?", (f"{old}%",)
+    )
+    conn.close()
+    assert tables == []
+    assert database.get_calls(q="dev")["data"] == []
@@ -0,0 +1,116 @@
+import sqlite3
+import pytest
+from database import EpochMs
+from migrations import BASE_VERSION, LATEST_VERSION, Migration, MigrationRunner
+
+# Left for the test to migrate
+UNMIGRATED = pytest.mark.parametrize(
+    "database", [{"migrate": False}], indirect=True, ids=["unmigrated"]
+)
+
+
+def version(database):
+    conn = database.get_connection()
+    rc = conn.fetchone("pragma user_version")["user_version"]
+    conn.close()
+    return rc
+
+
+def plan(database, sql, values):
+    conn = database.get_connection()
+    rc = " ".join(
+        r["detail"] for r in conn.run_sql(f"explain query plan {sql}", values)
+    )
+    conn.close()
+    return rc
+
+
+@UNMIGRATED
+def test_upgrade_from_base_version(database):
+    # Arrange
+    conn = database.get_connection()
+    database.create_tables(conn=conn)
+    conn.run_sql(f"pragma user_version = {BASE_VERSION}")
+    conn.run_sql(
+        "insert into besim_temperature values ('2024-01-01T10:00:00.250000+01:00', '1', 20.5, 21, 0)"
+    )
+    conn.close()
+
+    # Act
+    assert database.check_migrations()
+
+    # Assert
+    assert version(database) == LATEST_VERSION
+    assert "_thermostat_ts (thermostat=? AND ts>? AND ts<?)" in plan(
+        database,
+        "select ts,temp from besim_temperature where thermostat = ? and ts between ? and ?",
+        (1, 0, 1),
+    )
+    rows = database.get_temperature(
+        1, "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", step=False
+    )
+    assert len(rows) == 1
+    assert EpochMs(rows[0]["ts"]) == 1704099600250
+    assert rows[0]["temp"] == 20.5
+    assert rows[0]["settemp"] == 21
+    assert "_ts (ts>? AND ts<?)" in plan(
+        database, "select * from web_traces where ts between ? and ?", (0, 1)
+    )
+
+
+@UNMIGRATED
+@pytest.mark.parametrize("user_version", [3, LATEST_VERSION + 1])
+def test_unknown_version(database, user_version):
+    # Arrange
+    conn = database.get_connection()
+    conn.run_sql(f"pragma user_version = {user_version}")
+    conn.close()
+
+    # Act / Assert
+    assert not database.check_migrations()
+
+
+def test_failed_step_keeps_last_version(tmp_path):
+    # Arrange
+    sqlite = sqlite3.connect(tmp_path / "test.db", autocommit=False)
+    runner = MigrationRunner(
+        [
+            Migration(2, "ok", ("create table a(x)",)),
+            Migration(3, "broken", ("create table b(x)", "select * from missing")),
+        ]
+    )
+
+    # Act
+    with pytest.raises(sqlite3.OperationalError):
+        runner.run(sqlite, 1)
+
+    # Assert
+    assert sqlite.execute("pragma user_version").fetchone()[0] == 2
+    tables = {r[0] for r in sqlite.execute("select name from sqlite_master")}
+    assert tables == {"a"}
+    sqlite.close()
+
+
+@UNMIGRATED
+def test_status(database):
+    # Arrange
+    database.check_migrations()
+
+    # Act
+    status = database.get_status()
+
+    # Assert
+    assert status["version"] == status["target_version"] == LATEST_VERSION
+    assert status["migration"]["running"] is False
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2024-01-01T10:00:00+01:00", 1704099600000),
+        ("2024-01-01T09:00:00.123456+00:00", 1704099600123),
+        (1704099600000, 1704099600000),
+    ],
+)
+def test_epoch_ms(value, expected):
+    assert EpochMs(value) == expected
@@ -0,0 +1,39 @@
+import logging
+from packetTrace import HexDump, PacketTrace, RateLimitedLogger
+
+
+def test_hexdump_is_lazy():
+    # Arrange
+    dump = HexDump(b"\xfa\xd4", sep="")
+
+    # Act / Assert
+    assert str(dump) == "FAD4"
+
+
+def test_packet_trace_keeps_last_frames():
+    # Arrange
+    trace = PacketTrace(size=3)
+
+    # Act
+    for i in range(5):
+        trace.record("in", ("10.0.0.1", 6199), bytes([i]))
+
+    # Assert
+    frames = trace.dump()
+    assert [f["data"] for f in frames] == ["02", "03", "04"]
+    assert frames[0]["peer"] == "10.0.0.1:6199"
+    assert frames[0]["direction"] == "in"
+
+
+def test_rate_limited_logger(caplog):
+    # Arrange
+    limited = RateLimitedLogger(logging.getLogger("test"), interval=3600)
+
+    # Act
+    with caplog.at_level(logging.WARNING):
+        for i in range(5):
+            limited.warning((1, "unk1"), "Unexpected unk1=%x", i)
+        limited.warning((2, "unk1"), "Unexpected unk1=%x", 0)
+
+    # Assert
+    assert len(caplog.records) == 2
@@ -0,0 +1,89 @@
+import pytest
+from pagination import CALL_SORT, CountCache, KeysetClause, SortKeys
+
+
+@pytest.mark.parametrize(
+    "sort, expected",
+    [
+        (None, (CALL_SORT["ts"], True)),
+        ("ts asc", (CALL_SORT["ts"], False)),
+        ("rowid DESC", (CALL_SORT["rowid"], True)),
+    ],
+)
+def test_sort_keys(sort, expected):
+    assert SortKeys(sort, CALL_SORT) == expected
+
+
+@pytest.mark.parametrize(
+    "sort", ["elapsed", "ts sideways", "ts desc, uri", "ts; drop table web_traces"]
+)
+def test_sort_keys_rejected(sort):
+    with pytest.raises(ValueError):
+        SortKeys(sort, CALL_SORT)
+
+
+@pytest.mark.parametrize("cursor", ["x", "1", "1,2,3"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        KeysetClause(CALL_SORT["ts"], True, cursor)
+
+
+def test_count_cache():
+    # Arrange
+    cache = CountCache()
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return len(computed)
+
+    # Act / Assert
+    assert cache.get("web_traces", "key", compute) == 1
+    assert cache.get("web_traces", "key", compute) == 1
+    cache.invalidate("unknown_udp")
+    assert cache.get("web_traces", "key", compute) == 1
+    cache.invalidate("web_traces")
+    assert cache.get("web_traces", "key", compute) == 2
+    assert cache.getStats()["hits"] == 2
+
+
+@pytest.mark.parametrize("method", ["get_calls", "get_calls_group"])
+def test_keyset_pages(database, method):
+    # Arrange
+    for i in range(7):
+        database.log_traces("HTTP/1.1", f"host{i}", "map", "/api", i, "200")
+    database.flush()
+
+    # Act
+    pages = []
+    cursor = None
+    while True:
+        rc = getattr(database, method)(limit=3, cursor=cursor)
+        pages.append([row["host"] for row in rc["data"]])
+        cursor = rc["meta"]["next"]
+        if cursor is None:
+            break
+
+    # Assert
+    assert rc["meta"]["total"] == 7
+    assert pages == [
+        ["host6", "host5", "host4"],
+        ["host3", "host2", "host1"],
+        ["host0"],
+    ]
+
+
+def test_total_invalidated_on_insert(database):
+    # Arrange
+    database.log_traces("HTTP/1.1", "host", "map", "/api", 1, "200")
+    database.flush()
+    assert database.get_calls()["meta"]["total"] == 1
+
+    # Act
+    database.log_traces("HTTP/1.1", "host", "map", "/api", 1, "200")
+    database.flush()
+
+    # Assert
+    assert database.get_calls()["meta"]["total"] == 2
+    assert database.get_calls()["meta"]["total"] == 2
+    assert database.counts.getStats()["hits"] == 1
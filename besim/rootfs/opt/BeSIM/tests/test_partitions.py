@@ -0,0 +1,105 @@
+from database import EpochMs
+from partitions import ListPartitions, MonthOf, MonthRange
+
+JAN = MonthRange(202401)[0]
+FEB = MonthRange(202402)[0]
+MAR = MonthRange(202403)[0]
+
+
+def test_month_range():
+    # Arrange
+    start, end = MonthRange(202412)
+
+    # Assert
+    assert MonthOf(start) == 202412
+    assert MonthOf(end - 1) == 202412
+    assert MonthOf(end) == 202501
+
+
+def insert(database, ts, temp):
+    conn = database.get_connection()
+    table = database.partitions.table("besim_temperature", ts)
+    conn.run_sql(
+        f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, 1, ?, 210, 0)",
+        (ts, temp),
+    )
+    conn.close(commit=True)
+
+
+def partitions(database):
+    conn = database.get_connection()
+    rc = ListPartitions(conn.getConn(), "besim_temperature")
+    conn.close()
+    return rc
+
+
+def test_ids_continue_across_partitions(database):
+    # Act
+    insert(database, JAN, 200)
+    insert(database, JAN + 1, 201)
+    insert(database, FEB, 202)
+
+    # Assert
+    conn = database.get_connection()
+    rows = conn.run_sql("select id, temp from besim_temperature order by ts")
+    conn.close()
+    assert [(row["id"], row["temp"]) for row in rows] == [(1, 200), (2, 201), (3, 202)]
+
+
+def test_view_uses_partition_indexes(database):
+    # Arrange
+    insert(database, JAN, 200)
+    insert(database, FEB, 202)
+
+    # Act
+    conn = database.get_connection()
+    plan = " ".join(
+        row["detail"]
+        for row in conn.run_sql(
+            "explain query plan select * from besim_temperature where thermostat = ? and ts between ? and ?",
+            (1, JAN, FEB),
+        )
+    )
+    conn.close()
+
+    # Assert
+    assert "besim_temperature_p202401_thermostat_ts" in plan
+    assert "besim_temperature_p202402_thermostat_ts" in plan
+
+
+def test_drop_before(database):
+    # Arrange
+    insert(database, JAN, 200)
+    insert(database, FEB, 201)
+    insert(database, FEB + 1000, 202)
+    insert(database, MAR, 203)
+
+    # Act
+    rc = database.partitions.drop_before(FEB + 1)
+
+    # Assert
+    assert rc["dropped"] == ["besim_temperature_p202401"]
+    assert rc["deleted"] == 1
+    assert 202401 not in partitions(database)
+    conn = database.get_connection()
+    temps = [
+        row["temp"]
+        for row in conn.run_sql("select temp from besim_temperature order by ts")
+    ]
+    conn.close()
+    assert temps == [202, 203]
+
+
+def test_drop_before_keeps_latest_partition(database):
+    # Arrange
+    insert(database, JAN, 200)
+    latest = partitions(database)[-1]
+
+    # Act
+    database.partitions.drop_before(EpochMs() + 86400 * 1000)
+
+    # Assert
+    assert partitions(database) == [latest]
+    conn = database.get_connection()
+    assert conn.run_sql("select count(*) as n from besim_temperature")[0]["n"] == 0
+    conn.close()
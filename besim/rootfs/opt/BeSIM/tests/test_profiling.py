@@ -0,0 +1,58 @@
+import os
+import time
+import pytest
+from profiling import HotPathProfiler, LatencyHistogram, PhaseStats
+
+
+@pytest.mark.parametrize("value", [0, 1, 15, 16, 31, 32, 1000, 123456, 10**9])
+def test_histogram_bucket_bounds(value):
+    index = LatencyHistogram.index(value)
+    assert LatencyHistogram.lowest(index) <= value
+    assert value < LatencyHistogram.lowest(index + 1)
+
+
+def test_histogram_percentiles():
+    # Arrange
+    histogram = LatencyHistogram()
+
+    # Act
+    for value in range(1, 10001):
+        histogram.record(value * 1000)
+
+    # Assert
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 10000
+    assert snapshot["p50_us"] == pytest.approx(5000, rel=0.07)
+    assert snapshot["p99_us"] == pytest.approx(9900, rel=0.07)
+    assert snapshot["max_us"] == 10000
+
+
+def test_phase_stats():
+    stats = PhaseStats()
+
+    stats.begin()
+    stats.mark("decode")
+    with stats.phase("db"):
+        time.sleep(0.01)
+    stats.end("STATUS")
+
+    snapshot = stats.snapshot()["STATUS"]
+    assert snapshot["db"]["count"] == 1
+    assert snapshot["db"]["min_us"] >= 10000
+    assert snapshot["total"]["max_us"] >= snapshot["db"]["max_us"]
+
+
+@pytest.mark.parametrize("mode", HotPathProfiler.MODES)
+def test_profiler_writes_results(tmp_path, mode):
+    # Arrange
+    profiler = HotPathProfiler(str(tmp_path))
+
+    # Act
+    profiler.start(60, mode, interval=0.001)
+    for _ in range(20):
+        profiler.runcall(time.sleep, 0.002)
+    files = profiler.stop()
+
+    # Assert
+    assert not profiler.status()["active"]
+    assert files and all(os.path.exists(f) for f in files)
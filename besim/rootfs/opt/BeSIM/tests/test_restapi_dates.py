@@ -0,0 +1,30 @@
+import pytest
+from restapi import app
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/api/v1.0/devices/1/rooms/1/history",
+        "/api/v1.0/call/history",
+        "/api/v1.0/call/unknown/udp",
+        "/api/v1.0/call/unknown/api",
+        "/api/v1.0/export/temperature",
+    ],
+)
+@pytest.mark.parametrize("param", ["from", "to"])
+def test_bad_date(database, url, param):
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+
+    # Act
+    response = client.get(
+        url,
+        query_string={param: "garbage"},
+        base_url="http://api.besmart-home.com",
+    )
+
+    # Assert
+    assert response.status_code == 400
+    assert "garbage" in response.json["message"]
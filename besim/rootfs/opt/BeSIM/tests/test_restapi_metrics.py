@@ -0,0 +1,19 @@
+from restapi import app
+from metrics import UDP_PACKETS
+
+
+def test_metrics():
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+    UDP_PACKETS.labels("STATUS", "in").inc()
+
+    # Act
+    response = client.get("/metrics")
+
+    # Assert
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert 'besim_udp_packets_total{direction="in",msg="STATUS"}' in body
+    assert 'besim_status_entries{kind="devices"}' in body
+    assert 'besim_weather_cache_requests_total{result="hit"}' in body
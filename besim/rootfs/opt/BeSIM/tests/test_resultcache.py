@@ -0,0 +1,106 @@
+import time
+from database import EpochMs
+from resultcache import RESULT_CACHE_SETTLE, ResultCache
+
+
+def test_result_cache_generations():
+    # Arrange
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    # Act
+    first = cache.get(("t", "1"), "k", False, compute)
+    second = cache.get(("t", "1"), "k", False, compute)
+    cache.invalidate("t", "2")
+    third = cache.get(("t", "1"), "k", False, compute)
+    cache.invalidate("t", "1")
+    fourth = cache.get(("t", "1"), "k", False, compute)
+
+    # Assert
+    assert (first, second, third, fourth) == (1, 1, 1, 2)
+    assert cache.getStats() == {
+        "entries": 1,
+        "hits": 2,
+        "misses": 2,
+        "hit_ratio": 0.5,
+    }
+
+
+def test_result_cache_closed_and_ttl():
+    # Arrange
+    cache = ResultCache(ttl=0.01)
+    cache.get(("t", None), "closed", True, lambda: "closed")
+    cache.get(("t", None), "open", False, lambda: "open")
+
+    # Act
+    time.sleep(0.02)
+    cache.invalidate("t")
+
+    # Assert
+    assert cache.get(("t", None), "closed", True, lambda: "again") == "closed"
+    assert cache.get(("t", None), "open", False, lambda: "again") == "again"
+
+
+def test_history_invalidated_by_insert(database):
+    # Arrange
+    database.log_temperature(1, 20.0, 21.0, 1)
+    database.flush()
+    first = database.get_temperature(1, step=False)
+
+    # Act
+    cached = database.get_temperature(1, step=False)
+    database.log_temperature(2, 18.0, 21.0, 0)
+    database.flush()
+    other = database.get_temperature(1, step=False)
+    database.log_temperature(1, 20.5, 21.0, 1)
+    database.flush()
+    newer = database.get_temperature(1, step=False)
+
+    # Assert
+    assert cached is first and other is first
+    assert [row["temp"] for row in newer] == [20.0, 20.5]
+    assert database.get_status()["results"]["hits"] == 2
+
+
+def test_history_closed_window(database):
+    # Arrange
+    date_to = EpochMs() - RESULT_CACHE_SETTLE - 1000
+    date_from = date_to - 3600 * 1000
+    ts = date_from + 1000
+    partition = database.partitions.table("besim_temperature", ts)
+    conn = database.get_connection()
+    conn.run_sql(
+        f"insert into {partition}(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)",
+        (ts, 1, 200, 210, 1),
+    )
+    conn.close(commit=True)
+    first = database.get_temperature(1, date_from, date_to, step=False)
+
+    # Act
+    database.log_temperature(1, 20.5, 21.0, 1)
+    database.flush()
+
+    # Assert
+    assert database.get_temperature(1, date_from, date_to, step=False) is first
+    database.purge(3650)
+    assert database.get_temperature(1, date_from, date_to, step=False) is not first
+
+
+def test_history_invalidated_on_commit(database):
+    # Arrange: the row stays queued until flush()
+    assert database.writer is not None
+    database.writer.interval = 1.0
+    database.log_temperature(1, 20.0, 21.0, 1)
+    before = database.get_temperature(1, resolution="raw", step=False)
+
+    # Act
+    database.flush()
+    after = database.get_temperature(1, resolution="raw", step=False)
+
+    # Assert
+    assert before == []
+    assert [row["temp"] for row in after] == [20.0]
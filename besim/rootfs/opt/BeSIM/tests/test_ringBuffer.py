@@ -0,0 +1,137 @@
+import pytest
+from database import EpochMs
+from databaseConnection import DatabaseType
+from ringBuffer import RINGS, RingBuffer
+
+
+def test_ring_buffer_wraps():
+    # Arrange
+    ring = RingBuffer(RINGS["besim_temperature"], 4)
+
+    # Act
+    for i in range(6):
+        ring.append((1000 + i, i % 2, None if i == 5 else 200 + i, 210, 1))
+
+    # Assert
+    assert len(ring) == 4
+    assert ring.getStats() == {"rows": 4, "pending": 4, "lost": 2}
+    assert [row["ts"] for row in ring.select(0, 2000)] == [1002, 1003, 1004, 1005]
+    assert ring.select(0, 2000, ("ts", "temp"), thermostat=1) == [
+        {"ts": 1003, "temp": 203},
+        {"ts": 1005, "temp": None},
+    ]
+    assert ring.select(0, 1004, ("ts",), last=True, thermostat=0) == [{"ts": 1004}]
+    assert ring.total(1003, 1004) == 2
+
+
+def test_ring_buffer_flushed():
+    # Arrange
+    ring = RingBuffer(RINGS["web_traces"], 8)
+    for i in range(3):
+        ring.append((1000 + i, "10.0.0.1", "map", "host", "/uri", 1.5, "200"))
+
+    # Act
+    end, rows = ring.pending()
+    ring.append((2000, "10.0.0.2", None, "host", "/uri", None, "404"))
+    ring.markFlushed(end)
+
+    # Assert
+    assert rows[0] == (1000, "10.0.0.1", "map", "host", "/uri", 1.5, "200")
+    assert ring.pending() == (
+        4,
+        [(2000, "10.0.0.2", None, "host", "/uri", None, "404")],
+    )
+
+
+MEMORY = pytest.mark.parametrize(
+    "database", [{"backend": DatabaseType.MEMORY}], indirect=True, ids=["memory"]
+)
+
+
+@MEMORY
+def test_memory_backend(database):
+    # Arrange
+    database.log_temperature(1, 20.0, 21.0, 1)
+    database.log_outside_temperature(5.5)
+    database.log_traces("10.0.0.1", "host", "map", "/uri", 12, "200")
+
+    # Act
+    pending = database.get_status()["memory"]["tables"]
+    temperature = database.get_temperature(1, step=False)
+    outside = database.get_outside_temperature()
+    calls = database.get_calls()
+
+    # Assert
+    assert pending["besim_temperature"]["pending"] == 1
+    assert [(row["temp"], row["heating"]) for row in temperature] == [(20.0, 1)]
+    assert [row["temp"] for row in outside] == [5.5]
+    assert calls["meta"]["total"] == 1
+    assert calls["data"][0]["host"] == "host"
+    conn = database.get_connection()
+    for table in ("besim_temperature", "web_traces"):
+        assert conn.fetchone(f"select count(*) as n from {table}")["n"] == 0
+    conn.close()
+
+
+@MEMORY
+def test_memory_backend_merged(database):
+    # Arrange: one call written, two still in memory
+    database.log_traces("10.0.0.1", "api.besmart-home.com", "map", "/a", 10, "200")
+    database.flush_memory()
+    database.log_traces("10.0.0.1", "api.besmart-home.com", "map", "/b", 30, "200")
+    database.log_traces("10.0.0.2", "www.cloudwarm.net", "map", "/c", 5, "404")
+    database.log_temperature(1, 20.0, 21.0, 1)
+
+    # Act
+    matched = database.get_calls(q="besmart")
+    filtered = database.get_calls(filter={"response_status": "404"})
+    groups = database.get_calls_group()
+    calls = [row for batch in database.export("calls") for row in batch]
+    temperature = [row for batch in database.export("temperature") for row in batch]
+
+    # Assert
+    assert [row["uri"] for row in matched["data"]] == ["/b", "/a"]
+    assert matched["meta"]["total"] == 2
+    assert [row["uri"] for row in filtered["data"]] == ["/c"]
+    assert {
+        (row["host"], row["cardinal"], row["elapsed"]) for row in groups["data"]
+    } == {("api.besmart-home.com", 2, 20.0), ("www.cloudwarm.net", 1, 5.0)}
+    assert [row[4] for row in calls] == ["/a", "/b", "/c"]
+    assert [row[1:] for row in temperature] == [[1, 20.0, 21.0, 1]]
+    assert database.get_status()["memory"]["tables"]["web_traces"]["pending"] == 2
+
+
+@MEMORY
+def test_memory_backend_flush(database):
+    # Arrange
+    for temp in (20.0, 20.5):
+        database.log_temperature(1, temp, 21.0, 1)
+
+    # Act
+    written = database.flush_memory()
+    database.log_temperature(1, 21.0, 21.0, 0)
+
+    # Assert
+    assert written == ["besim_temperature"]
+    conn = database.get_connection()
+    assert conn.fetchone("select count(*) as n from besim_temperature")["n"] == 2
+    conn.close()
+    rows = database.get_temperature(1, EpochMs() - 60000, step=False)
+    assert [row["temp"] for row in rows] == [20.0, 20.5, 21.0]
+
+
+@MEMORY
+def test_memory_backend_export_flushed(database):
+    # Arrange
+    database.log_traces("10.0.0.1", "host", "map", "/a", 10, "200")
+    database.flush_memory()
+    database.log_traces("10.0.0.1", "host", "map", "/b", 30, "200")
+    batches = database.export("calls", batchSize=1)
+
+    # Act: flushed once the export has started
+    first = next(batches)
+    database.flush_memory()
+    rest = [row for batch in batches for row in batch]
+
+    # Assert
+    assert [row[4] for row in first + rest] == ["/a", "/b"]
@@ -0,0 +1,195 @@
+import pytest
+from database import ColumnarRows
+from rollups import DAY_MS, HOUR_MS, RollupAccumulator
+
+
+def test_accumulator_buckets():
+    # Arrange
+    rollups = RollupAccumulator(flushInterval=0)
+
+    # Act
+    rollups.addTemperature(1, 10 * HOUR_MS + 1, 200, 210, 1)
+    rollups.addTemperature(1, 10 * HOUR_MS + 2, 220, 210, 0)
+    rollups.addTemperature(1, 11 * HOUR_MS, 180, 210, 0)
+    rollups.addOutside(10 * HOUR_MS, 50)
+
+    # Assert
+    assert rollups.due()
+    rows = {
+        (table, values[0], values[1]): values for table, _, values in rollups.drain()
+    }
+    assert rows[("besim_temperature_hour", 1, 10 * HOUR_MS)] == (
+        1,
+        10 * HOUR_MS,
+        2,
+        200,
+        220,
+        420,
+        420,
+        1,
+    )
+    assert ("besim_temperature_hour", 1, 11 * HOUR_MS) in rows
+    assert ("besim_temperature_day", 1, 0) in rows
+    assert ("besim_outside_temperature_hour", 10 * HOUR_MS, 1) in rows
+    assert not rollups.due()
+
+
+@pytest.mark.parametrize(
+    "points, resolution, expected, count",
+    [
+        (None, None, "raw", 24),
+        (1000, None, "raw", 24),
+        (10, None, "raw", 10),
+        (5, None, "hour", 5),
+        (1, None, "day", 1),
+        (None, "hour", "hour", 6),
+    ],
+)
+def test_history_resolution(database, points, resolution, expected, count):
+    # Arrange
+    start = 1_700_000_000_000 - 1_700_000_000_000 % (24 * HOUR_MS)
+    conn = database.get_connection()
+    for i in range(24):
+        ts = start + i * HOUR_MS // 4
+        database.rollups.addTemperature(1, ts, 200 + i, 210, i % 2)
+        table = database.partitions.table("besim_temperature", ts)
+        conn.run_sql(
+            f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, 1, ?, 210, ?)",
+            (ts, 200 + i, i % 2),
+        )
+    conn.close()
+    database.flush()
+
+    # Act
+    rows = database.get_temperature(
+        1,
+        start,
+        start + 6 * HOUR_MS - 1,
+        step=False,
+        points=points,
+        resolution=resolution,
+    )
+
+    # Assert
+    assert len(rows) == count
+    if expected == "raw":
+        assert "samples" not in rows[0]
+    elif expected == "hour":
+        assert rows[0]["temp"] == 20.15  # 200..203
+        assert rows[0]["temp_max"] == 20.3
+        assert rows[0]["heating"] == 0.5
+        assert rows[0]["samples"] == 4
+    else:
+        assert rows[0]["samples"] == 24
+
+
+def test_history_points_budget(database):
+    # Arrange: 14 days, a sample every 10 minutes
+    start = 1_700_000_000_000 - 1_700_000_000_000 % DAY_MS
+    for i in range(14 * 24 * 6):
+        database.rollups.addTemperature(1, start + i * 600_000, 200 + i % 30, 210, 0)
+    database.flush_rollups()
+    database.flush()
+
+    # Act
+    rows = database.get_temperature(
+        1, start, start + 14 * DAY_MS - 1, step=False, points=300
+    )
+
+    # Assert: the hourly rollups (336 rows) reduced by LTTB
+    assert len(rows) == 300
+    assert rows[0]["samples"] == 6
+
+
+def test_history_does_not_flush_rollups(database):
+    # Arrange
+    start = 1_700_000_000_000 - 1_700_000_000_000 % (24 * HOUR_MS)
+    database.rollups.addTemperature(1, start, 200, 210, 1)
+
+    # Act
+    rows = database.get_temperature(
+        1, start, start + HOUR_MS - 1, step=False, resolution="hour"
+    )
+
+    # Assert
+    assert rows == []
+    assert database.rollups.pending
+
+
+def test_columnar_rows():
+    # Arrange
+    rows = [
+        {"ts": 1000, "temp": 200, "heating": 1},
+        {"ts": 61000, "temp": None, "heating": 0},
+        {"ts": 181000, "temp": 215, "heating": 0},
+    ]
+
+    # Act
+    rc = ColumnarRows(rows, temps=("temp",))
+
+    # Assert
+    assert rc == {
+        "ts": [1000, 60000, 120000],
+        "temp": [20.0, None, 21.5],
+        "heating": [1, 0, 0],
+    }
+    assert ColumnarRows([]) == {"ts": []}
+
+
+@pytest.mark.parametrize("resolution", ["raw", "hour"])
+def test_history_columnar(database, resolution):
+    # Arrange
+    start = 1_700_000_000_000 - 1_700_000_000_000 % (24 * HOUR_MS)
+    conn = database.get_connection()
+    for i in range(8):
+        ts = start + i * HOUR_MS // 4
+        database.rollups.addTemperature(1, ts, 200 + i, 210, 0)
+        table = database.partitions.table("besim_temperature", ts)
+        conn.run_sql(
+            f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, 1, ?, 210, 0)",
+            (ts, 200 + i),
+        )
+    conn.close()
+    database.flush()
+
+    # Act
+    rows = database.get_temperature(
+        1, start, start + 2 * HOUR_MS - 1, step=False, resolution=resolution
+    )
+    columns = database.get_temperature(
+        1,
+        start,
+        start + 2 * HOUR_MS - 1,
+        step=False,
+        resolution=resolution,
+        format="columnar",
+    )
+
+    # Assert
+    assert set(columns) == set(rows[0])
+    assert columns["temp"] == [row["temp"] for row in rows]
+    assert columns["ts"][0] == start
+    assert set(columns["ts"][1:]) == {HOUR_MS // 4 if resolution == "raw" else HOUR_MS}
+
+
+def test_history_lttb(database):
+    # Arrange
+    start = 1_700_000_000_000
+    conn = database.get_connection()
+    for i in range(50):
+        ts = start + i * 60_000
+        table = database.partitions.table("besim_temperature", ts)
+        conn.run_sql(
+            f"insert into {table}(ts, thermostat, temp, settemp, heating) values (?, 1, ?, 210, 0)",
+            (ts, 300 if i == 20 else 200),
+        )
+    conn.close()
+
+    # Act
+    rows = database.get_temperature(
+        1, start, start + 50 * 60_000, step=False, points=8, resolution="raw"
+    )
+
+    # Assert
+    assert len(rows) == 8
+    assert 30.0 in [row["temp"] for row in rows]
@@ -0,0 +1,57 @@
+import threading
+import pytest
+from scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(workers=2)
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_schedule_fires(scheduler):
+    # Arrange
+    done = threading.Event()
+
+    # Act
+    scheduler.schedule("key", 0.01, done.set)
+
+    # Assert
+    assert done.wait(2)
+    assert scheduler.getStats()["fired"] == 1
+
+
+def test_schedule_dedup(scheduler):
+    # Arrange
+    calls = []
+    done = threading.Event()
+
+    def call(value):
+        calls.append(value)
+        done.set()
+
+    # Act
+    scheduler.schedule("key", 0.05, call, 1)
+    assert not scheduler.schedule("key", 0, call, 2, replace=False)
+    scheduler.schedule("key", 0.05, call, 3)
+
+    # Assert
+    assert done.wait(2)
+    assert scheduler.due("key") is None
+    assert calls == [3]
+
+
+def test_cancel(scheduler):
+    # Arrange
+    done = threading.Event()
+    scheduler.schedule("key", 0.05, done.set)
+
+    # Act
+    cancelled = scheduler.cancel("key")
+
+    # Assert
+    assert cancelled
+    assert not done.wait(0.2)
+    assert scheduler.getStats()["pending"] == 0
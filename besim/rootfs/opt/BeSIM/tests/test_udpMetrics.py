@@ -0,0 +1,55 @@
+import struct
+import pytest
+from udpMetrics import RateCounter, UdpMetrics
+from udpserver import Frame
+
+PAYLOAD = bytes(range(16))
+GOOD = Frame(PAYLOAD).encode()
+
+
+@pytest.mark.parametrize(
+    "data, reason",
+    [
+        (GOOD, None),
+        (b"\x00" + GOOD[1:], "header"),
+        (GOOD[:-1], "length"),
+        (GOOD[:6], "length"),
+        (GOOD[:-4] + struct.pack("<H", 0) + GOOD[-2:], "crc"),
+        (GOOD[:-2] + b"\x00\x00", "footer"),
+    ],
+)
+def test_frame_decode_reason(data, reason):
+    frame = Frame()
+    payload = frame.decode(data)
+    assert frame.error == reason
+    assert (payload == PAYLOAD) if reason is None else payload is None
+
+
+def test_rate_counter():
+    # Arrange
+    counter = RateCounter(window=10.0, now=1000.0)
+
+    # Act
+    for i in range(20):
+        counter.add(100, now=1000.0 + i * 0.5)
+
+    # Assert
+    snapshot = counter.snapshot(now=1010.0)
+    assert snapshot["packets"] == 20
+    assert snapshot["bytes"] == 2000
+    assert snapshot["packets_per_sec"] == pytest.approx(2.0)
+    assert counter.snapshot(now=1040.0)["packets_per_sec"] == 0.0
+
+
+def test_udp_metrics_snapshot():
+    metrics = UdpMetrics()
+    metrics.countIn(("192.168.0.105", 6199), 54)
+    metrics.countOut(("192.168.0.105", 6199), 30)
+    metrics.countMalformed("crc")
+    metrics.countMalformed("crc")
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot["peers"]["192.168.0.105:6199"]["in"]["bytes"] == 54
+    assert snapshot["peers"]["192.168.0.105:6199"]["out"]["packets"] == 1
+    assert snapshot["malformed"] == {"crc": 2}
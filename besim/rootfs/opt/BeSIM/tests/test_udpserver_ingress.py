@@ -0,0 +1,85 @@
+import struct
+import time
+import pytest
+import proxyUdpServer
+from udpserver import Frame, MsgId, PeekDeviceId, UdpServer, Wrapper
+
+
+def make_frame(deviceid: int) -> bytes:
+    payload = struct.pack("<BBHI", 0xFF, 0, 0, deviceid)
+    return Frame(Wrapper(payload=payload).encodeDL(MsgId.PING, 0, write=1)).encode()
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (make_frame(596505258), 596505258),
+        (make_frame(1), 1),
+        # Knock and garbage datagrams have no deviceid
+        (bytes([0x58]), None),
+        (bytes(32), None),
+    ],
+)
+def test_PeekDeviceId(data, expected):
+    assert PeekDeviceId(data) == expected
+
+
+def test_enqueue_shards_by_device_and_drops_when_full():
+    # Arrange
+    server = UdpServer(("127.0.0.1", 0), queueSize=1, workers=4)
+    frame = make_frame(596505258)
+
+    # Act
+    first = server.enqueue(frame, ("192.168.0.105", 6199))
+    second = server.enqueue(frame, ("192.168.0.105", 6199))
+
+    # Assert
+    assert first is True
+    assert second is False
+    stats = server.getIngressStats()
+    assert stats["received"] == 2
+    assert stats["dropped"] == 1
+    assert stats["queue_depth"] == 1
+    assert server.shardOf(frame, ("10.0.0.1", 1)) == server.shardOf(
+        frame, ("10.0.0.2", 2)
+    )
+
+
+def test_proxy_knocks_per_peer(monkeypatch):
+    # Arrange
+    class Resolver:
+        def query(self, name, kind):
+            return iter([type("Answer", (), {"to_text": lambda self: "10.0.0.9"})()])
+
+    monkeypatch.setattr(proxyUdpServer.dns.resolver, "Resolver", Resolver)
+    server = proxyUdpServer.ProxyUdpServer(("127.0.0.1", 0), "1.1.1.1", workers=4)
+    knock, frame = bytes([0x58]), make_frame(596505258)
+
+    # Act
+    for _ in range(3):
+        server.handleMsg(knock, ("10.0.0.1", 1))
+    server.handleMsg(knock, ("10.0.0.2", 2))
+
+    # Assert
+    assert server.knocks == {("10.0.0.1", 1): 3, ("10.0.0.2", 2): 1}
+    assert server.shardOf(knock, ("10.0.0.1", 1)) == server.shardOf(
+        frame, ("10.0.0.1", 1)
+    )
+
+
+def test_shutdown_handles_queued(database):
+    # Arrange
+    server = UdpServer(("127.0.0.1", 0), workers=2)
+    handled = []
+    server.handleMsg = lambda data, addr: handled.append(data) or "PING"
+    server.start()
+    while server.sock is None or not server.workers:
+        time.sleep(0.01)
+    server.enqueue(make_frame(1), ("10.0.0.1", 1))
+
+    # Act
+    server.shutdown(timeout=5)
+
+    # Assert
+    assert not server.is_alive()
+    assert handled == [make_frame(1)]
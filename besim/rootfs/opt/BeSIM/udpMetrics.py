@@ -0,0 +1,144 @@
+#
+# Counters for the UDP listener: per-peer traffic, malformed frames and
+# kernel receive-buffer drops
+#
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+
+# Not exported by the socket module, value from linux/asm-generic/socket.h
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+
+PROC_NET_UDP = "/proc/net/udp"
+
+
+class RateCounter:
+    """Total packets/bytes plus the rate measured over the last completed window"""
+
+    def __init__(self, window: float = 10.0, now: float | None = None) -> None:
+        self.window = window
+        self.packets = 0
+        self.bytes = 0
+        self._windowStart = time.monotonic() if now is None else now
+        self._windowPackets = 0
+        self._windowBytes = 0
+        self._pps = 0.0
+        self._bps = 0.0
+
+    def _roll(self, now: float) -> None:
+        elapsed = now - self._windowStart
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self._pps = self._windowPackets / elapsed
+            self._bps = self._windowBytes / elapsed
+        else:
+            # Nothing was counted during the last complete window
+            self._pps = self._bps = 0.0
+        self._windowStart = now
+        self._windowPackets = self._windowBytes = 0
+
+    def add(self, nbytes: int, now: float | None = None) -> None:
+        self._roll(time.monotonic() if now is None else now)
+        self.packets += 1
+        self.bytes += nbytes
+        self._windowPackets += 1
+        self._windowBytes += nbytes
+
+    def snapshot(self, now: float | None = None) -> dict:
+        self._roll(time.monotonic() if now is None else now)
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "packets_per_sec": round(self._pps, 3),
+            "bytes_per_sec": round(self._bps, 3),
+        }
+
+
+def EnableRxqOverflow(sock: socket.socket) -> bool:
+    # Ask the kernel to attach its drop counter to every received datagram
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        return True
+    except OSError:
+        return False
+
+
+def ParseRxqOverflow(ancdata) -> int | None:
+    for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == SO_RXQ_OVFL and len(data) >= 4:
+            return struct.unpack("=I", data[:4])[0]
+    return None
+
+
+def ReadProcNetUdp(sock: socket.socket, path: str = PROC_NET_UDP) -> dict | None:
+    # Find our socket by inode and return its kernel receive queue and drop counter
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open(path) as f:
+            next(f)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 13 and fields[9] == inode:
+                    rx_queue = int(fields[4].split(":")[1], 16)
+                    return {"rx_queue_bytes": rx_queue, "drops": int(fields[12])}
+    except (OSError, ValueError, StopIteration):
+        pass
+    return None
+
+
+class UdpMetrics:
+    def __init__(self, window: float = 10.0) -> None:
+        self.window = window
+        self.lock = threading.Lock()
+        self.peers: dict = {}
+        self.malformed: Counter = Counter()
+        self.kernelDrops: int | None = None
+
+    def _peer(self, addr) -> dict:
+        if addr not in self.peers:
+            self.peers[addr] = {
+                "in": RateCounter(self.window),
+                "out": RateCounter(self.window),
+            }
+        return self.peers[addr]
+
+    def countIn(self, addr, nbytes: int) -> None:
+        with self.lock:
+            self._peer(addr)["in"].add(nbytes)
+
+    def countOut(self, addr, nbytes: int) -> None:
+        with self.lock:
+            self._peer(addr)["out"].add(nbytes)
+
+    def countMalformed(self, reason: str | None) -> None:
+        with self.lock:
+            self.malformed[reason or "unknown"] += 1
+
+    def snapshot(self, sock: socket.socket | None = None) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            peers = {
+                f"{addr[0]}:{addr[1]}": {
+                    "in": counters["in"].snapshot(now),
+                    "out": counters["out"].snapshot(now),
+                }
+                for addr, counters in self.peers.items()
+            }
+            malformed = dict(self.malformed)
+
+        kernel: dict = {"drops": self.kernelDrops, "rx_queue_bytes": None}
+        kernel["source"] = "SO_RXQ_OVFL" if self.kernelDrops is not None else None
+        if sock is not None and (proc := ReadProcNetUdp(sock)) is not None:
+            kernel["rx_queue_bytes"] = proc["rx_queue_bytes"]
+            if self.kernelDrops is None:
+                kernel["drops"] = proc["drops"]
+                kernel["source"] = PROC_NET_UDP
+
+        return {"kernel": kernel, "peers": peers, "malformed": malformed}
@@ -8,7 +8,10 @@ from typing_extensions import Buffer
 from crccheck.crc import Crc16Xmodem
 from enum import IntEnum
 import time
+import queue
+import signal
 import socket
+import sys
 import threading
 import struct
 import logging
@@ -17,11 +20,34 @@ import traceback
 
 from status import getPeerStatus, getRoomStatus, getDeviceStatus, getStatus
 from database import Database
+from udpMetrics import EnableRxqOverflow, ParseRxqOverflow, UdpMetrics
+from metrics import (
+    COLLECTOR,
+    CSEQ_RTT_SECONDS,
+    CSEQ_TIMEOUTS,
+    UDP_HANDLER_SECONDS,
+    UDP_PACKETS,
+)
+from profiling import PHASE_STATS, HotPathProfiler
+from packetTrace import HexDump, PacketTrace, RateLimitedLogger
+from scheduler import Scheduler
+from deadband import DeadbandRecorder
 
 logger = logging.getLogger(__name__)
 
 FAKEBOOST_TEMPERATURE_RISE = 6  # degC * 10
 FAKEBOOST_DURATION = 1800  # seconds
+FAKEBOOST_RETRY = 60  # seconds between attempts to revert an expired fake boost
+GET_PROG_INTERVAL = (
+    1  # seconds, embedded device may not handle lots of messages in a short time
+)
+
+#
+# Ingress tuning (see UdpServer.run)
+#
+UDP_QUEUE_SIZE = int(os.getenv("BESIM_UDP_QUEUE_SIZE", "256"))  # datagrams per worker
+UDP_WORKERS = int(os.getenv("BESIM_UDP_WORKERS", "2"))
+UDP_RCVBUF = int(os.getenv("BESIM_UDP_RCVBUF", "0"))  # bytes, 0 = kernel default
 
 
 class Unpacker:
@@ -243,7 +269,7 @@ UNUSED_CSEQ = 0xFF
 MAX_CSEQ = 0xFD
 
 
-def NextCSeq(device, wait=0):
+def NextCSeq(device, wait=0, msgType=None):
     current_cseq = device["cseq"]
     cseq = current_cseq + 1
     if cseq > MAX_CSEQ:
@@ -256,6 +282,8 @@ def NextCSeq(device, wait=0):
             "wait": wait,
             "ev": threading.Event(),
             "val": None,
+            "msg": MsgId(msgType).name if msgType is not None else "UNKNOWN",
+            "sent": time.perf_counter(),
         }
 
     return current_cseq
@@ -269,15 +297,20 @@ def LastCSeq(device):
 def WaitCSeq(device, cseq):
     if cseq in device["results"]:
         results = device["results"][cseq]
-        results["ev"].wait(results["wait"])
+        if not results["ev"].wait(results["wait"]):
+            CSEQ_TIMEOUTS.labels(results["msg"]).inc()
         del device["results"][cseq]
         return results["val"]
 
 
 def SignalCSeq(device, cseq, val):
     if cseq in device["results"]:
-        device["results"][cseq]["val"] = val
-        device["results"][cseq]["ev"].set()
+        results = device["results"][cseq]
+        results["val"] = val
+        results["ev"].set()
+        CSEQ_RTT_SECONDS.labels(results["msg"]).observe(
+            time.perf_counter() - results["sent"]
+        )
 
 
 #
@@ -296,6 +329,7 @@ class Frame:
     def __init__(self, payload: bytes | None = None) -> None:
         self.seq = None
         self.payload: bytes | None = payload
+        self.error: str | None = None  # Why decode() rejected the frame
 
     def encode(self, seq=0xFFFFFFFF) -> bytes:
         if self.payload is None:
@@ -308,15 +342,23 @@ class Frame:
         return buf
 
     def decode(self, data) -> bytes | None:
+        self.error = None
+        if len(data) < 12:
+            logger.warn(f"Invalid Length {len(data)}")
+            self.error = "length"
+            return None
+
         unpack = Unpacker(data)
         hdr, length, self.seq = unpack("<HHI")
 
         if hdr != MAGIC_HEADER:
             logger.warn(f"Invalid Header {hdr=:x}")
+            self.error = "header"
             return None
 
         if len(data) != length + 12:
             logger.warn(f"Invalid Length {length=} {len(data)}")
+            self.error = "length"
             return None
 
         self.payload = unpack.subbuf(length)
@@ -326,15 +368,33 @@ class Frame:
         crcCalc = Crc16Xmodem.calc(self.payload)
         if crcCalc != crc:
             logger.warn(f"Invalid CRC got {crc=:x} {crcCalc=:x}")
+            self.error = "crc"
             return None
 
         if ftr != MAGIC_FOOTER:
             logger.warn(f"Invalid Footer {ftr=:x}")
+            self.error = "footer"
             return None
 
         return self.payload
 
 
+def PeekDeviceId(data: bytes) -> int | None:
+    # The deviceid follows the frame header (8 bytes), the wrapper header (4 bytes)
+    # and cseq/unk1/unk2 (4 bytes) in every message we know about
+    if len(data) < 20:
+        return None
+    hdr, deviceid = struct.unpack_from("<H14xI", data)
+    if hdr != MAGIC_HEADER:
+        return None
+    return deviceid
+
+
+def PeekMsgId(data: bytes) -> str:
+    # The message type is the first byte of the wrapper, after the frame header
+    return MsgId(data[8]).name if len(data) > 8 else MsgId.UNKNOWN_ID.name
+
+
 #
 # The payload in the frame (see Frame()) uses the following wrapper
 # for all the protocol messages
@@ -440,6 +500,20 @@ class Wrapper:
 #
 
 
+def StopOnSigterm(*servers: "UdpServer", timeout: float = 10.0) -> None:
+    # For the entrypoint: s6 stops the addon with SIGTERM, which by default
+    # kills python before anything queued is written. The servers handle the
+    # datagrams they already got, then closing the database writes out the
+    # rollups, the ring buffers and the write queue
+    def stop(signum, frame):
+        for server in servers:
+            server.shutdown(timeout)
+        Database().close()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+
 class UdpServer(threading.Thread):
     MAX_DATA = 4096
 
@@ -447,37 +521,166 @@ class UdpServer(threading.Thread):
         self,
         addr,
         datalog: Optional[io.TextIOWrapper] = None,
+        queueSize: int = UDP_QUEUE_SIZE,
+        workers: int = UDP_WORKERS,
+        rcvbuf: int = UDP_RCVBUF,
     ):
         threading.Thread.__init__(self)
         self.addr = addr
         self.stop = False
         self.db = Database()
         self.datalog: io.TextIOWrapper | None = datalog
+        self.datalogLock = threading.Lock()
+        self.sock: socket.socket | None = None
+
+        # The receive loop only drains the socket into these queues. Each worker
+        # owns one queue, and datagrams are sharded by deviceid so that the
+        # messages of a device are always handled in order by the same worker.
+        self.queueSize = queueSize
+        self.rcvbuf = rcvbuf
+        self.queues: list[queue.Queue] = [
+            queue.Queue(maxsize=queueSize) for _ in range(max(1, workers))
+        ]
+        self.received = 0
+        self.dropped = 0
+        self.metrics = UdpMetrics()
+        self.profiler = HotPathProfiler()
+        self.trace = PacketTrace()
+        self.unexpected = RateLimitedLogger(logger)
+        self.scheduler = Scheduler()
+        self.recorder = DeadbandRecorder()
+        self.workers: list[threading.Thread] = []
 
     def run(self):
         logger.info("UDP server is running")
-        self.dbConn = self.db.get_connection()
         self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.rcvbuf > 0:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
         self.sock.bind(self.addr)
+        rxqOverflow = EnableRxqOverflow(self.sock)
+        COLLECTOR.udpServer = self
+        self.scheduler.start()
+
+        self.workers = [
+            threading.Thread(
+                target=self.worker, args=(q,), name=f"udp-worker-{index}", daemon=True
+            )
+            for index, q in enumerate(self.queues)
+        ]
+        for worker in self.workers:
+            worker.start()
+        logger.info(
+            f"UDP ingress: {len(self.queues)} workers, {self.queueSize} datagrams per queue, SO_RCVBUF={self.getRcvBuf()}"
+        )
 
         while not self.stop:
-            data, addr = self.sock.recvfrom(self.MAX_DATA)
-            logger.info(f"From {addr} {len(data)} bytes : {hexdump.dump(data)}")
+            if rxqOverflow:
+                data, ancdata, _, addr = self.sock.recvmsg(
+                    self.MAX_DATA, socket.CMSG_SPACE(4)
+                )
+                if (drops := ParseRxqOverflow(ancdata)) is not None:
+                    self.metrics.kernelDrops = drops
+            else:
+                data, addr = self.sock.recvfrom(self.MAX_DATA)
+            if self.stop:
+                break
+            self.metrics.countIn(addr, len(data))
+            self.trace.record("in", addr, data)
+            self.enqueue(data, addr)
+
+        for q in self.queues:
+            q.put(None)
+        # The datagrams already queued are handled (and logged) before exiting
+        for worker in self.workers:
+            worker.join()
+        self.scheduler.stop()
+        self.sock.close()
+
+    def shutdown(self, timeout: float | None = None) -> None:
+        self.stop = True
+        if self.sock is not None and self.sock.fileno() >= 0:
+            # Wakes up the receive loop
+            host, port = self.sock.getsockname()[:2]
+            with socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM) as wake:
+                wake.sendto(b"", ("127.0.0.1" if host == "0.0.0.0" else host, port))
+        if self.is_alive():
+            self.join(timeout)
+
+    def enqueue(self, data: bytes, addr) -> bool:
+        self.received += 1
+        try:
+            self.queues[self.shardOf(data, addr)].put_nowait((data, addr))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(
+                    f"UDP ingress queue full, {self.dropped} datagrams dropped so far"
+                )
+            return False
+
+    def worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            data, addr = item
+            logger.info("From %s %d bytes : %s", addr, len(data), HexDump(data))
+            start = time.perf_counter()
+            PHASE_STATS.begin()
+            msg = None
             try:
-                self.handleMsg(data, addr)
+                msg = self.profiler.runcall(self.handleMsg, data, addr)
             except Exception:
                 logger.error(traceback.format_exc())
-                time.sleep(1)
+            finally:
+                PHASE_STATS.end(msg or "INVALID")
+                UDP_HANDLER_SECONDS.labels(msg or "INVALID").observe(
+                    time.perf_counter() - start
+                )
+
+    def shardOf(self, data: bytes, addr) -> int:
+        deviceid = PeekDeviceId(data)
+        return hash(deviceid if deviceid is not None else addr) % len(self.queues)
+
+    def getRcvBuf(self) -> int | None:
+        if self.sock is None:
+            return None
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def getIngressStats(self) -> dict:
+        depths = [q.qsize() for q in self.queues]
+        return {
+            "workers": len(self.queues),
+            "queue_size": self.queueSize,
+            "queue_depth": sum(depths),
+            "queue_depth_per_worker": depths,
+            "received": self.received,
+            "dropped": self.dropped,
+            "rcvbuf": self.getRcvBuf(),
+        }
+
+    def getMetrics(self) -> dict:
+        return {
+            "ingress": self.getIngressStats(),
+            "scheduler": self.scheduler.getStats(),
+            "recorder": self.recorder.getStats(),
+        } | self.metrics.snapshot(self.sock)
 
     def sendto(self, data, address) -> int:
-        if self.datalog is not None:
-            self.datalog.write(
-                f'"O","{address}","{hexdump.dump(data, sep='')}"\r\n'
-            )
-            self.datalog.flush()
-            os.fsync(self.datalog)
-        return self.sock.sendto(data, address)
+        with PHASE_STATS.phase("send"):
+            if self.datalog is not None:
+                with self.datalogLock:
+                    self.datalog.write(
+                        f'"O","{address}","{hexdump.dump(data, sep='')}"\r\n'
+                    )
+                    self.datalog.flush()
+                    os.fsync(self.datalog)
+            self.metrics.countOut(address, len(data))
+            self.trace.record("out", address, data)
+            UDP_PACKETS.labels(PeekMsgId(data), "out").inc()
+            return self.sock.sendto(data, address)  # type: ignore
 
     def send_PING(self, addr, deviceid, response=0):
         cseq = UNUSED_CSEQ
@@ -487,38 +690,38 @@ class UdpServer(threading.Thread):
         payload = struct.pack("<BBHIH", cseq, unk1, unk2, deviceid, unk3)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.PING, response, write=1)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
 
     def send_GET_PROG(self, addr, device, deviceid, room, response=0, wait=0):
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, MsgId.GET_PROG)
         unk1 = 0x0  # Always zero in DL
         unk2 = 0x0
         unk3 = 0x800FE0
         payload = struct.pack("<BBHIII", cseq, unk1, unk2, deviceid, room, unk3)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.GET_PROG, response, write=0)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
     def send_SWVERSION(self, addr, device, deviceid, response=0, wait=0):
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, MsgId.SWVERSION)
         unk1 = 0x0  # Always zero in DL
         unk2 = 0x0
         payload = struct.pack("<BBHI", cseq, unk1, unk2, deviceid)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.SWVERSION, response, write=0)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
@@ -533,10 +736,10 @@ class UdpServer(threading.Thread):
         )
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.PROGRAM, response, write=write)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
@@ -547,10 +750,10 @@ class UdpServer(threading.Thread):
         payload = struct.pack("<BBHII", cseq, unk1, unk2, deviceid, lastseen)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.STATUS, response, write=1)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
 
     def send_SET(
@@ -569,7 +772,7 @@ class UdpServer(threading.Thread):
         logger.info(
             f"send_SET addr={addr} deviceid={deviceid} room={room} msgType={msgType} value={value}"
         )
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, msgType)
         flags = 0x0  # Always zero in DL
         unk2 = 0x0
         payload = struct.pack("<BBHII", cseq, flags, unk2, deviceid, room)
@@ -589,48 +792,48 @@ class UdpServer(threading.Thread):
 
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(msgType, response, write=write)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
     def send_REFRESH(self, addr, device, deviceid, response=0, wait=0):
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, MsgId.REFRESH)
         unk1 = 0x0  # Always zero in DL
         unk2 = 0x0
         payload = struct.pack("<BBHI", cseq, unk1, unk2, deviceid)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.REFRESH, response, write=0)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
     def send_OUTSIDE_TEMP(
         self, addr, device, deviceid, val, response=0, write=0, wait=0
     ):
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, MsgId.OUTSIDE_TEMP)
         unk1 = 0x0  # Always zero in DL
         unk2 = 0x0
         unk3 = val  # External Temperature Management 0 = off 1 = boiler 2 = web
         payload = struct.pack("<BBHIB", cseq, unk1, unk2, deviceid, unk3)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.OUTSIDE_TEMP, response, write=write)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
     def send_DEVICE_TIME(
         self, addr, device, deviceid, val, response=0, write=0, wait=0
     ):
-        cseq = NextCSeq(device, wait)
+        cseq = NextCSeq(device, wait, MsgId.DEVICE_TIME)
         unk1 = 0x0  # Always zero in DL
         unk2 = 0x0
         unk3 = val  # 1 = DST?
@@ -638,10 +841,10 @@ class UdpServer(threading.Thread):
         payload = struct.pack("<BBHIII", cseq, unk1, unk2, deviceid, unk3, unk4)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.DEVICE_TIME, response, write=write)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
         return WaitCSeq(device, cseq)
 
@@ -653,10 +856,10 @@ class UdpServer(threading.Thread):
         payload = struct.pack("<BBHIIH", cseq, unk1, unk2, deviceid, room, unk3)
         wrapper = Wrapper(payload=payload)
         payload = wrapper.encodeDL(MsgId.PROG_END, response, write=0)
-        logger.info(f"Sending {wrapper}")
+        logger.info("Sending %s", wrapper)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        logger.info("To %s %d bytes : %s", addr, len(buf), HexDump(buf))
         self.sendto(buf, addr)
 
     def send_FAKE_BOOST(self, addr, device, deviceid, room, val):
@@ -697,6 +900,7 @@ class UdpServer(threading.Thread):
                     )
                     if rc == 0:
                         roomStatus["fakeboost"] = 0
+                        self.scheduler.cancel(("fakeboost", deviceid, room))
                     return rc
             elif (
                 val == 1
@@ -733,9 +937,43 @@ class UdpServer(threading.Thread):
                     if rc != 3:
                         return 0
                     roomStatus["fakeboost"] = time.time() + FAKEBOOST_DURATION
+                    self.scheduler.schedule(
+                        ("fakeboost", deviceid, room),
+                        FAKEBOOST_DURATION,
+                        self.expireFakeBoost,
+                        deviceid,
+                        room,
+                    )
                     return 1
         return 0
 
+    def expireFakeBoost(self, deviceid, room):
+        # Runs in the scheduler pool, as send_FAKE_BOOST blocks waiting for the device
+        device = getDeviceStatus(deviceid)
+        roomStatus = getRoomStatus(deviceid, room)
+        if roomStatus.get("fakeboost", 0) == 0:
+            return
+        if roomStatus.get("mode") != HeatingMode.PARTY:
+            # Mode was changed on the thermostat, nothing to revert
+            logger.info("Fake boost of %s room %s dropped", deviceid, room)
+            roomStatus["fakeboost"] = 0
+            return
+        self.send_FAKE_BOOST(device.get("addr"), device, deviceid, room, 0)
+        if roomStatus["fakeboost"] != 0:
+            logger.warning(
+                "Fake boost revert of %s room %s failed, retry in %ds",
+                deviceid,
+                room,
+                FAKEBOOST_RETRY,
+            )
+            self.scheduler.schedule(
+                ("fakeboost", deviceid, room),
+                FAKEBOOST_RETRY,
+                self.expireFakeBoost,
+                deviceid,
+                room,
+            )
+
     def set_messages_payload_size(self, msgType):
         if msgType in [
             MsgId.SET_T3,
@@ -759,15 +997,16 @@ class UdpServer(threading.Thread):
 
     def handleMsg(self, data, addr) -> str:
 
-       
         if self.datalog is not None:
-            self.datalog.write(f'"I","{addr}","{hexdump.dump(data, sep='')}"\r\n')
-            self.datalog.flush()
-            os.fsync(self.datalog)
+            with self.datalogLock:
+                self.datalog.write(f'"I","{addr}","{hexdump.dump(data, sep='')}"\r\n')
+                self.datalog.flush()
+                os.fsync(self.datalog)
 
         frame = Frame()
         payload: bytes | None = frame.decode(data)
         if payload is None:
+            self.metrics.countMalformed(frame.error)
             return ""
         seq = frame.seq
         length: int = len(payload)
@@ -779,15 +1018,19 @@ class UdpServer(threading.Thread):
 
         wrapper = Wrapper()
         payload = wrapper.decodeUL(payload)
+        PHASE_STATS.mark("decode")
+        UDP_PACKETS.labels(MsgId(wrapper.msgType).name, "in").inc()
 
         msgLen = len(payload)
-        logger.info(f"{seq=} {wrapper} {length=} {msgLen=}")
+        logger.info("seq=%r %s length=%r msgLen=%r", seq, wrapper, length, msgLen)
 
         unpack = Unpacker(payload)
 
         if wrapper.msgType == MsgId.STATUS:
             cseq, unk1, unk2, deviceid = unpack("<BBHI")
-            logger.info(f"{cseq=:x} {unk1=:x} {unk2=:x} {deviceid=}")
+            logger.info(
+                "cseq=%x unk1=%x unk2=%x deviceid=%r", cseq, unk1, unk2, deviceid
+            )
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             rooms_to_get_prog = (
@@ -811,15 +1054,18 @@ class UdpServer(threading.Thread):
 
                 # Assume that if room is zero, 0xffffffff or byte1 is zero, then no thermostat is connected for that room
                 if room != 0 and room != 0xFFFFFFFF and byte1 != 0:
-                    logger.info(
-                        f"{room=:x} {byte1=:x} {mode=} {unk9=} {temp=} {settemp=} {t3=} {t2=} {t1=} {maxsetp=} {minsetp=} {sensorinfluence=} {units=} {advance=} {boost=} {cmdissued=} {winter=} {tempcurve=} {heatingsetp=}"
-                    )
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(
+                            f"{room=:x} {byte1=:x} {mode=} {unk9=} {temp=} {settemp=} {t3=} {t2=} {t1=} {maxsetp=} {minsetp=} {sensorinfluence=} {units=} {advance=} {boost=} {cmdissued=} {winter=} {tempcurve=} {heatingsetp=}"
+                        )
                     if byte1 == 0x8F:
                         heating = 1
                     elif byte1 == 0x83:
                         heating = 0
                     else:
-                        logger.warn(f"Unexpected {byte1=:x}")
+                        self.unexpected.warning(
+                            (deviceid, "byte1"), "Unexpected byte1=%x", byte1
+                        )
                         heating = None
 
                     roomStatus = getRoomStatus(deviceid, room)
@@ -844,11 +1090,16 @@ class UdpServer(threading.Thread):
                     roomStatus["lastseen"] = int(time.time())
 
                     if self.db is not None:
+                        self.db.rollup_temperature(
+                            room, temp / 10.0, settemp / 10.0, heating
+                        )
+                    if self.db is not None and self.recorder.accept(
+                        room, temp / 10.0, settemp / 10.0, heating
+                    ):
                         # @todo log other parameters..
                         self.db.log_temperature(
-                            room, temp / 10.0, settemp / 10.0, heating, conn=self.dbConn
+                            room, temp / 10.0, settemp / 10.0, heating
                         )
-                        self.dbConn.commit()
 
                     if len(roomStatus["days"]) != 7 or wrapper.cloudsynclost:
                         rooms_to_get_prog.add(room)
@@ -859,14 +1110,16 @@ class UdpServer(threading.Thread):
                             roomStatus["fakeboost"] != 0
                             and roomStatus["fakeboost"] < time.time()
                         ):
-                            # Call send_FAKE_BOOST but this needs to be done from a new thread
-                            # because it is blocking.
-                            # self.send_FAKE_BOOST(addr,deviceStatus,deviceid,room,0)
-                            thread = threading.Thread(
-                                target=self.send_FAKE_BOOST,
-                                args=(addr, deviceStatus, deviceid, room, 0),
+                            # Normally already scheduled by send_FAKE_BOOST, this
+                            # only catches boosts the scheduler doesn't know about
+                            self.scheduler.schedule(
+                                ("fakeboost", deviceid, room),
+                                0,
+                                self.expireFakeBoost,
+                                deviceid,
+                                room,
+                                replace=False,
                             )
-                            thread.start()
                     else:
                         roomStatus["fakeboost"] = 0
 
@@ -908,35 +1161,42 @@ class UdpServer(threading.Thread):
             deviceStatus["wifisignal"] = wifisignal
             deviceStatus["lastseen"] = int(time.time())
 
-            logger.info(getStatus())
+            logger.info("%s", getStatus())
 
             # Send a DL STATUS message
             self.send_STATUS(addr, deviceid, deviceStatus["lastseen"], response=1)
 
-            # Fetch updated program for any rooms in rooms_to_get_prog set
-            for room in rooms_to_get_prog:
-                time.sleep(
-                    1
-                )  # embedded device may not handle lots of messages in a short time
-                self.send_GET_PROG(addr, deviceStatus, deviceid, room, response=0)
+            # Fetch updated program for any rooms in rooms_to_get_prog set, spaced
+            # out without holding this worker
+            for index, room in enumerate(sorted(rooms_to_get_prog), start=1):
+                self.scheduler.schedule(
+                    ("getprog", deviceid, room),
+                    index * GET_PROG_INTERVAL,
+                    self.send_GET_PROG,
+                    addr,
+                    deviceStatus,
+                    deviceid,
+                    room,
+                    replace=False,
+                )
 
         elif wrapper.msgType == MsgId.GET_PROG:
             cseq, unk1, unk2, deviceid, room, unk3 = unpack("<BBHIII")
 
-            logger.info(f"{deviceid=} {room=}")
+            logger.info("deviceid=%r room=%r", deviceid, room)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=:x}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%x", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if unk3 != 0x800FE0:
-                logger.warn(f"Unexpected {unk3=:x}")
+                self.unexpected.warning((deviceid, "unk3"), "Unexpected unk3=%x", unk3)
 
             if wrapper.response:
                 SignalCSeq(
@@ -946,21 +1206,21 @@ class UdpServer(threading.Thread):
         elif wrapper.msgType == MsgId.PING:
             cseq, unk1, unk2, deviceid, unk3 = unpack("<BBHIH")
 
-            logger.info(f"{deviceid=}")
+            logger.info("deviceid=%r", deviceid)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             # on uplink unk2 is usually 4, but can be zero (when out of sync?)
             if unk2 not in [4, 0]:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if unk3 != 1:
-                logger.warn(f"Unexpected {unk3=:x}")
+                self.unexpected.warning((deviceid, "unk3"), "Unexpected unk3=%x", unk3)
 
             # Send a DL PING message
             self.send_PING(addr, deviceid, response=1)
@@ -968,17 +1228,17 @@ class UdpServer(threading.Thread):
         elif wrapper.msgType == MsgId.REFRESH:
             cseq, unk1, unk2, deviceid = unpack("<BBHI")
             # Padding at end ??
-            logger.info(f"{deviceid=}")
+            logger.info("deviceid=%r", deviceid)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if wrapper.response:
                 SignalCSeq(
@@ -990,26 +1250,26 @@ class UdpServer(threading.Thread):
             # 0 = no dst 1 = dst ?
             # The rest of the payload appears to be garbage?
             cseq, unk1, unk2, deviceid, val, unk3, unk4, unk5 = unpack("<BBHIBBHI")
-            logger.info(f"{deviceid=} {val=}")
+            logger.info("deviceid=%r val=%r", deviceid, val)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if unk3 != 0x0:
-                logger.warn(f"Unexpected {unk3=:x}")
+                self.unexpected.warning((deviceid, "unk3"), "Unexpected unk3=%x", unk3)
 
             if unk4 != 0x0:
-                logger.warn(f"Unexpected {unk4=:x}")
+                self.unexpected.warning((deviceid, "unk4"), "Unexpected unk4=%x", unk4)
 
             if unk5 != 0x0:
-                logger.warn(f"Unexpected {unk5=:x}")
+                self.unexpected.warning((deviceid, "unk5"), "Unexpected unk5=%x", unk5)
 
             if wrapper.response:
                 SignalCSeq(deviceStatus, cseq, val)
@@ -1017,17 +1277,17 @@ class UdpServer(threading.Thread):
         elif wrapper.msgType == MsgId.OUTSIDE_TEMP:
             cseq, unk1, unk2, deviceid, val = unpack("<BBHIB")
 
-            logger.info(f"{deviceid=} {val=}")
+            logger.info("deviceid=%r val=%r", deviceid, val)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             # val  = 0x0 means no external temperature management
             #        0x1 means boiler external temperature management
@@ -1038,20 +1298,20 @@ class UdpServer(threading.Thread):
 
         elif wrapper.msgType == MsgId.PROG_END:
             cseq, unk1, unk2, deviceid, room, unk3 = unpack("<BBHIIH")
-            logger.info(f"{deviceid=} {room=} {unk3=:x}")
+            logger.info("deviceid=%r room=%r unk3=%x", deviceid, room, unk3)
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if unk3 != 0xA14:
-                logger.warn(f"Unexpected {unk3=:x}")
+                self.unexpected.warning((deviceid, "unk3"), "Unexpected unk3=%x", unk3)
 
             # Send a PROG_END
             if wrapper.response != 1:
@@ -1059,18 +1319,18 @@ class UdpServer(threading.Thread):
 
         elif wrapper.msgType == MsgId.SWVERSION:
             cseq, unk1, unk2, deviceid, version = unpack("<BBHI13s")
-            logger.info(f"{deviceid=} {version=}")
+            logger.info("deviceid=%r version=%r", deviceid, version)
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             deviceStatus["version"] = str(version)
 
             if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if wrapper.response != 1:
                 self.send_SWVERSION(addr, deviceStatus, deviceid, response=1)
@@ -1083,21 +1343,24 @@ class UdpServer(threading.Thread):
             for _ in range(24):
                 (p,) = unpack("<B")
                 prog.append(p)
-            logger.info(f"{deviceid=} {room=} {day=} prog={ [ hex(l) for l in prog ] }")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    f"{deviceid=} {room=} {day=} prog={ [ hex(l) for l in prog ] }"
+                )
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             roomStatus = getRoomStatus(deviceid, room)
             roomStatus["days"][day] = prog
-            logger.info(getStatus())
+            logger.info("%s", getStatus())
 
             if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+                self.unexpected.warning((deviceid, "cseq"), "Unexpected cseq=%s", cseq)
 
             if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+                self.unexpected.warning((deviceid, "unk1"), "Unexpected unk1=%x", unk1)
 
             if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             # Send a DL PROGRAM message
             if wrapper.response != 1:
@@ -1125,7 +1388,9 @@ class UdpServer(threading.Thread):
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             roomStatus = getRoomStatus(deviceid, room)
 
-            logger.info(f"{cseq=} {deviceid=} {room=} {value=}")
+            logger.info(
+                "cseq=%r deviceid=%r room=%r value=%r", cseq, deviceid, room, value
+            )
 
             # Update the device status with the updated value
             if wrapper.msgType == MsgId.SET_T1:
@@ -1152,13 +1417,17 @@ class UdpServer(threading.Thread):
                 roomStatus["tempcurve"] = value
 
             if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+                self.unexpected.warning((deviceid, "unk2"), "Unexpected unk2=%x", unk2)
 
             if wrapper.downlink and flags != 0x0:
-                logger.warn(f"Unexpected {flags=:x} for downlink")
+                self.unexpected.warning(
+                    (deviceid, "flags"), "Unexpected flags=%x for downlink", flags
+                )
 
             if not wrapper.downlink and flags not in [0x0, 0x2]:
-                logger.warn(f"Unexpected {flags=:x} for uplink")
+                self.unexpected.warning(
+                    (deviceid, "flags"), "Unexpected flags=%x for uplink", flags
+                )
 
             # Send a DL SET message if this was initiated by the device
             if value is not None: